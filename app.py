@@ -1,546 +1,498 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 import os
+import time
+import cProfile
+import threading
 import datetime
-import json
-import uuid
+from collections import OrderedDict
+from functools import wraps
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
 import requests
 from typing import List, Dict
 from dotenv import load_dotenv
 import openai
 
+import json_codec
+from storage import DATA_DIR, InvalidCursor, project_fields
+from note_store import NoteStore
+from stores import ChatStore, ProjectStore, TodoStore
+from models import Note, Project, Session, Task, Todo
+from workspace import FORMATS as WORKSPACE_FORMATS, Workspace
+from global_search import TYPES as SEARCH_TYPES, GlobalSearch
+from intents import IntentMatcher
+from changes import open_change_feed
+from metrics import HTTP_REQUEST_BYTES, HTTP_REQUEST_SECONDS, HTTP_RESPONSE_BYTES, UPSTREAM_SECONDS, registry
+from http_cache import (ResponseBodyCache, accepted_encodings, choose_encoding, compress, etag_matches,
+                        make_etag)
+from llm_client import CompletionClient, ResponseCache, estimate_tokens, message_tokens, trim_to_budget
+
 # 加载环境变量
 load_dotenv()
 
-app = Flask(__name__, static_folder='static')
+class CodecJSONProvider(DefaultJSONProvider):
+    """用 json_codec（安装了 orjson 时为 orjson）序列化响应和解析请求体
 
-class NotebookAPI:
-    def __init__(self):
-        # 创建笔记存储目录
-        self.notes_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "notes")
-        if not os.path.exists(self.notes_dir):
-            os.makedirs(self.notes_dir)
-        
-        # 笔记索引文件
-        self.index_file = os.path.join(self.notes_dir, "index.json")
-        self.notes_index = self.load_index()
+    与默认实现一样按键排序；调试模式下缩进输出。
+    """
     
-    def load_index(self):
-        """加载笔记索引"""
-        if os.path.exists(self.index_file):
-            try:
-                with open(self.index_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return []
-        return []
-    
-    def save_index(self):
-        """保存笔记索引"""
-        with open(self.index_file, 'w', encoding='utf-8') as f:
-            json.dump(self.notes_index, f, ensure_ascii=False, indent=2)
-    
-    def create_note(self, title, content):
-        """创建新笔记"""
-        # 生成笔记ID和时间戳
-        timestamp = datetime.datetime.now()
-        note_id = str(uuid.uuid4())
-        
-        # 创建笔记文件
-        note_filename = f"{note_id}.txt"
-        note_path = os.path.join(self.notes_dir, note_filename)
-        
-        # 写入笔记内容
-        with open(note_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        
-        # 更新索引
-        note_info = {
-            'id': note_id,
-            'title': title,
-            'filename': note_filename,
-            'created_at': timestamp.isoformat(),
-            'updated_at': timestamp.isoformat()
-        }
-        
-        self.notes_index.append(note_info)
-        self.save_index()
-        
-        return note_info
-    
-    def list_notes(self):
-        """列出所有笔记"""
-        return sorted(self.notes_index, key=lambda x: x["created_at"], reverse=True)
-    
-    def get_note(self, note_id):
-        """获取指定笔记内容"""
-        for note in self.notes_index:
-            if note["id"] == note_id:
-                note_path = os.path.join(self.notes_dir, note["filename"])
-                if os.path.exists(note_path):
-                    with open(note_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    return {**note, "content": content}
-        return None
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return json_codec.dumps(obj, sort_keys=self.sort_keys, default=self.default)
     
-    def update_note(self, note_id, title, content):
-        """更新笔记"""
-        for i, note in enumerate(self.notes_index):
-            if note["id"] == note_id:
-                # 更新笔记内容
-                note_path = os.path.join(self.notes_dir, note["filename"])
-                if os.path.exists(note_path):
-                    with open(note_path, 'w', encoding='utf-8') as f:
-                        f.write(content)
-                    
-                    # 更新索引
-                    self.notes_index[i]["title"] = title
-                    self.notes_index[i]["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    self.save_index()
-                    return self.notes_index[i]
-        return None
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s)
     
-    def delete_note(self, note_id):
-        """删除笔记"""
-        for i, note in enumerate(self.notes_index):
-            if note["id"] == note_id:
-                # 删除笔记文件
-                note_path = os.path.join(self.notes_dir, note["filename"])
-                if os.path.exists(note_path):
-                    os.remove(note_path)
-                
-                # 更新索引
-                deleted_note = self.notes_index.pop(i)
-                self.save_index()
-                return deleted_note
-        return None
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        body = json_codec.dumps_bytes(obj, pretty=pretty, sort_keys=self.sort_keys, default=self.default)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+app = Flask(__name__, static_folder='static')
+app.json = CodecJSONProvider(app)
+
+# 变更序列：各API的修改方法在这里记录新建、修改、删除事件，供 /api/changes 推送
+change_feed = open_change_feed()
+
+# 按请求头 X-Profile 对单个请求做 cProfile 分析（需设置 PROFILE_REQUESTS=true）
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', '').lower() in ('true', '1', 'yes')
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(DATA_DIR, "profiles"))
 
-class TodoAPI:
-    def __init__(self):
-        # 创建待办存储目录
-        self.todos_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "todos")
-        if not os.path.exists(self.todos_dir):
-            os.makedirs(self.todos_dir)
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILE_REQUESTS and request.headers.get('X-Profile'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+# 最先注册的 after_request 最后执行，记录的是压缩后的响应大小
+@app.after_request
+def record_request_metrics(response):
+    """记录请求耗时和请求/响应大小，按路由模板聚合"""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                     route=route, status=response.status_code)
+    if request.content_length:
+        HTTP_REQUEST_BYTES.observe(request.content_length, method=request.method, route=route)
+    if not response.is_streamed and not response.direct_passthrough:
+        HTTP_RESPONSE_BYTES.observe(response.calculate_content_length() or 0,
+                                    method=request.method, route=route)
+    
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'index'
+        path = os.path.join(PROFILE_DIR, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{name}.prof")
+        profiler.dump_stats(path)
+        response.headers['X-Profile-File'] = os.path.basename(path)
+    return response
+
+class ChatAPI(ChatStore):
+    """聊天：在 ChatStore 的基础上构建会话上下文、调用AI服务"""
+
+    def __init__(self, change_feed=None):
+        super().__init__(change_feed)
+        # 上下文的token预算；超出预算的较早消息滚动汇总为摘要（CHAT_SUMMARY_TOKENS 为0时直接丢弃）
+        self.context_tokens = int(os.getenv('CHAT_CONTEXT_TOKENS', 1500))
+        self.summary_tokens = int(os.getenv('CHAT_SUMMARY_TOKENS', 300))
+        # 不使用会话时最多取客户端 history 中最近的几条消息作为上下文
+        self.history_messages = int(os.getenv('CHAT_HISTORY_MESSAGES', 5))
+        # 最近使用的 CHAT_CONTEXT_CACHE 个会话尚未汇总的消息缓存在内存中，
+        # 构建上下文时只读取上次之后新增的消息（所有会话共用一个读取位置）
+        self.context_cache_size = int(os.getenv('CHAT_CONTEXT_CACHE', 256))
+        self._contexts = OrderedDict()  # 会话id -> {消息id: 消息}，尚未汇总的消息（按时间顺序）
+        self._contexts_seen = None  # 缓存已读到的最后一条消息的id
+        self._contexts_mutex = threading.Lock()
+        # 正在后台生成摘要的会话
+        self._summarizing = set()
         
-        # 待办索引文件
-        self.index_file = os.path.join(self.todos_dir, "todos.json")
-        self.todos_index = self.load_index()
+        # 备用回复的意图配置
+        self.intents = IntentMatcher(
+            os.getenv('INTENTS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents.json")),
+            check_interval=float(os.getenv('INTENTS_RELOAD_INTERVAL', 2))
+        )
         
-        # 如果没有待办事项，创建默认示例数据
-        if not self.todos_index:
-            self.create_default_todos()
+        # AI服务配置（这里使用模拟回复，实际使用时需要配置真实的AI服务）
+        self.ai_service_enabled = False
+        self.openai_api_key = os.getenv('OPENAI_API_KEY')
+        self.client = None
+        if self.openai_api_key:
+            self.ai_service_enabled = True
+            # 连接池复用 keep-alive 连接；并发上限、重试次数和退避时间可通过环境变量配置
+            self.client = CompletionClient(
+                self.openai_api_key,
+                base_url=os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1'),
+                model=os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
+                pool_size=int(os.getenv('CHAT_POOL_SIZE', 10)),
+                max_concurrency=int(os.getenv('CHAT_MAX_CONCURRENCY', 8)),
+                max_retries=int(os.getenv('CHAT_MAX_RETRIES', 2)),
+                backoff=float(os.getenv('CHAT_RETRY_BACKOFF', 0.5)),
+                timeout=float(os.getenv('CHAT_TIMEOUT', 30)),
+                cache=self._create_cache()
+            )
     
-    def load_index(self):
-        """加载待办索引"""
-        if os.path.exists(self.index_file):
-            try:
-                with open(self.index_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return []
-        return []
-    
-    def save_index(self):
-        """保存待办索引"""
-        with open(self.index_file, 'w', encoding='utf-8') as f:
-            json.dump(self.todos_index, f, ensure_ascii=False, indent=2)
-    
-    def create_default_todos(self):
-        """创建默认待办示例数据"""
-        default_todos = [
-            {"title": "完成项目文档", "completed": False},
-            {"title": "学习新技术", "completed": False},
-            {"title": "整理代码库", "completed": True},
-            {"title": "准备会议材料", "completed": False},
-            {"title": "回复重要邮件", "completed": True}
-        ]
-        
-        for todo_data in default_todos:
-            self.create_todo(todo_data["title"], todo_data["completed"])
+    def _create_cache(self):
+        """创建回复缓存，CHAT_CACHE_SIZE 或 CHAT_CACHE_TTL 为0时不缓存"""
+        capacity = int(os.getenv('CHAT_CACHE_SIZE', 512))
+        ttl = float(os.getenv('CHAT_CACHE_TTL', 300))
+        if capacity <= 0 or ttl <= 0:
+            return None
+        return ResponseCache(capacity=capacity, ttl=ttl)
     
-    def create_todo(self, title, completed=False):
-        """创建新待办"""
-        timestamp = datetime.datetime.now()
-        todo_id = str(uuid.uuid4())
-        
-        todo_info = {
-            "id": todo_id,
-            "title": title,
-            "completed": completed,
-            "created_at": timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        
-        if completed:
-            todo_info["completed_at"] = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        
-        self.todos_index.append(todo_info)
-        self.save_index()
-        
-        return todo_info
-    
-    def list_todos(self):
-        """列出所有待办"""
-        return sorted(self.todos_index, key=lambda x: x["created_at"], reverse=True)
-    
-    def update_todo(self, todo_id, title=None, completed=None):
-        """更新待办"""
-        for i, todo in enumerate(self.todos_index):
-            if todo["id"] == todo_id:
-                if title is not None:
-                    self.todos_index[i]["title"] = title
-                
-                if completed is not None:
-                    self.todos_index[i]["completed"] = completed
-                    if completed:
-                        self.todos_index[i]["completed_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    else:
-                        self.todos_index[i].pop("completed_at", None)
-                
-                self.todos_index[i]["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.save_index()
-                return self.todos_index[i]
-        return None
+    def cache_stats(self):
+        """回复缓存的命中统计"""
+        if self.client is None or self.client.cache is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.client.cache.stats()}
     
-    def delete_todo(self, todo_id):
-        """删除待办"""
-        for i, todo in enumerate(self.todos_index):
-            if todo["id"] == todo_id:
-                deleted_todo = self.todos_index.pop(i)
-                self.save_index()
-                return deleted_todo
-        return None
+    def delete_session(self, session_id):
+        """删除会话（消息仍保留在聊天历史中），同时丢弃缓存的上下文"""
+        if not super().delete_session(session_id):
+            return False
+        with self._contexts_mutex:
+            self._contexts.pop(session_id, None)
+        return True
+    
+    def build_context(self, session_id, save_summary=False):
+        """根据存储的会话历史构建发送给AI服务的消息列表，返回 (消息列表, token数)
 
-class ProjectAPI:
-    def __init__(self):
-        # 创建项目存储目录
-        self.projects_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "projects")
-        if not os.path.exists(self.projects_dir):
-            os.makedirs(self.projects_dir)
-        
-        # 项目索引文件
-        self.index_file = os.path.join(self.projects_dir, "projects.json")
-        self.projects_index = self.load_index()
+        从最新的消息往前取，直到用完token预算（启用摘要时预留摘要的预算）；
+        更早且尚未汇总的消息与已有摘要合并为新的摘要。save_summary 为真时（发送聊天请求）
+        把新的摘要保存在会话中，之后的请求直接复用：有AI服务时摘要在后台生成，生成完成之前的请求
+        使用原来的摘要（移出窗口的消息暂不计入）。为假时只预览，不写入任何数据：没有AI服务时
+        在内存中截取生成摘要，否则使用原来的摘要。
+        """
+        session = self.get_session(session_id)
+        if session is None:
+            return [], 0
+        summarize = self.summary_tokens > 0
+        budget = self.context_tokens - (self.summary_tokens if summarize else 0)
+        summary = session.get('summary')
+        summary_until = session.get('summary_until')
         
-        # 任务存储目录
-        self.tasks_dir = os.path.join(self.projects_dir, "tasks")
-        if not os.path.exists(self.tasks_dir):
-            os.makedirs(self.tasks_dir)
-    
-    def load_index(self):
-        """加载项目索引"""
-        if os.path.exists(self.index_file):
-            try:
-                with open(self.index_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return []
-        return []
-    
-    def save_index(self):
-        """保存项目索引"""
-        with open(self.index_file, 'w', encoding='utf-8') as f:
-            json.dump(self.projects_index, f, ensure_ascii=False, indent=2)
-    
-    def create_project(self, name, description="", status="active"):
-        """创建新项目"""
-        timestamp = datetime.datetime.now()
-        project_id = str(uuid.uuid4())
-        
-        project_info = {
-            "id": project_id,
-            "name": name,
-            "description": description,
-            "status": status,
-            "created_at": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "updated_at": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "progress": 0
-        }
+        pending = self._session_messages(session, budget, summarize)
+        if summary_until:
+            # 其他进程或后台任务可能已经推进了摘要
+            pending = [message for message in pending if message['timestamp'] > summary_until]
         
-        self.projects_index.append(project_info)
-        self.save_index()
+        window = []
+        used = 0
+        for message in reversed(pending):
+            cost = message_tokens(message)
+            if window and used + cost > budget:
+                break
+            window.append(message)
+            used += cost
+        window.reverse()
+        overflow = pending[:len(pending) - len(window)]
         
-        # 创建项目任务文件
-        tasks_file = os.path.join(self.tasks_dir, f"{project_id}.json")
-        with open(tasks_file, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+        # 从缓存中移除已汇总的消息；不汇总时移出窗口的消息直接丢弃，汇总时保留到摘要保存之后
+        cutoff = overflow[-1]['timestamp'] if overflow and not summarize else summary_until
+        if cutoff:
+            self._trim_context(session_id, cutoff)
+        if overflow and summarize:
+            if save_summary:
+                summary = self._schedule_summary(session_id, summary, overflow) or summary
+            elif not self.ai_service_enabled:
+                summary = self._summarize(summary, overflow)
         
-        return project_info
+        messages = []
+        if summary and summarize:
+            messages.append({"role": "system", "content": f"此前对话的摘要：{summary}"})
+        messages += [{"role": m['role'], "content": m['content']} for m in window]
+        return messages, sum(message_tokens(m) for m in messages)
     
-    def list_projects(self):
-        """列出所有项目"""
-        return sorted(self.projects_index, key=lambda x: x["created_at"], reverse=True)
+    def _session_messages(self, session, budget, summarize):
+        """会话中尚未汇总的消息（按时间顺序），由缓存提供
+
+        先读取缓存的读取位置之后新增的消息分给已缓存的会话；会话不在缓存中时从最新的消息
+        往前读取一次，直到摘要覆盖到的位置（不汇总时到用完预算为止）。每个会话的缓存以消息id为键，
+        读锁不阻止其他进程追加消息，同一条消息可能既被往前读取又出现在之后新增的消息中，只保留一次。
+        """
+        session_id = session['id']
+        summary_until = session.get('summary_until')
+        with self.lock.read(), self._contexts_mutex:
+            contexts = self._contexts
+            try:
+                if self._contexts_seen is None:
+                    raise InvalidCursor(None)
+                for message in self.log.iter_forward(self._contexts_seen):
+                    self._contexts_seen = message['id']
+                    cached = contexts.get(message.get('session_id'))
+                    if cached is not None:
+                        cached.setdefault(message['id'], message)
+            except InvalidCursor:
+                # 第一次使用、聊天记录已被清空或读取位置已按保留策略删除：重新开始缓存
+                contexts.clear()
+                latest = self.log.recent(1)
+                self._contexts_seen = latest[0]['id'] if latest else None
+            
+            cached = contexts.get(session_id)
+            if cached is None:
+                recent = []
+                used = 0
+                for message in self.log.iter_reverse(created_from=session['created_at']):
+                    if message.get('session_id') != session_id:
+                        continue
+                    if summary_until and message['timestamp'] <= summary_until:
+                        break
+                    used += message_tokens(message)
+                    if not summarize and recent and used > budget:
+                        break
+                    recent.append(message)
+                cached = contexts[session_id] = {message['id']: message for message in reversed(recent)}
+                while len(contexts) > self.context_cache_size:
+                    contexts.popitem(last=False)
+            else:
+                contexts.move_to_end(session_id)
+            return list(cached.values())
     
-    def get_project(self, project_id):
-        """获取指定项目"""
-        for project in self.projects_index:
-            if project["id"] == project_id:
-                return project
+    def _schedule_summary(self, session_id, previous, overflow):
+        """把移出窗口的消息合并进摘要：有AI服务时在后台线程中生成（每个会话同时只有一个），返回None；
+        否则在本地截取生成并返回新的摘要"""
+        if not self.ai_service_enabled:
+            return self._save_summary(session_id, previous, overflow)
+        with self._contexts_mutex:
+            if session_id in self._summarizing:
+                return None
+            self._summarizing.add(session_id)
+        threading.Thread(target=self._save_summary, args=(session_id, previous, overflow), daemon=True).start()
         return None
     
-    def update_project(self, project_id, name=None, description=None, status=None):
-        """更新项目"""
-        for i, project in enumerate(self.projects_index):
-            if project["id"] == project_id:
-                if name is not None:
-                    self.projects_index[i]["name"] = name
-                if description is not None:
-                    self.projects_index[i]["description"] = description
-                if status is not None:
-                    self.projects_index[i]["status"] = status
-                
-                self.projects_index[i]["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.save_index()
-                return self.projects_index[i]
-        return None
+    def _save_summary(self, session_id, previous, overflow):
+        """生成摘要并保存在会话中，之后从缓存中移除已汇总的消息"""
+        until = overflow[-1]['timestamp']
+        try:
+            summary = self._summarize(previous, overflow)
+            with self.session_lock.write():
+                current = self.sessions.get(session_id)
+                if current is None or (current.get('summary_until') or '') >= until:
+                    return summary
+                current['summary'] = summary
+                current['summary_until'] = until
+                self.sessions.touch(current)
+                self.save_sessions(puts=[current])
+            self._trim_context(session_id, until)
+            return summary
+        finally:
+            with self._contexts_mutex:
+                self._summarizing.discard(session_id)
     
-    def delete_project(self, project_id):
-        """删除项目"""
-        for i, project in enumerate(self.projects_index):
-            if project["id"] == project_id:
-                # 删除项目任务文件
-                tasks_file = os.path.join(self.tasks_dir, f"{project_id}.json")
-                if os.path.exists(tasks_file):
-                    os.remove(tasks_file)
-                
-                # 更新索引
-                deleted_project = self.projects_index.pop(i)
-                self.save_index()
-                return deleted_project
-        return None
+    def _trim_context(self, session_id, until):
+        """从会话的缓存中移除时间不晚于 until 的消息"""
+        with self._contexts_mutex:
+            cached = self._contexts.get(session_id)
+            if cached and next(iter(cached.values()))['timestamp'] <= until:
+                self._contexts[session_id] = {key: m for key, m in cached.items() if m['timestamp'] > until}
     
-    def get_project_tasks(self, project_id):
-        """获取项目任务列表"""
-        tasks_file = os.path.join(self.tasks_dir, f"{project_id}.json")
-        if os.path.exists(tasks_file):
+    def _summarize(self, previous, messages):
+        """把已有摘要和新移出上下文窗口的消息合并为新的摘要"""
+        transcript = "\n".join(f"{'用户' if m['role'] == 'user' else '助手'}：{m['content']}" for m in messages)
+        if self.ai_service_enabled:
             try:
-                with open(tasks_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return []
-        return []
-    
-    def save_project_tasks(self, project_id, tasks):
-        """保存项目任务列表"""
-        tasks_file = os.path.join(self.tasks_dir, f"{project_id}.json")
-        with open(tasks_file, 'w', encoding='utf-8') as f:
-            json.dump(tasks, f, ensure_ascii=False, indent=2)
-        
-        # 更新项目进度
-        self.update_project_progress(project_id)
-    
-    def create_task(self, project_id, title, description="", status="pending", priority="medium", due_date=None):
-        """创建新任务"""
-        timestamp = datetime.datetime.now()
-        task_id = str(uuid.uuid4())
-        
-        task_info = {
-            "id": task_id,
-            "project_id": project_id,
-            "title": title,
-            "description": description,
-            "status": status,
-            "priority": priority,
-            "due_date": due_date,
-            "created_at": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "updated_at": timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        
-        if status == "completed":
-            task_info["completed_at"] = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        
-        tasks = self.get_project_tasks(project_id)
-        tasks.append(task_info)
-        self.save_project_tasks(project_id, tasks)
-        
-        return task_info
-    
-    def update_task(self, project_id, task_id, title=None, description=None, status=None, priority=None, due_date=None):
-        """更新任务"""
-        tasks = self.get_project_tasks(project_id)
-        
-        for i, task in enumerate(tasks):
-            if task["id"] == task_id:
-                if title is not None:
-                    tasks[i]["title"] = title
-                if description is not None:
-                    tasks[i]["description"] = description
-                if status is not None:
-                    old_status = tasks[i]["status"]
-                    tasks[i]["status"] = status
-                    
-                    # 处理完成状态变化
-                    if status == "completed" and old_status != "completed":
-                        tasks[i]["completed_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    elif status != "completed":
-                        tasks[i].pop("completed_at", None)
-                
-                if priority is not None:
-                    tasks[i]["priority"] = priority
-                if due_date is not None:
-                    tasks[i]["due_date"] = due_date
-                
-                tasks[i]["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.save_project_tasks(project_id, tasks)
-                return tasks[i]
-        return None
-    
-    def delete_task(self, project_id, task_id):
-        """删除任务"""
-        tasks = self.get_project_tasks(project_id)
-        
-        for i, task in enumerate(tasks):
-            if task["id"] == task_id:
-                deleted_task = tasks.pop(i)
-                self.save_project_tasks(project_id, tasks)
-                return deleted_task
-        return None
-    
-    def update_project_progress(self, project_id):
-        """更新项目进度"""
-        tasks = self.get_project_tasks(project_id)
-        if not tasks:
-            progress = 0
-        else:
-            completed_tasks = len([task for task in tasks if task["status"] == "completed"])
-            progress = int((completed_tasks / len(tasks)) * 100)
+                prompt = (f"已有摘要：{previous}\n\n" if previous else "") + f"新增对话：\n{transcript}"
+                return self.client.complete([
+                    {"role": "system",
+                     "content": "请把对话要点合并为一段简短的中文摘要，保留事实、结论和用户的偏好。"},
+                    {"role": "user", "content": prompt}
+                ], max_tokens=self.summary_tokens)
+            except Exception as e:
+                print(f"生成对话摘要失败: {e}")
         
-        for i, project in enumerate(self.projects_index):
-            if project["id"] == project_id:
-                self.projects_index[i]["progress"] = progress
-                self.save_index()
+        # 没有AI服务时保留每条消息的开头，超出预算时丢弃最早的内容
+        lines = ([previous] if previous else []) + [
+            f"{'用户' if m['role'] == 'user' else '助手'}：{m['content'][:60]}" for m in messages]
+        kept = []
+        used = 0
+        for line in reversed(lines):
+            used += estimate_tokens(line)
+            if kept and used > self.summary_tokens:
                 break
-        
-        return progress
-
-class ChatAPI:
-    def __init__(self):
-        # 创建聊天记录存储目录
-        self.chat_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chats")
-        if not os.path.exists(self.chat_dir):
-            os.makedirs(self.chat_dir)
-        
-        # 聊天记录文件
-        self.chat_file = os.path.join(self.chat_dir, "chat_history.json")
-        self.chat_history = self.load_chat_history()
-        
-        # AI服务配置（这里使用模拟回复，实际使用时需要配置真实的AI服务）
-        self.ai_service_enabled = False
-        self.openai_api_key = os.getenv('OPENAI_API_KEY')
-        if self.openai_api_key:
-            self.ai_service_enabled = True
+            kept.append(line)
+        return "\n".join(reversed(kept))
     
-    def load_chat_history(self):
-        """加载聊天历史"""
-        if os.path.exists(self.chat_file):
-            try:
-                with open(self.chat_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return []
-        return []
-    
-    def save_chat_history(self):
-        """保存聊天历史"""
-        with open(self.chat_file, 'w', encoding='utf-8') as f:
-            json.dump(self.chat_history, f, ensure_ascii=False, indent=2)
-    
-    def add_message(self, role: str, content: str):
-        """添加消息到历史记录"""
-        message = {
-            'id': str(uuid.uuid4()),
-            'role': role,
-            'content': content,
-            'timestamp': datetime.datetime.now().isoformat()
-        }
-        self.chat_history.append(message)
-        self.save_chat_history()
-        return message
-    
-    def get_ai_response(self, user_message: str, history: List[Dict] = None) -> str:
-        """获取AI回复"""
+    def get_ai_response(self, user_message: str, history: List[Dict] = None, session_id: str = None) -> str:
+        """获取AI回复（提供 session_id 时忽略 history，由服务端构建上下文）"""
         if self.ai_service_enabled:
             try:
-                return self._call_openai_api(user_message, history)
+                return self._call_openai_api(user_message, history, session_id)
             except Exception as e:
                 print(f"AI服务调用失败: {e}")
                 return self._get_fallback_response(user_message)
         else:
             return self._get_fallback_response(user_message)
     
-    def _call_openai_api(self, user_message: str, history: List[Dict] = None) -> str:
-        """调用OpenAI API"""
-        # 构建消息历史
+    def stream_ai_response(self, user_message: str, history: List[Dict] = None, session_id: str = None):
+        """流式获取AI回复，逐段产出文本
+
+        上游在产出任何内容之前失败时改用备用回复；已经产出部分内容后失败则直接结束。
+        """
+        if self.ai_service_enabled:
+            started = False
+            messages = self._build_messages(user_message, history, session_id)
+            upstream_started = time.perf_counter()
+            try:
+                for delta in self.client.stream(messages):
+                    started = True
+                    yield delta
+                UPSTREAM_SECONDS.observe(time.perf_counter() - upstream_started, mode="stream", outcome="ok")
+                return
+            except Exception as e:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - upstream_started, mode="stream", outcome="error")
+                print(f"AI服务调用失败: {e}")
+                if started:
+                    return
+        yield self._get_fallback_response(user_message)
+    
+    def _build_messages(self, user_message: str, history: List[Dict] = None,
+                        session_id: str = None) -> List[Dict]:
+        """构建发送给AI服务的消息列表
+
+        会话的上下文由服务端构建（用户消息此时已经保存在会话历史中）；
+        否则使用客户端提供的 history 中最近的 history_messages 条，同样按token预算截取。
+        """
+        if session_id:
+            return self.build_context(session_id, save_summary=True)[0]
+        
+        # 切片 [-0:] 会取全部，为0时不带历史
+        recent = (history or [])[-self.history_messages:] if self.history_messages > 0 else []
         messages = []
-        if history:
-            for msg in history[-5:]:  # 只取最近5条消息作为上下文
-                messages.append({
-                    "role": msg.get('role', 'user'),
-                    "content": msg.get('content', '')
-                })
+        for msg in recent:
+            messages.append({
+                "role": msg.get('role', 'user'),
+                "content": msg.get('content', '')
+            })
         
         messages.append({"role": "user", "content": user_message})
-        
-        # 调用OpenAI API
-        headers = {
-            "Authorization": f"Bearer {self.openai_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": "gpt-3.5-turbo",
-            "messages": messages,
-            "max_tokens": 500,
-            "temperature": 0.7
-        }
-        
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content'].strip()
-        else:
-            raise Exception(f"API调用失败: {response.status_code}")
+        return trim_to_budget(messages, self.context_tokens)[0]
+    
+    def _call_openai_api(self, user_message: str, history: List[Dict] = None, session_id: str = None) -> str:
+        """调用OpenAI API"""
+        messages = self._build_messages(user_message, history, session_id)
+        started = time.perf_counter()
+        try:
+            reply = self.client.complete(messages)
+        except Exception:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, mode="complete", outcome="error")
+            raise
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, mode="complete", outcome="ok")
+        return reply
     
     def _get_fallback_response(self, user_message: str) -> str:
         """获取备用回复（当AI服务不可用时）"""
-        # 简单的关键词匹配回复
-        message_lower = user_message.lower()
-        
-        if any(word in message_lower for word in ['你好', 'hello', 'hi', '您好']):
-            return "您好！我是您的AI助手，很高兴为您服务。有什么可以帮助您的吗？"
-        elif any(word in message_lower for word in ['谢谢', 'thank', '感谢']):
-            return "不客气！如果您还有其他问题，随时可以问我。"
-        elif any(word in message_lower for word in ['再见', 'bye', '拜拜']):
-            return "再见！祝您生活愉快，有需要随时找我聊天。"
-        elif any(word in message_lower for word in ['笔记', 'note', '记录']):
-            return "我可以帮您管理笔记！您可以在笔记页面创建、编辑和删除笔记。有什么具体的笔记需求吗？"
-        elif any(word in message_lower for word in ['待办', 'todo', '任务']):
-            return "我注意到您提到了待办事项。您可以在待办列表中添加、完成和删除任务。需要我帮您规划什么任务吗？"
-        elif any(word in message_lower for word in ['时间', 'time', '日期']):
-            current_time = datetime.datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
-            return f"现在的时间是：{current_time}"
-        elif '?' in user_message or '？' in user_message:
-            return "这是一个很好的问题！不过我目前的功能还比较有限，主要可以帮您管理笔记和待办事项。您可以尝试问我一些关于笔记管理的问题。"
-        else:
-            return "我理解您的意思。作为您的个人助手，我主要可以帮您管理笔记和待办事项。如果您需要其他帮助，请告诉我具体需求！"
-    
-    def clear_history(self):
-        """清空聊天历史"""
-        self.chat_history = []
-        self.save_chat_history()
+        # 按意图配置表做关键词匹配，配置文件修改后自动重新加载
+        return self.intents.respond(user_message)
 
 # 创建API实例
-notebook_api = NotebookAPI()
-todo_api = TodoAPI()
-chat_api = ChatAPI()
-project_api = ProjectAPI()
+notebook_api = NoteStore(change_feed)
+todo_api = TodoStore(change_feed)
+chat_api = ChatAPI(change_feed)
+project_api = ProjectStore(change_feed)
+
+# 整个工作区的导出与导入，导入时每批写入 IMPORT_BATCH_SIZE 条记录
+workspace = Workspace(notebook_api, todo_api, project_api, chat_api,
+                      batch_size=int(os.getenv('IMPORT_BATCH_SIZE', 1000)))
+
+# 跨集合的全局检索，启动时在后台建立索引，之后按变更序列增量维护
+global_search = GlobalSearch(notebook_api, todo_api, project_api, chat_api, change_feed)
+global_search.start()
+
+# 检索接口每次最多返回的结果数
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 100))
+
+def list_args():
+    """解析列表接口的通用参数：分页游标、每页条数和创建时间范围"""
+    limit = request.args.get('limit', type=int)
+    return {
+        'after': request.args.get('after'),
+        'limit': max(limit, 1) if limit is not None else None,
+        'created_from': request.args.get('created_from'),
+        'created_to': request.args.get('created_to'),
+    }
+
+def bool_arg(name):
+    """解析布尔型查询参数，未提供或无法识别时返回None"""
+    value = request.args.get(name, '').lower()
+    if value in ('true', '1', 'yes'):
+        return True
+    if value in ('false', '0', 'no'):
+        return False
+    return None
+
+def list_response(result):
+    """生成列表响应：按 fields 参数投影字段，下一页游标放在 X-Next-Cursor 响应头中"""
+    items, next_cursor = result
+    fields = request.args.get('fields')
+    response = jsonify(project_fields(items, fields.split(',') if fields else None))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return jsonify({"error": "分页游标无效"}), 400
+
+# 序列化后的GET响应体缓存，键为ETag（集合写入后代数变化，旧缓存自然失效）
+body_cache = ResponseBodyCache(capacity=int(os.getenv('RESPONSE_CACHE_SIZE', 256)))
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+
+def conditional(collection, lock):
+    """为GET接口添加ETag、If-None-Match（304）和响应体缓存，ETag由集合的代数生成"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with lock.read():
+                generation = lock.generation
+                if generation is None:
+                    return view(*args, **kwargs)
+                etag = make_etag(collection, generation, request.full_path)
+                if etag_matches(request.headers.get('If-None-Match'), etag):
+                    response = Response(status=304)
+                else:
+                    cached = body_cache.get(etag)
+                    if cached is not None:
+                        body, headers = cached
+                        response = Response(body, mimetype='application/json', headers=headers)
+                    else:
+                        response = app.make_response(view(*args, **kwargs))
+                        if response.status_code != 200 or lock.generation != generation:
+                            return response
+                        headers = {k: v for k, v in response.headers.items() if k == 'X-Next-Cursor'}
+                        body_cache.put(etag, response.get_data(), headers)
+            response.headers['ETag'] = etag
+            # 浏览器可以缓存，但每次使用前都要用 If-None-Match 重新验证
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+@app.after_request
+def compress_response(response):
+    """按 Accept-Encoding 压缩较大的JSON响应（br 或 gzip）"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    body = response.get_data()
+    if encoding is None or len(body) < COMPRESS_MIN_SIZE:
+        return response
+    etag = response.headers.get('ETag')
+    response.set_data(body_cache.encoded(etag, body, encoding) if etag else compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 # API路由
 @app.route('/')
@@ -548,31 +500,104 @@ def index():
     return send_from_directory('static', 'index.html')
 
 @app.route('/api/notes', methods=['GET'])
+@conditional('notes', notebook_api.lock)
 def get_notes():
-    notes = notebook_api.list_notes()
-    return jsonify(notes)
+    return list_response(notebook_api.query_notes(**list_args()))
 
 @app.route('/api/notes', methods=['POST'])
 def create_note():
     data = request.json
     if not data or 'title' not in data or 'content' not in data:
         return jsonify({"error": "标题和内容不能为空"}), 400
+    try:
+        Note.validate(data, partial=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     note = notebook_api.create_note(data['title'], data['content'])
     return jsonify(note), 201
 
+@app.route('/api/notes/search', methods=['GET'])
+@conditional('notes', notebook_api.lock)
+def search_notes():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "搜索关键词不能为空"}), 400
+    
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(notebook_api.search_notes(query, min(max(limit, 1), SEARCH_MAX_LIMIT)))
+
 @app.route('/api/notes/<note_id>', methods=['GET'])
+@conditional('notes', notebook_api.lock)
 def get_note(note_id):
     note = notebook_api.get_note(note_id)
     if note:
         return jsonify(note)
     return jsonify({"error": "笔记不存在"}), 404
 
+def content_response(opened, etag_prefix):
+    """流式返回正文，支持 Range 分段读取和 If-None-Match/If-Range 条件请求"""
+    f, size, signature, encoding = opened
+    response = Response(wrap_file(request.environ, f), mimetype='text/plain', direct_passthrough=True)
+    response.content_length = size
+    response.set_etag(f"{etag_prefix}-{signature}")
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    response.accept_ranges = 'bytes'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    try:
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        f.close()
+        raise
+
+@app.route('/api/notes/<note_id>/content', methods=['GET'])
+def get_note_content(note_id):
+    # 分段请求按解压后的正文计算偏移，只有完整读取时才直接发送压缩数据
+    gzip_ok = request.range is None and 'gzip' in accepted_encodings(request.headers.get('Accept-Encoding'))
+    opened = notebook_api.open_note_content(note_id, gzip_ok=gzip_ok)
+    if opened is None:
+        return jsonify({"error": "笔记不存在"}), 404
+    return content_response(opened, note_id)
+
+@app.route('/api/notes/<note_id>/versions', methods=['GET'])
+def get_note_versions(note_id):
+    versions = notebook_api.list_versions(note_id)
+    if versions is None:
+        return jsonify({"error": "笔记不存在"}), 404
+    return jsonify(versions)
+
+@app.route('/api/notes/<note_id>/versions/<int:version>', methods=['GET'])
+def get_note_version(note_id, version):
+    result = notebook_api.get_version(note_id, version)
+    if result is None:
+        return jsonify({"error": "版本不存在"}), 404
+    return jsonify(result)
+
+@app.route('/api/notes/<note_id>/versions/<int:version>/content', methods=['GET'])
+def get_note_version_content(note_id, version):
+    opened = notebook_api.open_version_content(note_id, version)
+    if opened is None:
+        return jsonify({"error": "版本不存在"}), 404
+    return content_response(opened, note_id)
+
+@app.route('/api/notes/<note_id>/versions/<int:version>/restore', methods=['POST'])
+def restore_note_version(note_id, version):
+    note = notebook_api.restore_version(note_id, version)
+    if note is None:
+        return jsonify({"error": "笔记或版本不存在"}), 404
+    return jsonify(note)
+
 @app.route('/api/notes/<note_id>', methods=['PUT'])
 def update_note(note_id):
     data = request.json
     if not data or 'title' not in data or 'content' not in data:
         return jsonify({"error": "标题和内容不能为空"}), 400
+    try:
+        Note.validate(data, partial=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     note = notebook_api.update_note(note_id, data['title'], data['content'])
     if note:
@@ -588,24 +613,40 @@ def delete_note(note_id):
 
 # 待办列表API路由
 @app.route('/api/todos', methods=['GET'])
+@conditional('todos', todo_api.lock)
 def get_todos():
-    todos = todo_api.list_todos()
-    return jsonify(todos)
+    return list_response(todo_api.query_todos(completed=bool_arg('completed'), **list_args()))
 
 @app.route('/api/todos', methods=['POST'])
 def create_todo():
     data = request.json
-    if not data or 'title' not in data:
-        return jsonify({"error": "待办标题不能为空"}), 400
+    try:
+        Todo.validate(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     todo = todo_api.create_todo(data['title'], data.get('completed', False))
     return jsonify(todo), 201
 
+@app.route('/api/todos/batch', methods=['POST'])
+def batch_todos():
+    data = request.get_json()
+    operations = data.get('operations') if isinstance(data, dict) else data
+    try:
+        results = todo_api.apply_batch(operations)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(results)
+
 @app.route('/api/todos/<todo_id>', methods=['PUT'])
 def update_todo(todo_id):
     data = request.json
     if not data:
         return jsonify({"error": "请提供更新数据"}), 400
+    try:
+        Todo.validate(data, partial=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     todo = todo_api.update_todo(
         todo_id, 
@@ -629,22 +670,27 @@ def chat():
     try:
         data = request.get_json()
         user_message = data.get('message', '').strip()
-        history = data.get('history', [])
+        session_id = data.get('session_id')
+        # 使用会话时上下文由服务端构建，忽略客户端提供的 history
+        history = [] if session_id else data.get('history', [])
         
         if not user_message:
             return jsonify({'error': '消息不能为空'}), 400
+        if session_id and not chat_api.get_session(session_id):
+            return jsonify({'error': '会话不存在'}), 404
         
         # 添加用户消息到历史记录
-        chat_api.add_message('user', user_message)
+        chat_api.add_message('user', user_message, session_id)
         
         # 获取AI回复
-        ai_reply = chat_api.get_ai_response(user_message, history)
+        ai_reply = chat_api.get_ai_response(user_message, history, session_id)
         
         # 添加AI回复到历史记录
-        chat_api.add_message('assistant', ai_reply)
+        chat_api.add_message('assistant', ai_reply, session_id)
         
         return jsonify({
             'reply': ai_reply,
+            'session_id': session_id,
             'timestamp': datetime.datetime.now().isoformat()
         })
     
@@ -652,11 +698,91 @@ def chat():
         print(f"聊天API错误: {e}")
         return jsonify({'error': '服务器内部错误'}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """流式聊天：以 Server-Sent Events 逐段返回AI回复"""
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message', '').strip()
+    session_id = data.get('session_id')
+    history = [] if session_id else data.get('history', [])
+    
+    if not user_message:
+        return jsonify({'error': '消息不能为空'}), 400
+    if session_id and not chat_api.get_session(session_id):
+        return jsonify({'error': '会话不存在'}), 404
+    
+    chat_api.add_message('user', user_message, session_id)
+    
+    def generate():
+        parts = []
+        try:
+            for delta in chat_api.stream_ai_response(user_message, history, session_id):
+                parts.append(delta)
+                yield f"data: {json_codec.dumps({'delta': delta})}\n\n"
+        finally:
+            # 客户端中途断开时也保存已生成的部分
+            ai_reply = ''.join(parts).strip()
+            if ai_reply:
+                chat_api.add_message('assistant', ai_reply, session_id)
+        done = {'reply': ai_reply, 'session_id': session_id, 'timestamp': datetime.datetime.now().isoformat()}
+        yield f"event: done\ndata: {json_codec.dumps(done)}\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/chat/sessions', methods=['GET'])
+@conditional('chat_sessions', chat_api.session_lock)
+def get_chat_sessions():
+    return list_response(chat_api.query_sessions(**list_args()))
+
+@app.route('/api/chat/sessions', methods=['POST'])
+def create_chat_session():
+    data = request.get_json(silent=True) or {}
+    try:
+        Session.validate(data, partial=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    session = chat_api.create_session((data.get('title') or '').strip())
+    return jsonify(session), 201
+
+@app.route('/api/chat/sessions/<session_id>', methods=['GET'])
+@conditional('chat_sessions', chat_api.session_lock)
+def get_chat_session(session_id):
+    session = chat_api.get_session(session_id)
+    if not session:
+        return jsonify({'error': '会话不存在'}), 404
+    return jsonify(session)
+
+@app.route('/api/chat/sessions/<session_id>', methods=['DELETE'])
+def delete_chat_session(session_id):
+    if not chat_api.delete_session(session_id):
+        return jsonify({'error': '会话不存在'}), 404
+    return jsonify({'message': '会话已删除'})
+
+@app.route('/api/chat/sessions/<session_id>/context', methods=['GET'])
+def get_chat_session_context(session_id):
+    """查看下一次请求将发送给AI服务的上下文及其token数"""
+    if not chat_api.get_session(session_id):
+        return jsonify({'error': '会话不存在'}), 404
+    messages, tokens = chat_api.build_context(session_id)
+    return jsonify({'messages': messages, 'tokens': tokens})
+
+@app.route('/api/chat/cache', methods=['GET'])
+def get_chat_cache_stats():
+    """获取AI回复缓存的命中统计"""
+    return jsonify(chat_api.cache_stats())
+
 @app.route('/api/chat/history', methods=['GET'])
+@conditional('chat_messages', chat_api.lock)
 def get_chat_history():
     """获取聊天历史"""
     try:
-        return jsonify(chat_api.chat_history)
+        return list_response(chat_api.query_history(before=request.args.get('before') or None,
+                                                    role=request.args.get('role'),
+                                                    session_id=request.args.get('session_id'),
+                                                    **list_args()))
+    except InvalidCursor:
+        raise
     except Exception as e:
         print(f"获取聊天历史错误: {e}")
         return jsonify({'error': '服务器内部错误'}), 500
@@ -671,35 +797,175 @@ def clear_chat_history():
         print(f"清空聊天历史错误: {e}")
         return jsonify({'error': '服务器内部错误'}), 500
 
+def cache_samples(field):
+    """各缓存的命中/未命中次数和条目数，供 /metrics 采集"""
+    caches = {'tasks': project_api.tasks, 'responses': body_cache}
+    if chat_api.client is not None and chat_api.client.cache is not None:
+        caches['ai_replies'] = chat_api.client.cache
+    samples = []
+    for name, cache in caches.items():
+        value = len(cache.entries) if field == 'entries' else getattr(cache, field)
+        samples.append(({'cache': name}, value))
+    return samples
+
+registry.callback('cache_hits_total', '缓存命中次数', lambda: cache_samples('hits'), type='counter')
+registry.callback('cache_misses_total', '缓存未命中次数', lambda: cache_samples('misses'), type='counter')
+registry.callback('cache_entries', '缓存条目数', lambda: cache_samples('entries'))
+registry.callback('collection_records', '集合中的记录数', lambda: [
+    ({'collection': 'notes'}, len(notebook_api.notes_index)),
+    ({'collection': 'todos'}, len(todo_api.todos_index)),
+    ({'collection': 'projects'}, len(project_api.projects_index)),
+    ({'collection': 'chat_sessions'}, len(chat_api.sessions)),
+])
+registry.callback('change_feed_last_seq', '变更序列的最新序号', lambda: [({}, change_feed.last_seq)])
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文本格式的指标（每个进程各自统计）"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# 全局检索
+@app.route('/api/search', methods=['GET'])
+def search_all():
+    """跨集合检索：q 为关键词，types 为逗号分隔的类型（默认全部），
+    created_from/created_to 过滤创建时间，due_from/due_to 过滤任务的截止日期"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '搜索关键词不能为空'}), 400
+
+    types = request.args.get('types')
+    if types:
+        types = [t.strip() for t in types.split(',') if t.strip()]
+        unknown = [t for t in types if t not in SEARCH_TYPES]
+        if unknown:
+            return jsonify({'error': f"未知的类型: {', '.join(unknown)}"}), 400
+
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(global_search.search(
+        query,
+        types=types or None,
+        created_from=request.args.get('created_from'),
+        created_to=request.args.get('created_to'),
+        due_from=request.args.get('due_from'),
+        due_to=request.args.get('due_to'),
+        limit=min(max(limit, 1), SEARCH_MAX_LIMIT)
+    ))
+
+# 工作区导出/导入
+@app.route('/api/export', methods=['GET'])
+def export_workspace():
+    """以 ndjson 或 tar 格式下载整个工作区的一致快照"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in WORKSPACE_FORMATS:
+        return jsonify({'error': '导出格式只能是 ndjson 或 tar'}), 400
+    
+    f = workspace.snapshot(fmt)
+    size = os.fstat(f.fileno()).st_size
+    filename = f"workspace-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    response = Response(wrap_file(request.environ, f), direct_passthrough=True,
+                        mimetype='application/x-tar' if fmt == 'tar' else 'application/x-ndjson')
+    response.content_length = size
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/api/import', methods=['POST'])
+def import_workspace():
+    """导入 /api/export 导出的文件（请求体为文件内容），按id新建或覆盖记录"""
+    fmt = request.args.get('format')
+    if fmt is not None and fmt not in WORKSPACE_FORMATS:
+        return jsonify({'error': '导入格式只能是 ndjson 或 tar'}), 400
+    
+    try:
+        result = workspace.import_stream(request.stream, fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+# 变更推送
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """变更事件：EventSource（Accept: text/event-stream）持续推送，否则返回 since 之后的事件"""
+    since = request.args.get('since', type=int)
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        # 断线重连时浏览器通过 Last-Event-ID 带上最后收到的序号
+        last_id = request.headers.get('Last-Event-ID', '')
+        if last_id.isdigit():
+            since = int(last_id)
+        return Response(change_stream(since), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    if since is None:
+        return jsonify({'events': [], 'last_seq': change_feed.last_seq})
+    limit = max(request.args.get('limit', 1000, type=int), 1)
+    events = change_feed.since(since, limit)
+    if events is None:
+        return jsonify({'error': '变更记录已过期，请重新加载完整列表', 'reset': True,
+                        'last_seq': change_feed.last_seq}), 410
+    last_seq = since + len(events)
+    body = (f'{{"events":[{",".join(events)}],"last_seq":{last_seq},'
+            f'"has_more":{"true" if last_seq < change_feed.last_seq else "false"}}}')
+    return Response(body, mimetype='application/json')
+
+def change_stream(since):
+    """生成变更事件流；没有事件时定期发送注释行保持连接"""
+    heartbeat = float(os.getenv('CHANGE_FEED_HEARTBEAT', 15))
+    seq = change_feed.last_seq if since is None else since
+    while True:
+        events = change_feed.since(seq)
+        if events is None:
+            seq = change_feed.last_seq
+            yield f"event: reset\ndata: {json_codec.dumps({'last_seq': seq})}\n\n"
+            continue
+        for event in events:
+            seq += 1
+            yield f"id: {seq}\nevent: change\ndata: {event}\n\n"
+        if not change_feed.wait(seq, heartbeat):
+            yield ": ping\n\n"
+
 # 项目管理相关API
 @app.route('/api/projects', methods=['GET'])
+@conditional('projects', project_api.lock)
 def get_projects():
-    projects = project_api.list_projects()
-    return jsonify(projects)
+    return list_response(project_api.query_projects(status=request.args.get('status'), **list_args()))
 
 @app.route('/api/projects', methods=['POST'])
 def create_project():
     data = request.get_json()
-    name = data.get('name', '')
+    try:
+        Project.validate(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    name = data['name']
     description = data.get('description', '')
     status = data.get('status', 'active')
     
-    if not name:
-        return jsonify({'error': '项目名称不能为空'}), 400
-    
     project = project_api.create_project(name, description, status)
     return jsonify(project), 201
 
 @app.route('/api/projects/<project_id>', methods=['GET'])
+@conditional('projects', project_api.lock)
 def get_project(project_id):
     project = project_api.get_project(project_id)
     if not project:
         return jsonify({'error': '项目不存在'}), 404
     return jsonify(project)
 
+@app.route('/api/projects/<project_id>/stats', methods=['GET'])
+def get_project_stats(project_id):
+    stats = project_api.get_project_stats(project_id, verify=bool_arg('verify') or False)
+    if stats is None:
+        return jsonify({'error': '项目不存在'}), 404
+    return jsonify(stats)
+
 @app.route('/api/projects/<project_id>', methods=['PUT'])
 def update_project(project_id):
     data = request.get_json()
+    try:
+        Project.validate(data, partial=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     name = data.get('name')
     description = data.get('description')
     status = data.get('status')
@@ -720,14 +986,21 @@ def delete_project(project_id):
 
 # 项目任务相关API
 @app.route('/api/projects/<project_id>/tasks', methods=['GET'])
+@conditional('projects', project_api.lock)
 def get_project_tasks(project_id):
     # 检查项目是否存在
     project = project_api.get_project(project_id)
     if not project:
         return jsonify({'error': '项目不存在'}), 404
     
-    tasks = project_api.get_project_tasks(project_id)
-    return jsonify(tasks)
+    return list_response(project_api.query_tasks(
+        project_id,
+        status=request.args.get('status'),
+        priority=request.args.get('priority'),
+        due_from=request.args.get('due_from'),
+        due_to=request.args.get('due_to'),
+        **list_args()
+    ))
 
 @app.route('/api/projects/<project_id>/tasks', methods=['POST'])
 def create_task(project_id):
@@ -737,18 +1010,35 @@ def create_task(project_id):
         return jsonify({'error': '项目不存在'}), 404
     
     data = request.get_json()
-    title = data.get('title', '')
+    try:
+        Task.validate(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    title = data['title']
     description = data.get('description', '')
     status = data.get('status', 'pending')
     priority = data.get('priority', 'medium')
     due_date = data.get('due_date')
     
-    if not title:
-        return jsonify({'error': '任务标题不能为空'}), 400
-    
     task = project_api.create_task(project_id, title, description, status, priority, due_date)
     return jsonify(task), 201
 
+@app.route('/api/projects/<project_id>/tasks/batch', methods=['POST'])
+def batch_tasks(project_id):
+    # 检查项目是否存在
+    project = project_api.get_project(project_id)
+    if not project:
+        return jsonify({'error': '项目不存在'}), 404
+    
+    data = request.get_json()
+    operations = data.get('operations') if isinstance(data, dict) else data
+    try:
+        results = project_api.apply_task_batch(project_id, operations)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(results)
+
 @app.route('/api/projects/<project_id>/tasks/<task_id>', methods=['PUT'])
 def update_task(project_id, task_id):
     # 检查项目是否存在
@@ -757,6 +1047,11 @@ def update_task(project_id, task_id):
         return jsonify({'error': '项目不存在'}), 404
     
     data = request.get_json()
+    try:
+        Task.validate(data, partial=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     title = data.get('title')
     description = data.get('description')
     status = data.get('status')
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import json
+import zlib
+import bisect
+import hashlib
+import datetime
+
+import json_codec
+from storage import open_note_content
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Gear 滚动哈希表：每个字节值对应一个固定的64位随机数
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+_MASK64 = (1 << 64) - 1
+# 哈希左移64次后，更早的字节不再影响结果：位置 i 的哈希只取决于以 i 结尾的64个字节
+_WINDOW = 64
+# 向量化计算时每次处理的字节数（限制临时数组的内存）
+_BLOCK = 1 << 20
+
+
+def chunk_boundaries(data, min_size=2048, avg_size=8192, max_size=65536):
+    """按内容确定分块边界（Gear 滚动哈希），返回每块的结束位置
+
+    边界只取决于附近的内容，在中间插入或删除文字只影响相邻的一两块，
+    其余分块与修改前相同，可以直接复用。安装了 numpy 时向量化计算候选边界，
+    结果与逐字节计算相同。
+    """
+    length = len(data)
+    if length <= min_size:
+        return [length] if length else []
+    bits = avg_size.bit_length() - 1
+    # Gear 哈希的高位与更多的前序字节有关，用高位判断边界
+    mask = ((1 << bits) - 1) << (64 - bits)
+    candidates = _candidates(data, mask) if numpy is not None else None
+    gear = _GEAR
+    ends = []
+    start = 0
+    while start < length:
+        end = min(start + max_size, length)
+        # 每块从 start + min_size 开始重新计算哈希；不足一个窗口时哈希与完整窗口的不同，逐字节计算
+        scan_end = end if candidates is None else min(start + min_size + _WINDOW - 1, end)
+        h = 0
+        for i in range(start + min_size, scan_end):
+            h = ((h << 1) + gear[data[i]]) & _MASK64
+            if not h & mask:
+                end = i + 1
+                break
+        else:
+            if candidates is not None:
+                j = bisect.bisect_left(candidates, scan_end)
+                if j < len(candidates) and candidates[j] < end:
+                    end = candidates[j] + 1
+        ends.append(end)
+        start = end
+    return ends
+
+
+def _candidates(data, mask):
+    """以完整的64字节窗口计算每个位置的 Gear 哈希，返回满足边界条件的位置（升序）
+
+    窗口宽度为 w 的哈希 H_w[i] = sum(G[data[i-k]] << k, k < w)，
+    由 H_2w[i] = (H_w[i-w] << w) + H_w[i] 翻倍六次得到，uint64 的加法和移位自然取模 2^64。
+    """
+    gear = numpy.array(_GEAR, dtype=numpy.uint64)
+    mask = numpy.uint64(mask)
+    found = []
+    for block in range(0, len(data), _BLOCK):
+        # 每块向前多取一个窗口，块首位置的哈希也是完整的
+        offset = max(block - _WINDOW + 1, 0)
+        h = gear[numpy.frombuffer(data, dtype=numpy.uint8, count=min(block + _BLOCK, len(data)) - offset,
+                                  offset=offset)]
+        width = 1
+        while width < _WINDOW:
+            shifted = numpy.zeros_like(h)
+            shifted[width:] = h[:-width] << numpy.uint64(width)
+            h += shifted
+            width *= 2
+        positions = numpy.flatnonzero((h & mask) == 0) + offset
+        found.extend(positions[positions >= block].tolist())
+    return found
+
+
+class ChunkStore:
+    """内容寻址的分块存储
+
+    内容按 chunk_boundaries 切分，每块以 SHA-256 命名保存在 chunks/<前两位>/<哈希> 中，
+    相同的块只保存一次；能压缩的块以 zlib 压缩保存（文件名带 .z 后缀）。
+    内容本身以整体的 SHA-256 作为标识：只有一块时标识就是这一块，
+    多块时在 manifests/<前两位>/<哈希>.json 中记录分块列表。写入的文件都先写临时文件再替换。
+    打开的内容（open）在关闭前对 gc.lock 持有共享锁，回收（collect_garbage）需要独占锁，
+    拿不到时推迟，正在读取的分块不会被其他请求或其他进程删除。
+    """
+
+    def __init__(self, directory, compress=True):
+        self.directory = directory
+        self.compress = compress
+        self.pin_path = os.path.join(directory, "gc.lock")
+        os.makedirs(os.path.join(directory, "chunks"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "manifests"), exist_ok=True)
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.directory, "chunks", digest[:2], digest)
+
+    def _manifest_path(self, digest):
+        return os.path.join(self.directory, "manifests", digest[:2], digest + ".json")
+
+    @staticmethod
+    def _write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def _put_chunk(self, chunk):
+        """保存一块（已存在时跳过），返回 (哈希, 新写入的字节数)"""
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path) or os.path.exists(path + ".z"):
+            return digest, 0
+        if self.compress:
+            packed = zlib.compress(chunk, 6)
+            # 压缩后至少小八分之一才值得解压的开销
+            if len(packed) < len(chunk) - len(chunk) // 8:
+                self._write_atomic(path + ".z", packed)
+                return digest, len(packed)
+        self._write_atomic(path, chunk)
+        return digest, len(chunk)
+
+    def put(self, data):
+        """保存内容，返回 (内容标识, 新写入的字节数)"""
+        chunks = []
+        written = 0
+        start = 0
+        for end in chunk_boundaries(data):
+            digest, size = self._put_chunk(data[start:end])
+            chunks.append([digest, end - start])
+            written += size
+            start = end
+        if len(chunks) == 1:
+            return chunks[0][0], written
+        blob = hashlib.sha256(data).hexdigest()
+        path = self._manifest_path(blob)
+        if not os.path.exists(path):
+            manifest = json_codec.dumps_bytes({"size": len(data), "chunks": chunks})
+            self._write_atomic(path, manifest)
+            written += len(manifest)
+        return blob, written
+
+    def chunks(self, blob):
+        """内容的分块列表 [[哈希, 字节数], ...]"""
+        try:
+            with open(self._manifest_path(blob), "rb") as f:
+                return json_codec.load(f)["chunks"]
+        except FileNotFoundError:
+            pass
+        path = self._chunk_path(blob)
+        if os.path.exists(path):
+            return [[blob, os.path.getsize(path)]]
+        if os.path.exists(path + ".z"):
+            # 压缩块的原始大小需要解压才能知道，单块内容不超过 max_size，代价可以接受
+            return [[blob, len(self.read_chunk(blob))]]
+        raise FileNotFoundError(f"内容不存在: {blob}")
+
+    def read_chunk(self, digest):
+        path = self._chunk_path(digest)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with open(path + ".z", "rb") as f:
+                return zlib.decompress(f.read())
+
+    def pin(self):
+        """对 gc.lock 加共享锁并返回文件描述符，关闭前 collect_garbage 不会删除任何文件"""
+        fd = os.open(self.pin_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        return fd
+
+    def open(self, blob):
+        """以可随机访问的二进制文件对象打开内容，只在读到时加载对应的块（关闭前持有 pin）"""
+        pin = self.pin()
+        try:
+            return ChunkReader(self, self.chunks(blob), pin)
+        except BaseException:
+            os.close(pin)
+            raise
+
+    def read(self, blob):
+        return b"".join(self.read_chunk(digest) for digest, _ in self.chunks(blob))
+
+    def collect_garbage(self, live_blobs):
+        """删除不被 live_blobs 引用的分块和清单，返回 (删除的文件数, 释放的字节数)
+
+        有打开的内容（本进程或其他进程）时不删除任何文件，返回None。
+        """
+        fd = os.open(self.pin_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return None
+        try:
+            return self._sweep(live_blobs)
+        finally:
+            os.close(fd)
+
+    def _sweep(self, live_blobs):
+        live_chunks = set()
+        for blob in live_blobs:
+            try:
+                live_chunks.update(digest for digest, _ in self.chunks(blob))
+            except FileNotFoundError:
+                continue
+        removed, freed = 0, 0
+        for kind, live in (("manifests", live_blobs), ("chunks", live_chunks)):
+            root = os.path.join(self.directory, kind)
+            for prefix in os.listdir(root):
+                for filename in os.listdir(os.path.join(root, prefix)):
+                    digest = filename.split(".", 1)[0]
+                    if digest in live and not filename.endswith(".tmp"):
+                        continue
+                    path = os.path.join(root, prefix, filename)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+        return removed, freed
+
+
+class ChunkReader(io.RawIOBase):
+    """按分块列表读取内容的只读文件对象，支持 seek（用于 Range 请求）
+
+    pin 为 ChunkStore.pin 返回的文件描述符，关闭时释放。
+    """
+
+    def __init__(self, store, chunks, pin=None):
+        super().__init__()
+        self.store = store
+        self._pin = pin
+        self.digests = [digest for digest, _ in chunks]
+        # 每块的起始偏移
+        self.offsets = []
+        total = 0
+        for _, size in chunks:
+            self.offsets.append(total)
+            total += size
+        self.size = total
+        self.position = 0
+        self._loaded = (None, b"")
+
+    def close(self):
+        if self._pin is not None:
+            os.close(self._pin)
+            self._pin = None
+        super().close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index = bisect.bisect_right(self.offsets, self.position) - 1
+        if self._loaded[0] != index:
+            self._loaded = (index, self.store.read_chunk(self.digests[index]))
+        chunk = self._loaded[1]
+        start = self.position - self.offsets[index]
+        count = min(len(buffer), len(chunk) - start)
+        buffer[:count] = chunk[start:start + count]
+        self.position += count
+        return count
+
+
+class NoteContentStore:
+    """笔记正文及其版本历史
+
+    正文保存在 ChunkStore（notes/blobs/）中，笔记索引记录当前版本的内容标识（blob）、字节数和版本号。
+    每次保存在 notes/versions/<笔记id>.jsonl 中追加一个版本（标题、内容标识、字节数、时间），
+    版本只引用共享的分块，修改大笔记的一部分只新增改动附近的块，内容相同的笔记和版本不占额外空间。
+    max_versions 大于0时只保留最近的若干版本；删除笔记或版本后不再被引用的块
+    累计达到 gc_threshold 个版本时统一回收，有正文正在读取时推迟到之后的删除。调用方负责加写锁。
+    旧版本的 <id>.txt / <id>.txt.gz 文件仍可读取，第一次修改时连同原内容一起转入分块存储。
+    """
+
+    def __init__(self, notes_dir, max_versions=0, compress=True, gc_threshold=1000):
+        self.notes_dir = notes_dir
+        self.blobs = ChunkStore(os.path.join(notes_dir, "blobs"), compress=compress)
+        self.versions_dir = os.path.join(notes_dir, "versions")
+        os.makedirs(self.versions_dir, exist_ok=True)
+        self.max_versions = max_versions
+        self.gc_threshold = gc_threshold
+        self._released = 0
+
+    def _legacy_path(self, note):
+        return os.path.join(self.notes_dir, note["filename"]) if "filename" in note else None
+
+    def exists(self, note):
+        legacy = self._legacy_path(note)
+        return os.path.exists(legacy) if legacy else "blob" in note
+
+    def signature(self, note):
+        """正文签名（内容变化时改变），用于检索索引和ETag；正文不存在时返回None"""
+        legacy = self._legacy_path(note)
+        if legacy is None:
+            return note.get("blob")
+        try:
+            stat = os.stat(legacy)
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def size(self, note):
+        """正文字节数"""
+        if "size" in note:
+            return note["size"]
+        return os.path.getsize(self._legacy_path(note))
+
+    def open(self, note, binary=False):
+        """打开正文（默认为文本模式）"""
+        legacy = self._legacy_path(note)
+        if legacy:
+            return open_note_content(legacy, 'rb' if binary else 'r')
+        reader = self.blobs.open(note["blob"])
+        return reader if binary else io.TextIOWrapper(io.BufferedReader(reader), encoding="utf-8")
+
+    def open_raw(self, note):
+        """旧版本压缩保存的正文返回原始gzip文件，其他情况返回None"""
+        legacy = self._legacy_path(note)
+        if legacy and legacy.endswith(".gz"):
+            return open(legacy, "rb")
+        return None
+
+    def read(self, note):
+        with self.open(note) as f:
+            return f.read()
+
+    def _versions_path(self, note_id):
+        return os.path.join(self.versions_dir, f"{note_id}.jsonl")
+
+    def versions(self, note_id):
+        """笔记的全部版本（从旧到新）"""
+        versions = []
+        try:
+            with open(self._versions_path(note_id), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        versions.append(json_codec.loads(line))
+                    except json.JSONDecodeError:
+                        # 崩溃时可能留下写了一半的行
+                        continue
+        except FileNotFoundError:
+            pass
+        return versions
+
+    def get_version(self, note_id, number):
+        for version in self.versions(note_id):
+            if version["version"] == number:
+                return version
+        return None
+
+    def save(self, note, content, title=None):
+        """保存新的正文（和标题）并记录一个版本，更新笔记记录中的 title、blob、size 和 version，返回版本记录
+
+        内容和标题都没有变化时不产生新版本。
+        """
+        versions = self.versions(note["id"])
+        legacy = self._legacy_path(note)
+        if legacy and not versions and os.path.exists(legacy):
+            # 旧格式的笔记：先把原内容记为第一个版本
+            old = self.read(note).encode("utf-8")
+            versions.append(self._append(note["id"], {
+                "version": 1, "title": note["title"], "blob": self.blobs.put(old)[0], "size": len(old),
+                "created_at": note.get("updated_at", note.get("created_at"))
+            }))
+        if title is not None:
+            note["title"] = title
+        data = content.encode("utf-8")
+        blob = self.blobs.put(data)[0]
+        if versions and versions[-1]["blob"] == blob and versions[-1]["title"] == note["title"]:
+            version = versions[-1]
+        else:
+            version = self._record(note["id"], versions, note["title"], blob, len(data))
+        if legacy:
+            note.pop("filename")
+            if os.path.exists(legacy):
+                os.remove(legacy)
+        note.update({"blob": blob, "size": len(data), "version": version["version"]})
+        return version
+
+    def restore(self, note, number):
+        """把指定版本的标题和正文恢复为新的当前版本（不复制内容），返回新版本记录，版本不存在时返回None"""
+        versions = self.versions(note["id"])
+        old = next((version for version in versions if version["version"] == number), None)
+        if old is None:
+            return None
+        version = self._record(note["id"], versions, old["title"], old["blob"], old["size"], restored_from=number)
+        note.update({"title": old["title"], "blob": old["blob"], "size": old["size"], "version": version["version"]})
+        return version
+
+    def _record(self, note_id, versions, title, blob, size, restored_from=None):
+        """追加一个版本，超出 max_versions 时删除最旧的版本"""
+        version = {"version": versions[-1]["version"] + 1 if versions else 1, "title": title,
+                   "blob": blob, "size": size, "created_at": datetime.datetime.now().isoformat()}
+        if restored_from is not None:
+            version["restored_from"] = restored_from
+        versions.append(self._append(note_id, version))
+        if 0 < self.max_versions < len(versions):
+            self._rewrite(note_id, versions[-self.max_versions:])
+            self._release(len(versions) - self.max_versions)
+        return version
+
+    def _append(self, note_id, version):
+        with open(self._versions_path(note_id), "a", encoding="utf-8") as f:
+            f.write(json_codec.dumps(version) + "\n")
+        return version
+
+    def _rewrite(self, note_id, versions):
+        path = self._versions_path(note_id)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("".join(json_codec.dumps(v) + "\n" for v in versions))
+        os.replace(path + ".tmp", path)
+
+    def drop(self, note):
+        """删除笔记的正文和全部版本"""
+        legacy = self._legacy_path(note)
+        if legacy and os.path.exists(legacy):
+            os.remove(legacy)
+        path = self._versions_path(note["id"])
+        if os.path.exists(path):
+            self._release(len(self.versions(note["id"])))
+            os.remove(path)
+
+    def _release(self, count):
+        self._released += count
+        if self.gc_threshold and self._released >= self.gc_threshold:
+            self.collect_garbage()
+
+    def collect_garbage(self):
+        """回收不再被任何版本引用的分块，返回 (删除的文件数, 释放的字节数)，有正文正在读取时返回None"""
+        live = set()
+        for filename in os.listdir(self.versions_dir):
+            if filename.endswith(".jsonl"):
+                live.update(version["blob"] for version in self.versions(filename[:-len(".jsonl")]))
+        result = self.blobs.collect_garbage(live)
+        if result is not None:
+            self._released = 0
+        return result
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import datetime
+import threading
+
+import json_codec
+from storage import DATA_DIR, CollectionLock
+
+
+class ChangeFeed:
+    """跨进程的变更序列（笔记、待办、项目和任务的新建、修改、删除事件，以及聊天消息的新建和清空事件）
+
+    事件以JSON行追加到 changes.jsonl，序号在文件锁内分配，所有进程共享同一个单调递增的序列。
+    内存中保留最近 retain 个事件（已序列化的字符串），序号连续，按序号取增量为O(1)定位。
+    其他进程写入后锁文件中的代数变化，本进程在下一次加锁时从上次读到的位置继续读取。
+    文件中的事件超过 retain 的两倍时重写为只包含最近 retain 个事件。
+    """
+
+    def __init__(self, directory, retain=10000, poll_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "changes.jsonl")
+        self.retain = retain
+        self.poll_interval = poll_interval
+        self.events = []      # 已序列化的事件，序号从 first_seq 开始连续
+        self.first_seq = 1
+        self.last_seq = 0
+        self._offset = 0
+        self._inode = None
+        self._lines = 0
+        self._cond = threading.Condition()
+        self.lock = CollectionLock(self.path + ".lock", self._catch_up)
+        with self.lock.read():
+            self._catch_up()
+
+    def _catch_up(self):
+        """读取其他进程追加的事件（文件被重写过时从头读取）"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        size = stat.st_size
+        if stat.st_ino != self._inode or size < self._offset:
+            self._inode = stat.st_ino
+            self._offset = 0
+            self._lines = 0
+            self.events = []
+            self.last_seq = 0
+        if size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # 只处理完整的行，写了一半的行留到下次
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").splitlines():
+            try:
+                seq = json_codec.loads(line)["seq"]
+            except (json.JSONDecodeError, KeyError):
+                continue
+            self._lines += 1
+            if seq <= self.last_seq:
+                continue
+            if not self.events:
+                self.first_seq = seq
+            self.events.append(line)
+            self.last_seq = seq
+        self._offset += end
+        self._trim()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _trim(self):
+        if len(self.events) > self.retain * 2:
+            drop = len(self.events) - self.retain
+            del self.events[:drop]
+            self.first_seq += drop
+
+    def publish(self, changes):
+        """记录一组变更，changes 为 [(集合名, 操作, 记录)]，删除操作的记录只需包含 id
+
+        清空整个集合的操作为 clear，记录为 {"id": None}。
+        任务事件的记录中带有 project_id。返回分配的最后一个序号。
+        """
+        if not changes:
+            return self.last_seq
+        timestamp = datetime.datetime.now().isoformat()
+        with self.lock.write():
+            lines = []
+            for collection, op, record in changes:
+                seq = self.last_seq + len(lines) + 1
+                event = {"seq": seq, "collection": collection, "op": op, "id": record["id"],
+                         "timestamp": timestamp}
+                if op == "delete":
+                    if "project_id" in record:
+                        event["project_id"] = record["project_id"]
+                elif op != "clear":
+                    event["data"] = record
+                lines.append(json_codec.dumps(event))
+
+            if not self.events:
+                self.first_seq = self.last_seq + 1
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(line + "\n" for line in lines))
+                self._offset = f.tell()
+            self._inode = os.stat(self.path).st_ino
+            self._lines += len(lines)
+            self.events.extend(lines)
+            self.lock.changed()
+            self.last_seq += len(lines)
+            self._trim()
+            if self._lines > self.retain * 2:
+                self._rewrite()
+        with self._cond:
+            self._cond.notify_all()
+        return self.last_seq
+
+    def _rewrite(self):
+        """只保留最近的 retain 个事件（调用方持有写锁）"""
+        keep = self.events[-self.retain:]
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in keep))
+            offset = f.tell()
+        os.replace(tmp_path, self.path)
+        self._inode = os.stat(self.path).st_ino
+        self.first_seq += len(self.events) - len(keep)
+        self.events = keep
+        self._offset = offset
+        self._lines = len(keep)
+
+    def since(self, seq, limit=None):
+        """返回序号大于 seq 的事件（已序列化的字符串）
+
+        seq 早于保留范围时返回None，客户端需要重新加载完整列表。
+        """
+        with self.lock.read():
+            if seq >= self.last_seq:
+                return []
+            if seq < self.first_seq - 1:
+                return None
+            start = seq - self.first_seq + 1
+            end = len(self.events) if limit is None else start + limit
+            return self.events[start:end]
+
+    def wait(self, seq, timeout):
+        """等待出现序号大于 seq 的事件，返回是否有新事件
+
+        本进程的写入会立即唤醒等待者；其他进程的写入每隔 poll_interval 秒检查一次。
+        """
+        remaining = timeout
+        while True:
+            with self.lock.read():
+                if self.last_seq > seq:
+                    return True
+            if remaining <= 0:
+                return False
+            step = min(self.poll_interval, remaining)
+            with self._cond:
+                self._cond.wait(step)
+            remaining -= step
+
+
+def open_change_feed():
+    """打开数据目录中的变更序列（CHANGE_FEED_RETAIN 为内存中保留的事件数）"""
+    return ChangeFeed(os.path.join(DATA_DIR, "changes"), retain=int(os.getenv('CHANGE_FEED_RETAIN', 10000)))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""跨集合的全局检索（笔记、待办、项目、项目任务和聊天消息）
+
+每种类型一个倒排索引，按类型过滤时只查询对应的索引；查询只遍历查询词项的倒排表，
+耗时取决于命中的文档数而不是集合大小。笔记直接使用 NoteStore 自己维护的检索索引，
+其余类型的索引在应用启动时由后台线程建立，之后按变更序列（changes.py）增量更新：
+每次查询前先应用上次之后的变更事件，其他进程的修改同样可见。变更事件已超出保留范围时
+在后台重新建立，建好之前继续使用原来的索引。
+"""
+
+import os
+import heapq
+import itertools
+import threading
+from operator import itemgetter
+
+import json_codec
+from search import InvertedIndex, tokenize
+from storage import InvalidCursor, in_time_range
+
+TYPES = ("note", "todo", "project", "task", "message")
+
+# 变更序列中的集合名 -> 类型（笔记的变更由 NoteStore 的检索索引处理）
+_COLLECTION_TYPES = {"todos": "todo", "projects": "project", "tasks": "task", "chat_messages": "message"}
+
+# 有截止日期的类型
+_DUE_TYPES = ("task",)
+
+# 各类型索引的字段权重（与笔记检索索引的标题、正文权重相同，得分才可以比较）
+_FIELDS = {"title": 3, "body": 1}
+
+# 消息作为结果标题时截取的长度
+_MESSAGE_TITLE_CHARS = 80
+
+# 建立索引时每次在聊天读锁内读取的消息数
+_BUILD_BATCH = 1000
+
+
+def _document(doc_type, record):
+    """记录 -> (检索字段, 结果摘要)"""
+    if doc_type == "todo":
+        return ({"title": record.get("title")},
+                {"title": record.get("title"), "created_at": record.get("created_at"),
+                 "completed": record.get("completed")})
+    if doc_type == "project":
+        return ({"title": record.get("name"), "body": record.get("description")},
+                {"title": record.get("name"), "created_at": record.get("created_at"),
+                 "status": record.get("status")})
+    if doc_type == "task":
+        return ({"title": record.get("title"), "body": record.get("description")},
+                {"title": record.get("title"), "created_at": record.get("created_at"),
+                 "project_id": record.get("project_id"), "status": record.get("status"),
+                 "priority": record.get("priority"), "due_date": record.get("due_date")})
+    content = record.get("content") or ""
+    return ({"body": content},
+            {"title": content[:_MESSAGE_TITLE_CHARS], "created_at": record.get("timestamp"),
+             "role": record.get("role"), "session_id": record.get("session_id")})
+
+
+class _Indexes:
+    """一套按类型分开的索引和结果摘要"""
+
+    def __init__(self):
+        self.indexes = {doc_type: InvertedIndex(_FIELDS) for doc_type in _COLLECTION_TYPES.values()}
+        # 类型 -> {id: 结果摘要}
+        self.summaries = {doc_type: {} for doc_type in _COLLECTION_TYPES.values()}
+        # 项目id -> 任务id集合（删除项目时一并删除它的任务）
+        self.project_tasks = {}
+
+    def put(self, doc_type, record):
+        values, summary = _document(doc_type, record)
+        doc_id = record["id"]
+        self.indexes[doc_type].add(doc_id, values)
+        self.summaries[doc_type][doc_id] = summary
+        if doc_type == "task":
+            self.project_tasks.setdefault(summary["project_id"], set()).add(doc_id)
+
+    def remove(self, doc_type, doc_id):
+        self.indexes[doc_type].remove(doc_id)
+        summary = self.summaries[doc_type].pop(doc_id, None)
+        if doc_type == "task" and summary is not None:
+            self.project_tasks.get(summary["project_id"], set()).discard(doc_id)
+        elif doc_type == "project":
+            for task_id in self.project_tasks.pop(doc_id, ()):
+                self.indexes["task"].remove(task_id)
+                self.summaries["task"].pop(task_id, None)
+
+    def clear(self, doc_type):
+        self.indexes[doc_type] = InvertedIndex(_FIELDS)
+        self.summaries[doc_type] = {}
+
+    def apply(self, event):
+        """应用一个变更事件"""
+        doc_type = _COLLECTION_TYPES.get(event["collection"])
+        if doc_type is None:
+            return
+        if event["op"] == "clear":
+            self.clear(doc_type)
+        elif event["op"] == "delete":
+            self.remove(doc_type, event["id"])
+        else:
+            self.put(doc_type, event["data"])
+
+
+class GlobalSearch:
+    """全局检索：按类型分开的倒排索引，按变更序列增量维护
+
+    查询结果为结果摘要（类型、id、标题、创建时间等，任务带 project_id 和 due_date，
+    消息带 session_id），按相关度排序；IDF 按所有参与查询的索引合并计算，不同类型的得分可以比较。
+    """
+
+    def __init__(self, notes, todos, projects, chat, change_feed):
+        self.notes = notes
+        self.todos = todos
+        self.projects = projects
+        self.chat = chat
+        self.change_feed = change_feed
+        # 当前使用的索引，None 表示尚未建立
+        self.current = None
+        # current 已应用到的变更序号
+        self.seq = None
+        self._lock = threading.Lock()
+        self._reset_build_state()
+
+    def _reset_build_state(self):
+        self._pid = os.getpid()
+        self._building = threading.Lock()
+        self._ready = threading.Event()
+
+    # ---- 维护 ----
+
+    def start(self):
+        """在后台线程中建立索引（已有建立任务时不重复启动），应用启动时调用"""
+        if self._pid != os.getpid():
+            # fork 之前启动的建立线程不会出现在子进程中
+            self._reset_build_state()
+        if self._building.acquire(blocking=False):
+            self._ready.clear()
+            threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            # 从建立前的序号开始应用变更（重复应用的事件不影响结果）
+            seq = self.change_feed.last_seq
+            built = self._build()
+            with self._lock:
+                self.current, self.seq = built, seq
+        finally:
+            self._building.release()
+            self._ready.set()
+
+    def _build(self):
+        """由各集合的数据建立一套新的索引
+
+        不持有本对象的锁，查询照常使用原来的索引；集合的读锁只在读取一批数据时持有，不长时间阻塞写入。
+        """
+        built = _Indexes()
+        with self.todos.lock.read():
+            todos = self.todos.todos_index.records
+        for todo in todos:
+            built.put("todo", todo)
+        with self.projects.lock.read():
+            projects = self.projects.projects_index.records
+        for project in projects:
+            built.put("project", project)
+            with self.projects.lock.read():
+                tasks = list(self.projects.tasks.peek(project["id"]))
+            for task in tasks:
+                built.put("task", task)
+        after = None
+        while True:
+            with self.chat.lock.read():
+                try:
+                    batch = list(itertools.islice(self.chat.log.iter_forward(after), _BUILD_BATCH))
+                except InvalidCursor:
+                    # 聊天记录已被清空，之后应用的清空事件会处理
+                    break
+            for message in batch:
+                built.put("message", message)
+            if len(batch) < _BUILD_BATCH:
+                break
+            after = batch[-1]["id"]
+        return built
+
+    def _catch_up(self):
+        """应用上次之后的变更事件（调用方持有 self._lock）；事件已过期时在后台重新建立"""
+        events = self.change_feed.since(self.seq)
+        if events is None:
+            self.start()
+            return
+        for line in events:
+            event = json_codec.loads(line)
+            self.seq = event["seq"]
+            self.current.apply(event)
+
+    # ---- 查询 ----
+
+    def search(self, query, types=None, created_from=None, created_to=None, due_from=None, due_to=None,
+               limit=20):
+        """在 types（默认全部类型）中检索，返回按相关度排序的结果摘要
+
+        created_from/created_to 过滤创建时间（消息为发送时间），due_from/due_to 过滤截止日期
+        （只有任务有截止日期，指定时只返回截止日期在范围内的任务），都是闭区间，可以只给日期。
+        索引尚未建立完成时等待后台的建立任务。
+        """
+        if self.current is None:
+            self.start()
+            self._ready.wait()
+            if self.current is None:
+                raise RuntimeError("全局检索索引建立失败")
+
+        types = [doc_type for doc_type in TYPES if types is None or doc_type in types]
+        if due_from or due_to:
+            types = [doc_type for doc_type in types if doc_type in _DUE_TYPES]
+        created = created_from or created_to
+        due = due_from or due_to
+
+        def matches(summary):
+            if created and not in_time_range(summary.get("created_at"), created_from, created_to):
+                return False
+            if due and not in_time_range(summary.get("due_date"), due_from, due_to):
+                return False
+            return True
+
+        hits = []
+        tokens = set(tokenize(query, unigrams=False))
+        with self._lock:
+            self._catch_up()
+            current = self.current
+            indexes = {doc_type: current.indexes[doc_type] for doc_type in types if doc_type != "note"}
+            if "note" in types:
+                indexes["note"] = self.notes.search_index
+            # 按参与查询的全部索引计算IDF
+            total = sum(len(index) for index in indexes.values())
+            doc_freq = {token: sum(index.doc_freq(token) for index in indexes.values()) for token in tokens}
+
+            for doc_type in types:
+                if doc_type == "note":
+                    continue
+                summaries = current.summaries[doc_type]
+                match = (lambda doc_id: matches(summaries[doc_id])) if created or due else None
+                for doc_id, score in indexes[doc_type].search(query, limit, match, total, doc_freq):
+                    hits.append((doc_type, doc_id, score, summaries[doc_id]))
+
+        if "note" in types:
+            with self.notes.lock.read():
+                notes_index = self.notes.notes_index
+
+                def note_summary(note):
+                    return {"title": note["title"], "created_at": note.get("created_at")}
+
+                def match_note(doc_id):
+                    note = notes_index.get(doc_id)
+                    return note is not None and matches(note_summary(note))
+
+                for doc_id, score in indexes["note"].search(query, limit, match_note, total, doc_freq):
+                    hits.append(("note", doc_id, score, note_summary(notes_index.get(doc_id))))
+
+        return [{"type": doc_type, "id": doc_id, **summary, "score": round(score, 3)}
+                for doc_type, doc_id, score, summary in heapq.nlargest(limit, hits, key=itemgetter(2))]
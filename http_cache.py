@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_etag(collection, generation, path):
+    """由集合名、集合代数和请求路径（含查询参数）生成弱ETag
+
+    集合的每次写入都会递增代数，因此数据变化后ETag随之变化；
+    代数记录在锁文件中，多个进程对同一数据生成相同的ETag。
+    """
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:12]
+    return f'W/"{collection}-{generation}-{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """判断 If-None-Match 请求头是否包含给定的ETag（弱比较）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def accepted_encodings(accept_encoding):
+    """解析 Accept-Encoding 请求头，返回客户端接受的编码集合（忽略 q=0 的编码）"""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(accept_encoding):
+    """根据 Accept-Encoding 选择压缩方式：优先 br（需要安装 brotli），其次 gzip"""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    """按指定方式压缩响应体"""
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class ResponseBodyCache:
+    """序列化后的响应体缓存（LRU）
+
+    键为ETag，值为未压缩的响应体、需要保留的响应头以及按需生成的压缩版本。
+    集合写入后代数变化，旧的ETag不会再被请求，由LRU自然淘汰。
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回 (响应体, 响应头)，未缓存时返回None"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry["body"], entry["headers"]
+
+    def put(self, key, body, headers):
+        """缓存响应体"""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self.entries[key] = {"body": body, "headers": headers, "encoded": {}}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def encoded(self, key, body, encoding):
+        """返回压缩后的响应体，已缓存的响应对每种压缩方式只压缩一次"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and encoding in entry["encoded"]:
+                return entry["encoded"][encoding]
+        data = compress(body, encoding)
+        if entry is not None:
+            with self._lock:
+                entry["encoded"][encoding] = data
+        return data
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import datetime
+import threading
+from collections import deque
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 多模式匹配自动机
+
+    patterns 为 [(关键词, 优先级)]，优先级数值越小越优先。
+    一次扫描文本即可找出命中的最高优先级，耗时只与文本长度有关，与关键词数量无关。
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        # 每个状态（包括沿失败链可达的状态）命中的最高优先级，None表示没有命中
+        self.best = [None]
+        for keyword, priority in patterns:
+            if keyword:
+                self._insert(keyword, priority)
+        self._link()
+
+    def _insert(self, keyword, priority):
+        state = 0
+        for ch in keyword:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.best.append(None)
+            state = nxt
+        if self.best[state] is None or priority < self.best[state]:
+            self.best[state] = priority
+
+    def _link(self):
+        """按广度优先计算失败链接，并把失败链上的命中合并到每个状态"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                inherited = self.best[self.fail[nxt]]
+                if inherited is not None and (self.best[nxt] is None or inherited < self.best[nxt]):
+                    self.best[nxt] = inherited
+
+    def search(self, text):
+        """返回文本中命中的最高优先级，没有命中时返回None"""
+        goto, fail, best = self.goto, self.fail, self.best
+        state = 0
+        found = None
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            priority = best[state]
+            if priority is not None and (found is None or priority < found):
+                found = priority
+                if found == 0:
+                    break
+        return found
+
+
+class IntentMatcher:
+    """基于配置文件的意图匹配器（用于聊天的备用回复）
+
+    配置文件格式：{"default": 默认回复, "intents": [{"name", "keywords", "response"}, ...]}，
+    intents 中越靠前的意图优先级越高，关键词不区分大小写、按子串匹配。
+    回复中的 {now} 替换为当前时间。
+    每隔 check_interval 秒检查一次文件修改时间，文件变化后自动重新加载；
+    新配置无效时继续使用原有配置。
+    """
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        # (自动机, 意图列表, 默认回复) 整体替换，匹配时无需加锁
+        self._table = (KeywordAutomaton([]), [], "")
+        self.reload()
+
+    @staticmethod
+    def compile(config):
+        """把意图配置编译为 (自动机, 意图列表, 默认回复)"""
+        intents = config.get("intents", [])
+        patterns = []
+        for priority, intent in enumerate(intents):
+            if not intent.get("response"):
+                raise ValueError(f"意图缺少回复: {intent.get('name')}")
+            patterns.extend((keyword.lower(), priority) for keyword in intent.get("keywords", []))
+        return KeywordAutomaton(patterns), intents, config.get("default", "")
+
+    def reload(self):
+        """重新加载配置文件，返回是否加载成功"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                # 加载失败时同样记录修改时间，文件再次修改前不重复尝试
+                self._mtime = os.path.getmtime(self.path)
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._table = self.compile(json.load(f))
+                return True
+            except Exception as e:
+                print(f"加载意图配置失败: {e}")
+                return False
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def respond(self, text):
+        """返回命中意图的回复，没有命中时返回默认回复"""
+        self._maybe_reload()
+        automaton, intents, default = self._table
+        priority = automaton.search(text.lower())
+        response = intents[priority]["response"] if priority is not None else default
+        if "{now}" in response:
+            response = response.replace("{now}", datetime.datetime.now().strftime("%Y年%m月%d日 %H:%M:%S"))
+        return response
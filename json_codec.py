@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""JSON编解码
+
+安装了 orjson 时使用 orjson，否则使用标准库 json（JSON_BACKEND=stdlib 时强制使用标准库）。
+两种实现的输出相同：紧凑格式、非ASCII字符不转义、非字符串的键（如 None）转为字符串。
+数据文件默认以紧凑格式保存，设置 JSON_PRETTY=true 时缩进两格，便于调试时直接查看。
+解析失败时抛出 json.JSONDecodeError（orjson 的异常是它的子类）。
+"""
+
+import os
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.getenv('JSON_BACKEND', 'auto') == 'stdlib':
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "stdlib"
+PRETTY = os.getenv('JSON_PRETTY', '').lower() in ('true', '1', 'yes')
+
+
+def dumps_bytes(value, pretty=False, sort_keys=False, default=None):
+    """序列化为UTF-8编码的 bytes"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(value, default=default, option=option)
+    return dumps(value, pretty, sort_keys, default).encode("utf-8")
+
+
+def dumps(value, pretty=False, sort_keys=False, default=None):
+    """序列化为 str"""
+    if orjson is not None:
+        return dumps_bytes(value, pretty, sort_keys, default).decode("utf-8")
+    if pretty:
+        return json.dumps(value, ensure_ascii=False, indent=2, sort_keys=sort_keys, default=default)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys, default=default)
+
+
+def loads(data):
+    """解析 str 或 bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load(f):
+    """解析文件对象的全部内容"""
+    return loads(f.read())
+
+
+def write_file(f, value):
+    """把值写入以二进制模式打开的数据文件（是否缩进由 JSON_PRETTY 决定）"""
+    f.write(dumps_bytes(value, pretty=PRETTY))
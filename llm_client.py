@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class UpstreamBusy(Exception):
+    """并发请求数已达上限，等待超时"""
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中日韩等宽字符每字约1个，其他字符每4个约1个"""
+    wide = sum(1 for ch in text if ord(ch) >= 0x2e80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def message_tokens(message):
+    """估算一条消息的token数（包括角色等固定开销）"""
+    return estimate_tokens(message.get("content") or "") + 4
+
+
+def trim_to_budget(messages, budget):
+    """从最新的消息往前保留，总token数不超过 budget（最新一条总是保留）
+
+    返回 (保留的消息, 保留的token数)，保留的消息按原顺序排列。
+    """
+    kept = []
+    used = 0
+    for message in reversed(messages):
+        cost = message_tokens(message)
+        if kept and used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    return kept, used
+
+
+class _Flight:
+    """一次进行中的上游请求，相同请求的其他调用者等待它的结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """带TTL的LRU回复缓存，并把并发的相同请求合并为一次上游调用
+
+    键是模型、消息和参数规范化（Unicode NFKC、合并空白）后的哈希。
+    hits 为命中缓存的次数，coalesced 为等待其他进行中请求的次数，
+    misses 为实际发往上游的次数。
+    """
+
+    def __init__(self, capacity=512, ttl=300):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()  # 键 -> (过期时间, 回复)
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, messages, params):
+        """计算请求的缓存键"""
+        normalized = [
+            {"role": m.get("role", "user"),
+             "content": " ".join(unicodedata.normalize("NFKC", m.get("content") or "").split())}
+            for m in messages
+        ]
+        raw = json.dumps([model, normalized, params], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key):
+        """查询缓存，并计入命中/未命中次数"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value, elapsed=0.0):
+        """写入缓存，elapsed 为这次上游调用的耗时"""
+        with self._lock:
+            self.upstream_seconds += elapsed
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """返回缓存的回复；未命中时调用 compute，同一时刻相同的请求只调用一次"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            start = time.monotonic()
+            flight.value = compute()
+            self.put(key, flight.value, time.monotonic() - start)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self.inflight.pop(key, None)
+            flight.done.set()
+
+    def clear(self):
+        """清空缓存（不影响计数）"""
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        """缓存统计；saved_seconds 按上游平均耗时估算节省的时间"""
+        with self._lock:
+            served = self.hits + self.coalesced
+            total = served + self.misses
+            average = self.upstream_seconds / self.misses if self.misses else 0.0
+            return {
+                "size": len(self.entries),
+                "capacity": self.capacity,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round(served / total, 4) if total else 0.0,
+                "avg_upstream_seconds": round(average, 4),
+                "saved_seconds": round(served * average, 3)
+            }
+
+
+class CompletionClient:
+    """OpenAI 兼容的聊天补全客户端
+
+    复用一个带连接池的 requests.Session（keep-alive），对连接错误和 429/5xx 响应
+    按指数退避重试，并用信号量限制同时进行的上游请求数。
+    base_url 可以指向本地的模拟服务（scripts/stub_openai.py）用于测试。
+    提供 cache（ResponseCache）时，相同的请求直接返回缓存的回复。
+    """
+
+    def __init__(self, api_key, base_url="https://api.openai.com/v1", model="gpt-3.5-turbo",
+                 pool_size=10, max_concurrency=8, max_retries=2, backoff=0.5,
+                 timeout=30, queue_timeout=10, cache=None):
+        self.api_key = api_key
+        self.cache = cache
+        self.url = base_url.rstrip('/') + "/chat/completions"
+        self.model = model
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise UpstreamBusy("AI服务繁忙，请稍后再试")
+
+    def _payload(self, messages, stream, params):
+        return {"model": self.model, "messages": messages, "stream": stream,
+                "max_tokens": 500, "temperature": 0.7, **params}
+
+    def _cache_key(self, messages, params):
+        payload = self._payload(messages, False, params)
+        return self.cache.key(payload.pop("model"), payload.pop("messages"), payload)
+
+    def complete(self, messages, **params):
+        """请求完整回复，返回回复文本"""
+        if self.cache is None:
+            return self._complete(messages, params)
+        return self.cache.get_or_compute(self._cache_key(messages, params),
+                                         lambda: self._complete(messages, params))
+
+    def _complete(self, messages, params):
+        self._acquire()
+        try:
+            response = self.session.post(self.url, json=self._payload(messages, False, params),
+                                         timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+        if response.status_code == 200:
+            result = response.json()
+            return result['choices'][0]['message']['content'].strip()
+        raise Exception(f"API调用失败: {response.status_code}")
+
+    def stream(self, messages, **params):
+        """流式请求回复，逐段产出上游返回的文本增量
+
+        命中缓存时一次产出完整回复；完整接收的流式回复会写入缓存。
+        """
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(messages, params)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        start = time.monotonic()
+        self._acquire()
+        try:
+            with self.session.post(self.url, json=self._payload(messages, True, params),
+                                   timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    raise Exception(f"API调用失败: {response.status_code}")
+                # text/event-stream 未声明字符集时 requests 会按 latin-1 解码
+                if 'charset' not in response.headers.get('Content-Type', ''):
+                    response.encoding = 'utf-8'
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+        finally:
+            self._slots.release()
+
+        if key is not None and parts:
+            self.cache.put(key, "".join(parts).strip(), time.monotonic() - start)
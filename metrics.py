@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""进程内指标（Prometheus 文本格式）
+
+提供计数器、直方图和在采集时计算的回调指标。指标保存在各自进程的内存中，
+多进程部署时每个 worker 分别暴露自己的指标。
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# 延迟（秒）和大小（字节）的默认分桶
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, key), value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """分桶直方图，输出 _bucket、_sum 和 _count"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # 标签值 -> [各桶计数..., +Inf桶计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            series_items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                result.append((self.name + "_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            result.append((self.name + "_sum", labels, series[-1]))
+            result.append((self.name + "_count", labels, cumulative))
+        return result
+
+
+class CallbackMetric:
+    """采集时调用 callback 取值的指标，callback 返回 [(标签字典, 值)]
+
+    用于暴露各个缓存自己维护的命中计数等已有状态。
+    """
+
+    def __init__(self, name, help, callback, type="gauge"):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.callback = callback
+
+    def samples(self):
+        result = []
+        for labels, value in self.callback():
+            names = tuple(sorted(labels))
+            result.append((self.name, _format_labels(names, [labels[n] for n in names]), value))
+        return result
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, callback, type="gauge"):
+        return self.register(CallbackMetric(name, help, callback, type))
+
+    def render(self):
+        """输出 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics)
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"采集指标失败 {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "HTTP请求处理耗时", ("method", "route", "status"))
+HTTP_REQUEST_BYTES = registry.histogram(
+    "http_request_size_bytes", "HTTP请求体大小", ("method", "route"), SIZE_BUCKETS)
+HTTP_RESPONSE_BYTES = registry.histogram(
+    "http_response_size_bytes", "HTTP响应体大小（压缩后）", ("method", "route"), SIZE_BUCKETS)
+STORAGE_SECONDS = registry.histogram(
+    "storage_io_duration_seconds", "存储读写耗时", ("collection", "operation"))
+UPSTREAM_SECONDS = registry.histogram(
+    "upstream_request_duration_seconds", "AI服务调用耗时", ("mode", "outcome"))
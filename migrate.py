@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""把数据目录（DATA_DIR）的 notes/、todos/、projects/、chats/ 中的JSON数据一次性迁移到SQLite
+
+用法: python migrate.py [--db workspace.db]
+迁移完成后以 STORAGE_BACKEND=sqlite 启动应用。笔记正文仍保存在 notes 目录中。
+"""
+
+import os
+import sys
+import argparse
+
+from storage import (DATA_DIR, JsonFileBackend, SegmentedLog, SqliteDatabase, SqliteBackend,
+                     SqliteTaskStore, load_json_records, sqlite_path)
+
+
+def migrate(db_path):
+    """执行迁移，返回每个集合迁移的记录数"""
+    db = SqliteDatabase.open(db_path)
+    counts = {}
+
+    collections = [
+        ("notes", os.path.join(DATA_DIR, "notes", "index.json")),
+        ("todos", os.path.join(DATA_DIR, "todos", "todos.json")),
+        ("projects", os.path.join(DATA_DIR, "projects", "projects.json")),
+        ("chat_sessions", os.path.join(DATA_DIR, "chats", "sessions.json")),
+    ]
+    for table, path in collections:
+        records = load_json_records(path)
+        SqliteBackend(db, table).snapshot(records)
+        counts[table] = len(records)
+
+    # 聊天记录：分段存储（旧版本为单个 chat_history.json）
+    segments_dir = os.path.join(DATA_DIR, "chats", "segments")
+    if os.path.isdir(segments_dir):
+        messages = list(SegmentedLog(segments_dir).iter_forward())
+    else:
+        messages = load_json_records(os.path.join(DATA_DIR, "chats", "chat_history.json"))
+    SqliteBackend(db, "chat_messages").snapshot(messages)
+    counts["chat_messages"] = len(messages)
+
+    # 每个项目的任务文件
+    task_store = SqliteTaskStore(db)
+    tasks_dir = os.path.join(DATA_DIR, "projects", "tasks")
+    counts["tasks"] = 0
+    if os.path.isdir(tasks_dir):
+        for filename in sorted(os.listdir(tasks_dir)):
+            if not filename.endswith(".json"):
+                continue
+            project_id = filename[:-len(".json")]
+            tasks = JsonFileBackend(os.path.join(tasks_dir, filename)).load()
+            task_store.save(project_id, tasks)
+            counts["tasks"] += len(tasks)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="迁移JSON数据到SQLite")
+    parser.add_argument("--db", default=sqlite_path(), help="SQLite数据库文件路径")
+    args = parser.parse_args()
+
+    counts = migrate(args.db)
+    for table, count in counts.items():
+        print(f"{table}: {count} 条")
+    print(f"迁移完成: {args.db}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        sys.exit(1)
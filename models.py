@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""笔记、待办、项目、任务、会话和聊天消息的记录类型
+
+记录本身仍是普通字典：orjson 直接序列化字典，比任何需要回调的对象都快，存储层、
+接口和导出都按字典处理。记录类型只描述字段（类型注解）并在边界上整理数据：
+
+- new 创建记录，值为 UNSET 的字段省略（与原来不写这个键相同）；
+- from_dict/from_list 在加载时原地整理解析出的字典：状态、优先级、角色以及所属项目/会话的id
+  等取值有限的字段驻留（sys.intern），所有记录共用同一个字符串对象；与 created_at 相同的
+  时间字段共用同一个字符串对象。键名由 orjson 的键缓存共用；
+- validate 在接口入口处按字段的类型注解校验客户端提交的数据。
+"""
+
+import sys
+import typing
+from typing import ClassVar, Optional
+
+
+class _Unset:
+    """创建记录时表示省略字段的占位对象"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "UNSET"
+
+    def __bool__(self):
+        return False
+
+
+UNSET = _Unset()
+
+_TYPE_NAMES = {str: "字符串", bool: "布尔值", int: "整数", dict: "对象"}
+
+
+class Record:
+    """记录类型的基类（只包含类方法，记录本身是字典）"""
+
+    # 由 record 装饰器设置：字段名 -> 字段类型
+    _types: ClassVar[dict] = {}
+    # 子类设置：需要驻留的字段、与 created_at 共用字符串的时间字段、
+    # 客户端可以提交的字段、新建时必填的字段（字段名 -> 错误信息）、取值受限的字段
+    INTERNED: ClassVar[tuple] = ()
+    TIMESTAMPS: ClassVar[tuple] = ()
+    INPUT: ClassVar[tuple] = ()
+    REQUIRED: ClassVar[dict] = {}
+    CHOICES: ClassVar[dict] = {}
+
+    @classmethod
+    def new(cls, **fields):
+        """创建记录（省略值为 UNSET 的字段）"""
+        return cls.from_dict({name: value for name, value in fields.items() if value is not UNSET})
+
+    @classmethod
+    def from_dict(cls, data):
+        """原地整理字典（驻留取值有限的字段、共用时间字符串），返回同一个字典"""
+        cls.from_list((data,))
+        return data
+
+    @classmethod
+    def from_list(cls, records):
+        """原地整理字典列表，返回同一个列表（加载时对每条记录调用，循环内只用局部变量）"""
+        interned, timestamps, intern = cls.INTERNED, cls.TIMESTAMPS, sys.intern
+        for data in records:
+            for name in interned:
+                value = data.get(name)
+                if type(value) is str:
+                    data[name] = intern(value)
+            if timestamps:
+                created = data.get("created_at")
+                for name in timestamps:
+                    if created is not None and data.get(name) == created:
+                        data[name] = created
+        return records
+
+    @classmethod
+    def validate(cls, data, partial=False):
+        """校验客户端提交的数据，无效时抛出 ValueError
+
+        只检查 INPUT 中的字段：类型与注解一致、取值在 CHOICES 之内；
+        partial 为假（新建）时 REQUIRED 中的字段必须是非空值。其他字段忽略。
+        """
+        if not isinstance(data, dict):
+            raise ValueError("请求数据格式无效")
+        if not partial:
+            for name, message in cls.REQUIRED.items():
+                if not data.get(name):
+                    raise ValueError(message)
+        for name in cls.INPUT:
+            value = data.get(name)
+            if value is None:
+                continue
+            expected = cls._types[name]
+            # bool 是 int 的子类，整数字段不接受布尔值
+            if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+                raise ValueError(f"{name} 应为{_TYPE_NAMES.get(expected, expected.__name__)}")
+            choices = cls.CHOICES.get(name)
+            if choices and value not in choices:
+                raise ValueError(f"{name} 只能是 {'、'.join(choices)}")
+
+
+def record(cls):
+    """记录 Record 子类中注解的字段及其类型"""
+    types = {}
+    for name, hint in typing.get_type_hints(cls).items():
+        if typing.get_origin(hint) is ClassVar:
+            continue
+        # Optional[X] 校验时按 X 处理（None 表示未提供）
+        args = [arg for arg in typing.get_args(hint) if arg is not type(None)]
+        types[name] = args[0] if args else hint
+    cls._types = types
+    return cls
+
+
+PRIORITIES = ("low", "medium", "high")
+TASK_STATUSES = ("pending", "in_progress", "completed")
+# 新建表单的状态（active、completed、archived）和列表中显示的状态
+PROJECT_STATUSES = ("active", "planning", "in_progress", "on_hold", "completed", "archived")
+
+
+@record
+class Note(Record):
+    """笔记信息（正文由 NoteContentStore 保存）"""
+    id: str
+    title: str
+    created_at: str
+    updated_at: str
+    blob: str
+    size: int
+    version: int
+    # 旧格式的正文文件名
+    filename: str
+    # 正文只在请求中提交，由 NoteContentStore 保存，不在笔记信息中
+    content: str
+
+    TIMESTAMPS: ClassVar[tuple] = ("updated_at",)
+    INPUT: ClassVar[tuple] = ("title", "content")
+    REQUIRED: ClassVar[dict] = {"title": "标题和内容不能为空"}
+
+
+@record
+class Todo(Record):
+    """待办"""
+    id: str
+    title: str
+    completed: bool
+    created_at: str
+    updated_at: str
+    completed_at: str
+
+    TIMESTAMPS: ClassVar[tuple] = ("updated_at", "completed_at")
+    INPUT: ClassVar[tuple] = ("title", "completed")
+    REQUIRED: ClassVar[dict] = {"title": "待办标题不能为空"}
+
+
+@record
+class Project(Record):
+    """项目（stats 为任务统计，progress 为完成百分比）"""
+    id: str
+    name: str
+    description: str
+    status: str
+    created_at: str
+    updated_at: str
+    progress: int
+    stats: dict
+
+    INTERNED: ClassVar[tuple] = ("status",)
+    TIMESTAMPS: ClassVar[tuple] = ("updated_at",)
+    INPUT: ClassVar[tuple] = ("name", "description", "status")
+    REQUIRED: ClassVar[dict] = {"name": "项目名称不能为空"}
+    CHOICES: ClassVar[dict] = {"status": PROJECT_STATUSES}
+
+
+@record
+class Task(Record):
+    """项目任务"""
+    id: str
+    project_id: str
+    title: str
+    description: str
+    status: str
+    priority: str
+    due_date: Optional[str]
+    created_at: str
+    updated_at: str
+    completed_at: str
+
+    INTERNED: ClassVar[tuple] = ("project_id", "status", "priority")
+    TIMESTAMPS: ClassVar[tuple] = ("updated_at", "completed_at")
+    INPUT: ClassVar[tuple] = ("title", "description", "status", "priority", "due_date")
+    REQUIRED: ClassVar[dict] = {"title": "任务标题不能为空"}
+    CHOICES: ClassVar[dict] = {"status": TASK_STATUSES, "priority": PRIORITIES}
+
+
+@record
+class Session(Record):
+    """聊天会话（summary_until 为摘要已覆盖到的最后一条消息的时间）"""
+    id: str
+    title: str
+    created_at: str
+    updated_at: str
+    message_count: int
+    summary: Optional[str]
+    summary_until: Optional[str]
+
+    TIMESTAMPS: ClassVar[tuple] = ("updated_at",)
+    INPUT: ClassVar[tuple] = ("title",)
+
+
+@record
+class Message(Record):
+    """聊天消息"""
+    id: str
+    role: str
+    content: str
+    timestamp: str
+    session_id: str
+
+    INTERNED: ClassVar[tuple] = ("role", "session_id")
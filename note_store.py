@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import uuid
+import datetime
+
+from storage import DATA_DIR, CollectionLock, IndexedCollection, open_backend
+from search import InvertedIndex
+from blobs import NoteContentStore
+from changes import open_change_feed
+from models import Note
+from metrics import STORAGE_SECONDS
+
+# 由正文存储维护的字段，导出时省略，导入时忽略
+NOTE_INTERNAL_FIELDS = ("content", "blob", "size", "version", "filename")
+
+
+class NoteStore:
+    """笔记存储：索引、正文、版本历史和全文检索
+
+    Web服务和命令行记事本共用这一实现，所有修改都在集合锁内进行并记录到变更序列，
+    多个进程同时读写同一数据目录时互不覆盖。
+    """
+
+    def __init__(self, change_feed=None):
+        # 创建笔记存储目录
+        self.notes_dir = os.path.join(DATA_DIR, "notes")
+        if not os.path.exists(self.notes_dir):
+            os.makedirs(self.notes_dir)
+        
+        # 笔记详情只内联不超过 NOTE_INLINE_MAX 字节的正文，更大的正文通过 /content 接口按需读取
+        self.preview_chars = int(os.getenv('NOTE_PREVIEW_CHARS', 500))
+        self.inline_max = int(os.getenv('NOTE_INLINE_MAX', 65536))
+        
+        # 正文按内容分块去重保存，每次修改记录一个版本
+        self.contents = NoteContentStore(
+            self.notes_dir,
+            max_versions=int(os.getenv('NOTE_MAX_VERSIONS', 0)),
+            compress=os.getenv('NOTE_COMPRESS_CHUNKS', 'true').lower() in ('true', '1', 'yes'),
+            gc_threshold=int(os.getenv('NOTE_GC_THRESHOLD', 1000))
+        )
+        
+        # 笔记索引文件
+        self.index_file = os.path.join(self.notes_dir, "index.json")
+        self.store = open_backend(self.index_file, "notes")
+        self.notes_index = IndexedCollection(self.load_index())
+        self.lock = CollectionLock(self.store.lock_path, self.reload_index)
+        
+        # 全文检索索引（标题权重高于正文）
+        self.search_index = InvertedIndex(
+            {"title": 3, "content": 1},
+            path=os.path.join(self.notes_dir, "search_index.json"),
+            save_interval=float(os.getenv('SEARCH_INDEX_SAVE_INTERVAL', 5))
+        )
+        self.sync_search_index()
+        
+        self.change_feed = change_feed if change_feed is not None else open_change_feed()
+    
+    def load_index(self):
+        """加载笔记索引"""
+        with STORAGE_SECONDS.time(collection="notes", operation="load"):
+            return Note.from_list(self.store.load())
+    
+    def reload_index(self):
+        """其他进程修改数据后重新加载笔记索引"""
+        self.notes_index = IndexedCollection(self.load_index())
+        self.sync_search_index()
+    
+    def _index_note(self, note, content):
+        """把笔记加入检索索引（签名为正文的内容标识，用于判断检索索引是否过期）"""
+        self.search_index.add(note["id"], {"title": note["title"], "content": content},
+                              sig=self.contents.signature(note))
+    
+    def sync_search_index(self):
+        """让检索索引与笔记索引保持一致，只重新索引有变化的笔记"""
+        for note in self.notes_index:
+            signature = self.contents.signature(note)
+            if signature is None:
+                continue
+            if self.search_index.signature(note["id"]) != signature:
+                self._index_note(note, self.contents.read(note))
+        for doc_id in list(self.search_index.docs):
+            if doc_id not in self.notes_index:
+                self.search_index.remove(doc_id)
+    
+    def save_index(self, puts=(), deletes=()):
+        """保存笔记索引的变更"""
+        self.lock.changed()
+        with STORAGE_SECONDS.time(collection="notes", operation="save"):
+            self.store.write(puts, deletes, self.notes_index)
+    
+    def _new_note(self, title, content):
+        """写入正文并把笔记加入内存索引（不持久化索引）"""
+        # 生成笔记ID和时间戳
+        timestamp = datetime.datetime.now().isoformat()
+        note_id = str(uuid.uuid4())
+        
+        note_info = Note.new(
+            id=note_id,
+            title=title,
+            created_at=timestamp,
+            updated_at=timestamp
+        )
+        
+        # 写入笔记内容（记录第一个版本）
+        self.contents.save(note_info, content)
+        
+        self.notes_index.add(note_info)
+        self._index_note(note_info, content)
+        return note_info
+    
+    def create_note(self, title, content):
+        """创建新笔记"""
+        with self.lock.write():
+            note_info = self._new_note(title, content)
+            self.save_index(puts=[note_info])
+            self.change_feed.publish([("notes", "create", note_info)])
+            return note_info
+    
+    def create_notes(self, items):
+        """批量创建笔记，items 为 (标题, 正文) 序列
+        
+        在一次加锁内完成，索引只持久化一次，变更一次性记录。返回创建的笔记列表。
+        """
+        with self.lock.write():
+            created = [self._new_note(title, content) for title, content in items]
+            if created:
+                self.save_index(puts=created)
+                self.change_feed.publish([("notes", "create", note) for note in created])
+            return created
+
+    def import_notes(self, records):
+        """按id批量写入笔记（不存在时新建，存在时覆盖），records 中每条带有 content
+
+        正文有变化时记录新版本；索引只持久化一次，变更一次性记录。返回新建和更新的数量。
+        """
+        with self.lock.write():
+            changes = []
+            for record in records:
+                fields = {key: value for key, value in record.items() if key not in NOTE_INTERNAL_FIELDS}
+                note = self.notes_index.get(record["id"])
+                if note is None:
+                    note = Note.from_dict(fields)
+                    self.contents.save(note, record["content"])
+                    self.notes_index.add(note)
+                    changes.append(("notes", "create", note))
+                else:
+                    self.contents.save(note, record["content"], fields["title"])
+                    note.update(fields)
+                    self.notes_index.touch(note)
+                    changes.append(("notes", "update", note))
+                self._index_note(note, record["content"])
+            if changes:
+                self.save_index(puts=[note for _, _, note in changes])
+                self.change_feed.publish(changes)
+            created = sum(1 for _, op, _ in changes if op == "create")
+            return {"created": created, "updated": len(changes) - created}
+    
+    def list_notes(self):
+        """列出所有笔记"""
+        with self.lock.read():
+            return self.notes_index.sorted()
+    
+    def query_notes(self, after=None, limit=None, created_from=None, created_to=None):
+        """分页查询笔记，返回 (本页笔记, 下一页游标)"""
+        with self.lock.read():
+            if self.store.supports_query:
+                notes, cursor = self.store.query(after, limit, created_from=created_from, created_to=created_to)
+                return Note.from_list(notes), cursor
+            return self.notes_index.page(after, limit, created_from=created_from, created_to=created_to)
+    
+    def _with_content(self, record, note):
+        """在笔记（或版本）信息中加入正文大小和预览，正文不超过 inline_max 字节时一并加入正文"""
+        size = self.contents.size(note)
+        with self.contents.open(note) as f:
+            if size <= self.inline_max:
+                content = f.read()
+                return {**record, "size": size, "preview": content[:self.preview_chars], "content": content}
+            return {**record, "size": size, "preview": f.read(self.preview_chars)}
+    
+    def get_note(self, note_id):
+        """获取笔记信息、正文大小和预览，正文不超过 inline_max 字节时一并返回"""
+        with self.lock.read():
+            note = self.notes_index.get(note_id)
+            if note and self.contents.exists(note):
+                return self._with_content(note, note)
+            return None
+    
+    def _open_content(self, note, gzip_ok):
+        """打开正文，返回 (二进制文件对象, 字节数, 签名, 内容编码)"""
+        raw = self.contents.open_raw(note) if gzip_ok else None
+        if raw is not None:
+            return raw, os.fstat(raw.fileno()).st_size, f"{self.contents.signature(note)}-gz", 'gzip'
+        signature = self.contents.signature(note)
+        return self.contents.open(note, binary=True), self.contents.size(note), signature, None
+    
+    def open_note_content(self, note_id, gzip_ok=False):
+        """打开笔记正文，返回 (二进制文件对象, 字节数, 签名, 内容编码)，笔记不存在时返回None
+        
+        在锁内打开，之后的修改写入新的内容；文件对象关闭前持有分块存储的 pin，
+        删除笔记或版本后的回收推迟到关闭之后，已打开的内容可以读完。
+        gzip_ok 为真且正文是旧格式的压缩文件时直接返回gzip数据（字节数为压缩后的大小，编码为 gzip），
+        否则返回解压后的正文（编码为None）。
+        """
+        with self.lock.read():
+            note = self.notes_index.get(note_id)
+            if not note:
+                return None
+            try:
+                return self._open_content(note, gzip_ok)
+            except FileNotFoundError:
+                return None
+    
+    def update_note(self, note_id, title, content):
+        """更新笔记"""
+        with self.lock.write():
+            note = self.notes_index.get(note_id)
+            if note:
+                if self.contents.exists(note):
+                    # 更新笔记内容（记录新版本）
+                    self.contents.save(note, content, title)
+                
+                    # 更新索引
+                    note["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    self.notes_index.touch(note)
+                    self.save_index(puts=[note])
+                    self._index_note(note, content)
+                    self.change_feed.publish([("notes", "update", note)])
+                    return note
+            return None
+    
+    def delete_note(self, note_id):
+        """删除笔记"""
+        with self.lock.write():
+            note = self.notes_index.get(note_id)
+            if note:
+                # 删除笔记正文和版本历史
+                self.contents.drop(note)
+            
+                # 更新索引
+                deleted_note = self.notes_index.remove(note_id)
+                self.save_index(deletes=[note_id])
+                self.search_index.remove(note_id)
+                self.change_feed.publish([("notes", "delete", deleted_note)])
+                return deleted_note
+            return None
+
+    def list_versions(self, note_id):
+        """笔记的版本列表（从新到旧），笔记不存在时返回None"""
+        with self.lock.read():
+            note = self.notes_index.get(note_id)
+            if not note:
+                return None
+            versions = self.contents.versions(note_id)
+            return [{**version, "current": version["version"] == note.get("version")}
+                    for version in reversed(versions)]
+    
+    def get_version(self, note_id, number):
+        """获取指定版本的信息、大小和预览（正文不大时一并返回），不存在时返回None"""
+        with self.lock.read():
+            version = self.contents.get_version(note_id, number) if note_id in self.notes_index else None
+            if version:
+                return self._with_content(version, version)
+            return None
+    
+    def open_version_content(self, note_id, number):
+        """打开指定版本的正文，返回值同 open_note_content"""
+        with self.lock.read():
+            version = self.contents.get_version(note_id, number) if note_id in self.notes_index else None
+            if version:
+                return self._open_content(version, False)
+            return None
+    
+    def restore_version(self, note_id, number):
+        """把笔记恢复到指定版本（记录为新版本），返回更新后的笔记，笔记或版本不存在时返回None"""
+        with self.lock.write():
+            note = self.notes_index.get(note_id)
+            if note and self.contents.restore(note, number):
+                note["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.notes_index.touch(note)
+                self.save_index(puts=[note])
+                self._index_note(note, self.contents.read(note))
+                self.change_feed.publish([("notes", "update", note)])
+                return note
+            return None
+    
+    def search_notes(self, query, limit=20):
+        """全文检索笔记，按相关度返回笔记信息"""
+        with self.lock.read():
+            results = []
+            for note_id, score in self.search_index.search(query, limit):
+                note = self.notes_index.get(note_id)
+                if note:
+                    results.append({**note, "score": round(score, 3)})
+            return results
@@ -1,77 +1,40 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
-import datetime
-import json
+"""个人记事本（命令行）
+
+不带参数时进入交互菜单；带子命令时执行一次操作后退出，便于脚本调用：
+
+    python notebook.py add 标题 [--content 正文]    正文省略时从标准输入读取
+    python notebook.py list [--limit N] [--json]
+    python notebook.py show ID [--json]
+    python notebook.py search 关键词 [--limit N] [--json]
+    python notebook.py import < notes.jsonl        每行一个 {"title": ..., "content": ...}，也可以是JSON数组
+
+add 和 import 在标准输出打印新笔记的ID。
+
+整个工作区（笔记、待办、项目、任务和聊天记录）的备份与迁移：
+
+    python notebook.py export-workspace [--format ndjson|tar] [-o 文件]
+    python notebook.py import-workspace [文件]      省略文件时从标准输入读取，格式根据文件头判断
+
+与Web服务共用同一个笔记存储（索引、正文、版本历史、检索索引和变更序列），
+服务运行时也可以安全使用。
+"""
+
 import sys
+import os
+import shutil
+import argparse
+
+from dotenv import load_dotenv
+
+import json_codec
+from note_store import NoteStore
+from stores import ChatStore, ProjectStore, TodoStore
+from changes import open_change_feed
+from workspace import FORMATS as WORKSPACE_FORMATS, Workspace
 
-class Notebook:
-    def __init__(self):
-        # 创建笔记存储目录
-        self.notes_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "notes")
-        if not os.path.exists(self.notes_dir):
-            os.makedirs(self.notes_dir)
-        
-        # 笔记索引文件
-        self.index_file = os.path.join(self.notes_dir, "index.json")
-        self.notes_index = self.load_index()
-    
-    def load_index(self):
-        """加载笔记索引"""
-        if os.path.exists(self.index_file):
-            try:
-                with open(self.index_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return []
-        return []
-    
-    def save_index(self):
-        """保存笔记索引"""
-        with open(self.index_file, 'w', encoding='utf-8') as f:
-            json.dump(self.notes_index, f, ensure_ascii=False, indent=2)
-    
-    def create_note(self, title, content):
-        """创建新笔记"""
-        # 生成笔记ID和时间戳
-        timestamp = datetime.datetime.now()
-        note_id = timestamp.strftime("%Y%m%d%H%M%S")
-        
-        # 创建笔记文件
-        note_filename = f"{note_id}.txt"
-        note_path = os.path.join(self.notes_dir, note_filename)
-        
-        # 写入笔记内容
-        with open(note_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        
-        # 更新索引
-        note_info = {
-            "id": note_id,
-            "title": title,
-            "created_at": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "filename": note_filename
-        }
-        self.notes_index.append(note_info)
-        self.save_index()
-        
-        return note_info
-    
-    def list_notes(self):
-        """列出所有笔记"""
-        return sorted(self.notes_index, key=lambda x: x["created_at"], reverse=True)
-    
-    def get_note(self, note_id):
-        """获取指定笔记内容"""
-        for note in self.notes_index:
-            if note["id"] == note_id:
-                note_path = os.path.join(self.notes_dir, note["filename"])
-                if os.path.exists(note_path):
-                    with open(note_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    return {**note, "content": content}
-        return None
 
 def print_menu():
     """打印主菜单"""
@@ -83,13 +46,44 @@ def print_menu():
     print("0. 退出")
     print("=" * 30)
 
-def main():
-    notebook = Notebook()
-    
+
+def format_time(value):
+    """把ISO格式的时间显示为 年-月-日 时:分:秒"""
+    return value[:19].replace("T", " ")
+
+
+def print_notes(notes):
+    """以表格形式打印笔记列表"""
+    print("-" * 80)
+    if not notes:
+        print("暂无笔记")
+    else:
+        print(f"{'ID':<36}  {'创建时间':<19}  {'标题'}")
+        print("-" * 80)
+        for note in notes:
+            print(f"{note['id']:<36}  {format_time(note['created_at']):<19}  {note['title']}")
+    print("-" * 80)
+
+
+def print_note(note):
+    """打印笔记内容"""
+    print("-" * 60)
+    print(f"标题: {note['title']}")
+    print(f"创建时间: {format_time(note['created_at'])}")
+    print("-" * 60)
+    print(note['content'])
+    print("-" * 60)
+
+
+def print_json(value):
+    print(json_codec.dumps(value))
+
+
+def interactive(notebook):
     while True:
         print_menu()
         choice = input("请选择操作 [0-3]: ")
-        
+
         if choice == "1":
             # 新建笔记
             print("\n新建笔记")
@@ -102,50 +96,186 @@ def main():
                     break
                 lines.append(line)
             content = "\n".join(lines)
-            
+
             note = notebook.create_note(title, content)
             print(f"\n笔记已保存! ID: {note['id']}")
-        
+
         elif choice == "2":
             # 查看笔记列表
-            notes = notebook.list_notes()
             print("\n笔记列表:")
-            print("-" * 60)
-            if not notes:
-                print("暂无笔记")
-            else:
-                print(f"{'ID':<15} {'创建时间':<20} {'标题'}")
-                print("-" * 60)
-                for note in notes:
-                    print(f"{note['id']:<15} {note['created_at']:<20} {note['title']}")
-            print("-" * 60)
-        
+            print_notes(notebook.list_notes())
+
         elif choice == "3":
             # 查看笔记内容
             note_id = input("请输入要查看的笔记ID: ")
-            note = notebook.get_note(note_id)
+            note = read_note(notebook, note_id)
             if note:
-                print("\n" + "-" * 60)
-                print(f"标题: {note['title']}")
-                print(f"创建时间: {note['created_at']}")
-                print("-" * 60)
-                print(note['content'])
-                print("-" * 60)
+                print()
+                print_note(note)
             else:
                 print("未找到该笔记!")
-        
+
         elif choice == "0":
             # 退出
             print("感谢使用个人记事本!")
             break
-        
+
         else:
             print("无效的选择，请重新输入!")
 
+
+def read_note(notebook, note_id):
+    """读取笔记信息和完整正文（不受 NOTE_INLINE_MAX 限制），笔记不存在时返回None"""
+    with notebook.lock.read():
+        note = notebook.notes_index.get(note_id)
+        if note and notebook.contents.exists(note):
+            return {**note, "content": notebook.contents.read(note)}
+        return None
+
+
+def read_import(stream):
+    """读取要导入的笔记：JSON数组，或每行一个JSON对象"""
+    text = stream.read()
+    if text.lstrip().startswith("["):
+        items = json_codec.loads(text)
+    else:
+        items = [json_codec.loads(line) for line in text.splitlines() if line.strip()]
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict) or "title" not in item or "content" not in item:
+            raise ValueError(f"第{number}条笔记缺少 title 或 content")
+    return [(str(item["title"]), str(item["content"])) for item in items]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="个人记事本")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("add", help="新建笔记")
+    p.add_argument("title", help="标题")
+    p.add_argument("--content", help="正文（省略时从标准输入读取）")
+
+    p = sub.add_parser("list", help="列出笔记（从新到旧）")
+    p.add_argument("--limit", type=int, help="最多列出的条数")
+    p.add_argument("--json", action="store_true", help="每行输出一条笔记的JSON")
+
+    p = sub.add_parser("show", help="查看笔记内容")
+    p.add_argument("id", help="笔记ID")
+    p.add_argument("--json", action="store_true", help="输出JSON")
+
+    p = sub.add_parser("search", help="全文检索")
+    p.add_argument("query", help="关键词")
+    p.add_argument("--limit", type=int, default=20, help="最多返回的条数")
+    p.add_argument("--json", action="store_true", help="每行输出一条笔记的JSON")
+
+    sub.add_parser("import", help="从标准输入批量导入笔记")
+
+    p = sub.add_parser("export-workspace", help="导出整个工作区")
+    p.add_argument("--format", choices=WORKSPACE_FORMATS, default="ndjson", help="导出格式")
+    p.add_argument("-o", "--output", help="输出文件（默认输出到标准输出）")
+
+    p = sub.add_parser("import-workspace", help="导入 export-workspace 导出的文件")
+    p.add_argument("file", nargs="?", help="导入文件（默认从标准输入读取）")
+    p.add_argument("--format", choices=WORKSPACE_FORMATS, help="导入格式（默认根据文件头判断）")
+    return parser
+
+
+def run_command(notebook, args):
+    """执行子命令，返回进程退出码"""
+    if args.command == "add":
+        content = args.content if args.content is not None else sys.stdin.read()
+        print(notebook.create_note(args.title, content)["id"])
+
+    elif args.command == "list":
+        if args.limit is not None:
+            notes = notebook.query_notes(limit=args.limit)[0]
+        else:
+            notes = notebook.list_notes()
+        if args.json:
+            for note in notes:
+                print_json(note)
+        else:
+            print_notes(notes)
+
+    elif args.command == "show":
+        note = read_note(notebook, args.id)
+        if not note:
+            print(f"未找到该笔记: {args.id}", file=sys.stderr)
+            return 1
+        if args.json:
+            print_json(note)
+        else:
+            print_note(note)
+
+    elif args.command == "search":
+        notes = notebook.search_notes(args.query, args.limit)
+        if args.json:
+            for note in notes:
+                print_json(note)
+        else:
+            print_notes(notes)
+
+    elif args.command == "import":
+        try:
+            items = read_import(sys.stdin)
+        except ValueError as e:
+            # json.JSONDecodeError 也是 ValueError
+            print(f"导入失败: {e}", file=sys.stderr)
+            return 1
+        created = notebook.create_notes(items)
+        for note in created:
+            print(note["id"])
+        print(f"已导入 {len(created)} 条笔记", file=sys.stderr)
+
+    return 0
+
+
+def run_workspace_command(args):
+    """执行工作区导出/导入，返回进程退出码"""
+    # 需要全部集合，直接创建各集合的存储（与服务共用数据目录、存储后端、锁和变更序列），不加载Web应用
+    change_feed = open_change_feed()
+    workspace = Workspace(NoteStore(change_feed), TodoStore(change_feed), ProjectStore(change_feed),
+                          ChatStore(change_feed), batch_size=int(os.getenv('IMPORT_BATCH_SIZE', 1000)))
+
+    if args.command == "export-workspace":
+        if args.output:
+            with open(args.output, "wb") as f:
+                workspace.export(f, args.format)
+        else:
+            # 先写入临时文件再输出，管道另一端读得慢时不会长时间占用锁
+            with workspace.snapshot(args.format) as f:
+                shutil.copyfileobj(f, sys.stdout.buffer)
+        return 0
+
+    try:
+        if args.file:
+            with open(args.file, "rb") as f:
+                result = workspace.import_stream(f, args.format)
+        else:
+            result = workspace.import_stream(sys.stdin.buffer, args.format)
+    except ValueError as e:
+        print(f"导入失败: {e}", file=sys.stderr)
+        return 1
+    print_json(result)
+    return 0
+
+
+def main(argv=None):
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    if args.command in ("export-workspace", "import-workspace"):
+        return run_workspace_command(args)
+    notebook = NoteStore()
+    if args.command is None:
+        interactive(notebook)
+        return 0
+    return run_command(notebook, args)
+
+
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except KeyboardInterrupt:
         print("\n程序已中断，感谢使用!")
     except Exception as e:
-        print(f"发生错误: {e}")
\ No newline at end of file
+        print(f"发生错误: {e}")
+        sys.exit(1)
@@ -0,0 +1,804 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""API基准与压测
+
+生成指定规模的合成数据，分别通过 Flask 测试客户端（单线程，测量处理耗时）和真实的WSGI服务
+（多线程并发）驱动 app.py 的全部路由，输出每个路由的 p50/p95/p99 延迟、吞吐量以及进程峰值内存。
+结果为JSON，可用 compare 子命令比较两个版本。AI服务由进程内的模拟服务（stub_openai.py）代替。
+
+用法:
+  python scripts/bench.py run [--profile small|medium|large] [--modes client,server] [--requests 50]
+                              [--concurrency 8] [--data-dir DIR] [--output result.json]
+  python scripts/bench.py seed --data-dir DIR [--profile small] [--notes 1000] [--messages 10000] ...
+  python scripts/bench.py compare old.json new.json [--threshold 0.2]
+
+不指定 --data-dir 时使用临时目录，结束后删除；数据目录中已有同样规模的数据时直接复用。
+存储后端由 STORAGE_BACKEND 环境变量决定，与应用相同。
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import shutil
+import signal
+import logging
+import platform
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPTS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+# 数据规模：笔记、待办、项目、每个项目的任务、聊天会话、聊天消息
+PROFILES = {
+    "small": {"notes": 1000, "todos": 1000, "projects": 100, "tasks": 100, "sessions": 20, "messages": 10000},
+    "medium": {"notes": 10000, "todos": 10000, "projects": 1000, "tasks": 200, "sessions": 100,
+               "messages": 100000},
+    "large": {"notes": 100000, "todos": 100000, "projects": 10000, "tasks": 1000, "sessions": 500,
+              "messages": 1000000},
+}
+COLLECTIONS = ("notes", "todos", "projects", "chat")
+MANIFEST = "bench_dataset.json"
+SAMPLE_SIZE = 200
+
+WORDS = ["项目", "会议", "计划", "预算", "设计", "测试", "发布", "客户", "需求", "文档", "周报", "复盘",
+         "python", "flask", "deploy", "release", "budget", "review", "roadmap", "backup", "cache", "index"]
+PRIORITIES = ("low", "medium", "high")
+STATUSES = ("pending", "in_progress", "completed")
+
+
+def _rss_bytes():
+    """当前进程的峰值常驻内存（字节）"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _timestamps(rng, count, days=365):
+    """过去 days 天内按时间递增的 count 个时间点"""
+    start = datetime.datetime.now() - datetime.timedelta(days=days)
+    step = days * 86400 / max(count, 1)
+    for i in range(count):
+        yield start + datetime.timedelta(seconds=i * step + rng.random() * step)
+
+
+# ---------------------------------------------------------------- 生成数据
+
+def seed_notes(data_dir, count, rng):
+    from blobs import NoteContentStore
+    from storage import open_backend
+    notes_dir = os.path.join(data_dir, "notes")
+    os.makedirs(notes_dir, exist_ok=True)
+    contents = NoteContentStore(notes_dir)
+    records = []
+    for created in _timestamps(rng, count):
+        note = {"id": _uuid(rng), "title": _text(rng, 3), "created_at": created.isoformat(),
+                "updated_at": created.isoformat()}
+        contents.save(note, _text(rng, rng.randint(30, 300)))
+        records.append(note)
+    open_backend(os.path.join(notes_dir, "index.json"), "notes").snapshot(records)
+    return {"notes": rng.sample([r["id"] for r in records], min(SAMPLE_SIZE, len(records)))}
+
+
+def seed_todos(data_dir, count, rng):
+    from storage import open_backend
+    todos_dir = os.path.join(data_dir, "todos")
+    os.makedirs(todos_dir, exist_ok=True)
+    records = []
+    for created in _timestamps(rng, count):
+        todo = {"id": _uuid(rng), "title": _text(rng, 4), "completed": rng.random() < 0.3,
+                "created_at": created.strftime("%Y-%m-%d %H:%M:%S")}
+        if todo["completed"]:
+            todo["completed_at"] = todo["created_at"]
+        records.append(todo)
+    open_backend(os.path.join(todos_dir, "todos.json"), "todos").snapshot(records)
+    return {"todos": rng.sample([r["id"] for r in records], min(SAMPLE_SIZE, len(records)))}
+
+
+def seed_projects(data_dir, count, tasks_per_project, rng):
+    from storage import open_backend, open_task_store
+    projects_dir = os.path.join(data_dir, "projects")
+    tasks_dir = os.path.join(projects_dir, "tasks")
+    os.makedirs(tasks_dir, exist_ok=True)
+    task_store = open_task_store(tasks_dir)
+    records = []
+    sample_tasks = []
+    for created in _timestamps(rng, count):
+        stamp = created.strftime("%Y-%m-%d %H:%M:%S")
+        project_id = _uuid(rng)
+        stats = {"total": 0, "completed": 0, "by_status": {}, "by_priority": {}}
+        tasks = []
+        for _ in range(tasks_per_project):
+            task = {"id": _uuid(rng), "project_id": project_id, "title": _text(rng, 4),
+                    "description": _text(rng, 12), "status": rng.choice(STATUSES),
+                    "priority": rng.choice(PRIORITIES),
+                    "due_date": (created + datetime.timedelta(days=rng.randint(1, 90))).strftime("%Y-%m-%d"),
+                    "created_at": stamp, "updated_at": stamp}
+            if task["status"] == "completed":
+                task["completed_at"] = stamp
+                stats["completed"] += 1
+            stats["total"] += 1
+            stats["by_status"][task["status"]] = stats["by_status"].get(task["status"], 0) + 1
+            stats["by_priority"][task["priority"]] = stats["by_priority"].get(task["priority"], 0) + 1
+            tasks.append(task)
+        task_store.save(project_id, tasks)
+        if tasks and len(sample_tasks) < SAMPLE_SIZE and rng.random() < SAMPLE_SIZE / count:
+            sample_tasks.append([project_id, rng.choice(tasks)["id"]])
+        records.append({"id": project_id, "name": _text(rng, 2), "description": _text(rng, 10),
+                        "status": rng.choice(("active", "active", "archived")), "created_at": stamp,
+                        "updated_at": stamp, "stats": stats,
+                        "progress": int(stats["completed"] / stats["total"] * 100) if stats["total"] else 0})
+    open_backend(os.path.join(projects_dir, "projects.json"), "projects").snapshot(records)
+    return {"projects": rng.sample([r["id"] for r in records], min(SAMPLE_SIZE, len(records))),
+            "tasks": sample_tasks}
+
+
+def seed_chat(data_dir, session_count, message_count, rng):
+    """生成聊天会话和消息；约一半的消息属于某个会话"""
+    from storage import file_lock, open_backend, open_message_log
+    chat_dir = os.path.join(data_dir, "chats")
+    os.makedirs(chat_dir, exist_ok=True)
+    sessions = []
+    for created in _timestamps(rng, session_count, days=400):
+        stamp = created.strftime("%Y-%m-%d %H:%M:%S")
+        sessions.append({"id": _uuid(rng), "title": _text(rng, 2), "created_at": stamp, "updated_at": stamp,
+                         "message_count": 0, "summary": None, "summary_until": None})
+    sample_messages = []
+
+    def messages():
+        for created in _timestamps(rng, message_count):
+            message = {"id": _uuid(rng), "role": rng.choice(("user", "assistant")),
+                       "content": _text(rng, rng.randint(5, 60)), "timestamp": created.isoformat()}
+            if sessions and rng.random() < 0.5:
+                session = rng.choice(sessions)
+                message["session_id"] = session["id"]
+                session["message_count"] += 1
+            if len(sample_messages) < SAMPLE_SIZE and rng.random() < SAMPLE_SIZE / message_count:
+                sample_messages.append(message["id"])
+            yield message
+
+    log = open_message_log(chat_dir)
+    with file_lock(log.lock_path):
+        log.clear()
+        log.extend(messages())
+    open_backend(os.path.join(chat_dir, "sessions.json"), "chat_sessions").snapshot(sessions)
+    return {"sessions": rng.sample([s["id"] for s in sessions], min(SAMPLE_SIZE, len(sessions))),
+            "messages": sample_messages}
+
+
+def seed(data_dir, sizes, seed_value, only=None):
+    """生成数据集并写入清单（各集合的样本id），返回清单"""
+    os.environ["DATA_DIR"] = data_dir
+    manifest_path = os.path.join(data_dir, MANIFEST)
+    manifest = {"sizes": {}, "samples": {}, "seconds": {}}
+    if only and os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    manifest["backend"] = os.getenv("STORAGE_BACKEND", "json")
+    manifest["seed"] = seed_value
+
+    for collection in only or COLLECTIONS:
+        # 每个集合使用独立的随机序列，单独重新生成某个集合时得到相同的数据
+        rng = random.Random(f"{seed_value}-{collection}")
+        started = time.perf_counter()
+        if collection == "notes":
+            samples = seed_notes(data_dir, sizes["notes"], rng)
+        elif collection == "todos":
+            samples = seed_todos(data_dir, sizes["todos"], rng)
+        elif collection == "projects":
+            samples = seed_projects(data_dir, sizes["projects"], sizes["tasks"], rng)
+        else:
+            samples = seed_chat(data_dir, sizes["sessions"], sizes["messages"], rng)
+        manifest["samples"].update(samples)
+        manifest["seconds"][collection] = round(time.perf_counter() - started, 3)
+    manifest["sizes"] = sizes
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+# ---------------------------------------------------------------- 场景
+
+class Scenario:
+    """一个被测路由：rule 为路由模板，build(ctx, rng) 返回 (url, json请求体, 请求头)
+
+    prepare(ctx, driver, count) 在计时之前执行，例如为删除场景预先创建记录。
+    """
+
+    def __init__(self, name, method, rule, build, expect=(200,), prepare=None):
+        self.name = name
+        self.method = method
+        self.rule = rule
+        self.build = build
+        self.expect = expect
+        self.prepare = prepare
+
+
+def _pool_prepare(create):
+    """创建 count 条待删除的记录，放入 ctx["pool"]"""
+    def prepare(ctx, driver, count):
+        pool = queue.Queue()
+        for i in range(count):
+            pool.put(create(ctx, driver, i))
+        ctx["pool"] = pool
+    return prepare
+
+
+def _create(path_fn, body_fn, key="id"):
+    def create(ctx, driver, i):
+        status, body = driver.request("POST", path_fn(ctx), json_body=body_fn(i), want_body=True)
+        return json.loads(body)[key]
+    return create
+
+
+def _pick(ctx, rng, name):
+    return rng.choice(ctx["samples"][name])
+
+
+def _etag_prepare(url):
+    def prepare(ctx, driver, count):
+        ctx["etag"] = driver.request("GET", url, want_headers=True)[1].get("ETag", "")
+    return prepare
+
+
+def _tasks_pool(ctx, driver, count):
+    project_id = ctx["samples"]["tasks"][0][0]
+    pool = queue.Queue()
+    for i in range(count):
+        status, body = driver.request("POST", f"/api/projects/{project_id}/tasks",
+                                      json_body={"title": f"待删除任务{i}"}, want_body=True)
+        pool.put((project_id, json.loads(body)["id"]))
+    ctx["pool"] = pool
+
+
+def _import_body(ctx, driver, count):
+    """导入场景的请求体：覆盖写入已有的待办（重复执行结果相同）"""
+    status, body = driver.request("GET", "/api/todos?limit=20", want_body=True)
+    lines = [{"type": "workspace", "version": 1}]
+    lines += [{"type": "todos", "data": todo} for todo in json.loads(body)]
+    ctx["import_body"] = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+
+
+def build_scenarios():
+    pool_item = lambda ctx: ctx["pool"].get_nowait()  # noqa: E731
+    return [
+        Scenario("index", "GET", "/", lambda c, r: ("/", None, None)),
+        Scenario("static", "GET", "/static/<path:filename>", lambda c, r: ("/static/index.html", None, None)),
+        Scenario("debug", "GET", "/debug", lambda c, r: ("/debug", None, None)),
+
+        Scenario("notes_page", "GET", "/api/notes", lambda c, r: ("/api/notes?limit=50", None, None)),
+        Scenario("notes_all", "GET", "/api/notes", lambda c, r: ("/api/notes", None, None)),
+        Scenario("notes_page_gzip", "GET", "/api/notes",
+                 lambda c, r: ("/api/notes?limit=200", None, {"Accept-Encoding": "gzip"})),
+        Scenario("notes_page_304", "GET", "/api/notes",
+                 lambda c, r: ("/api/notes?limit=50", None, {"If-None-Match": c["etag"]}),
+                 expect=(304,), prepare=_etag_prepare("/api/notes?limit=50")),
+        Scenario("notes_search", "GET", "/api/notes/search",
+                 lambda c, r: (f"/api/notes/search?q={r.choice(WORDS)}+{r.choice(WORDS)}", None, None)),
+        Scenario("note_get", "GET", "/api/notes/<note_id>",
+                 lambda c, r: (f"/api/notes/{_pick(c, r, 'notes')}", None, None)),
+        Scenario("note_content", "GET", "/api/notes/<note_id>/content",
+                 lambda c, r: (f"/api/notes/{_pick(c, r, 'notes')}/content", None, None)),
+        Scenario("note_content_range", "GET", "/api/notes/<note_id>/content",
+                 lambda c, r: (f"/api/notes/{_pick(c, r, 'notes')}/content", None, {"Range": "bytes=0-1023"}),
+                 expect=(206,)),
+        Scenario("note_versions", "GET", "/api/notes/<note_id>/versions",
+                 lambda c, r: (f"/api/notes/{_pick(c, r, 'notes')}/versions", None, None)),
+        Scenario("note_version_get", "GET", "/api/notes/<note_id>/versions/<int:version>",
+                 lambda c, r: (f"/api/notes/{_pick(c, r, 'notes')}/versions/1", None, None)),
+        Scenario("note_version_content", "GET", "/api/notes/<note_id>/versions/<int:version>/content",
+                 lambda c, r: (f"/api/notes/{_pick(c, r, 'notes')}/versions/1/content", None, None)),
+        Scenario("note_version_restore", "POST", "/api/notes/<note_id>/versions/<int:version>/restore",
+                 lambda c, r: (f"/api/notes/{_pick(c, r, 'notes')}/versions/1/restore", None, None)),
+        Scenario("note_create", "POST", "/api/notes",
+                 lambda c, r: ("/api/notes", {"title": _text(r, 3), "content": _text(r, 200)}, None),
+                 expect=(201,)),
+        Scenario("note_update", "PUT", "/api/notes/<note_id>",
+                 lambda c, r: (f"/api/notes/{_pick(c, r, 'notes')}",
+                               {"title": _text(r, 3), "content": _text(r, 200)}, None)),
+        Scenario("note_delete", "DELETE", "/api/notes/<note_id>",
+                 lambda c, r: (f"/api/notes/{pool_item(c)}", None, None),
+                 prepare=_pool_prepare(_create(lambda c: "/api/notes",
+                                               lambda i: {"title": f"待删除{i}", "content": "x"}))),
+
+        Scenario("todos_page", "GET", "/api/todos", lambda c, r: ("/api/todos?limit=50", None, None)),
+        Scenario("todos_filtered", "GET", "/api/todos",
+                 lambda c, r: ("/api/todos?completed=false&limit=50", None, None)),
+        Scenario("todo_create", "POST", "/api/todos",
+                 lambda c, r: ("/api/todos", {"title": _text(r, 4)}, None), expect=(201,)),
+        Scenario("todos_batch", "POST", "/api/todos/batch",
+                 lambda c, r: ("/api/todos/batch",
+                               [{"op": "create", "title": _text(r, 4)} for _ in range(5)]
+                               + [{"op": "update", "id": todo_id, "completed": r.random() < 0.5}
+                                  for todo_id in r.sample(c["samples"]["todos"],
+                                                          min(5, len(c["samples"]["todos"])))], None)),
+        Scenario("todo_update", "PUT", "/api/todos/<todo_id>",
+                 lambda c, r: (f"/api/todos/{_pick(c, r, 'todos')}", {"completed": r.random() < 0.5}, None)),
+        Scenario("todo_delete", "DELETE", "/api/todos/<todo_id>",
+                 lambda c, r: (f"/api/todos/{pool_item(c)}", None, None),
+                 prepare=_pool_prepare(_create(lambda c: "/api/todos", lambda i: {"title": f"待删除{i}"}))),
+
+        Scenario("projects_page", "GET", "/api/projects", lambda c, r: ("/api/projects?limit=50", None, None)),
+        Scenario("project_get", "GET", "/api/projects/<project_id>",
+                 lambda c, r: (f"/api/projects/{_pick(c, r, 'projects')}", None, None)),
+        Scenario("project_stats", "GET", "/api/projects/<project_id>/stats",
+                 lambda c, r: (f"/api/projects/{_pick(c, r, 'projects')}/stats", None, None)),
+        Scenario("project_create", "POST", "/api/projects",
+                 lambda c, r: ("/api/projects", {"name": _text(r, 2), "description": _text(r, 8)}, None),
+                 expect=(201,)),
+        Scenario("project_update", "PUT", "/api/projects/<project_id>",
+                 lambda c, r: (f"/api/projects/{_pick(c, r, 'projects')}", {"description": _text(r, 8)}, None)),
+        Scenario("project_delete", "DELETE", "/api/projects/<project_id>",
+                 lambda c, r: (f"/api/projects/{pool_item(c)}", None, None),
+                 prepare=_pool_prepare(_create(lambda c: "/api/projects", lambda i: {"name": f"待删除{i}"}))),
+        Scenario("tasks_list", "GET", "/api/projects/<project_id>/tasks",
+                 lambda c, r: (f"/api/projects/{_pick(c, r, 'tasks')[0]}/tasks", None, None)),
+        Scenario("tasks_filtered", "GET", "/api/projects/<project_id>/tasks",
+                 lambda c, r: (f"/api/projects/{_pick(c, r, 'tasks')[0]}/tasks?status=pending&priority=high"
+                               "&limit=20", None, None)),
+        Scenario("task_create", "POST", "/api/projects/<project_id>/tasks",
+                 lambda c, r: (f"/api/projects/{_pick(c, r, 'tasks')[0]}/tasks",
+                               {"title": _text(r, 4), "priority": r.choice(PRIORITIES)}, None),
+                 expect=(201,)),
+        Scenario("tasks_batch", "POST", "/api/projects/<project_id>/tasks/batch",
+                 lambda c, r: (f"/api/projects/{_pick(c, r, 'tasks')[0]}/tasks/batch",
+                               [{"op": "create", "title": _text(r, 4)} for _ in range(5)], None)),
+        Scenario("task_update", "PUT", "/api/projects/<project_id>/tasks/<task_id>",
+                 lambda c, r: ("/api/projects/{}/tasks/{}".format(*_pick(c, r, 'tasks')),
+                               {"status": r.choice(STATUSES)}, None)),
+        Scenario("task_delete", "DELETE", "/api/projects/<project_id>/tasks/<task_id>",
+                 lambda c, r: ("/api/projects/{}/tasks/{}".format(*pool_item(c)), None, None),
+                 prepare=_tasks_pool),
+
+        Scenario("chat", "POST", "/api/chat",
+                 lambda c, r: ("/api/chat", {"message": _text(r, 8), "history": []}, None)),
+        Scenario("chat_session", "POST", "/api/chat",
+                 lambda c, r: ("/api/chat", {"message": _text(r, 8), "session_id": _pick(c, r, 'sessions')}, None)),
+        Scenario("chat_stream", "POST", "/api/chat/stream",
+                 lambda c, r: ("/api/chat/stream", {"message": _text(r, 8)}, None)),
+        Scenario("chat_cache", "GET", "/api/chat/cache", lambda c, r: ("/api/chat/cache", None, None)),
+        Scenario("sessions_page", "GET", "/api/chat/sessions",
+                 lambda c, r: ("/api/chat/sessions?limit=50", None, None)),
+        Scenario("session_get", "GET", "/api/chat/sessions/<session_id>",
+                 lambda c, r: (f"/api/chat/sessions/{_pick(c, r, 'sessions')}", None, None)),
+        Scenario("session_context", "GET", "/api/chat/sessions/<session_id>/context",
+                 lambda c, r: (f"/api/chat/sessions/{_pick(c, r, 'sessions')}/context", None, None)),
+        Scenario("session_create", "POST", "/api/chat/sessions",
+                 lambda c, r: ("/api/chat/sessions", {"title": _text(r, 2)}, None), expect=(201,)),
+        Scenario("session_delete", "DELETE", "/api/chat/sessions/<session_id>",
+                 lambda c, r: (f"/api/chat/sessions/{pool_item(c)}", None, None),
+                 prepare=_pool_prepare(_create(lambda c: "/api/chat/sessions", lambda i: {"title": f"待删除{i}"}))),
+        Scenario("history_recent", "GET", "/api/chat/history",
+                 lambda c, r: ("/api/chat/history?limit=50", None, None)),
+        Scenario("history_deep_page", "GET", "/api/chat/history",
+                 lambda c, r: (f"/api/chat/history?limit=50&before={_pick(c, r, 'messages')}", None, None)),
+        Scenario("changes_since", "GET", "/api/changes",
+                 lambda c, r: (f"/api/changes?since={max(c['last_seq'] - 100, 0)}", None, None),
+                 prepare=lambda c, d, n: c.update(last_seq=json.loads(
+                     d.request("GET", "/api/changes", want_body=True)[1])["last_seq"])),
+        Scenario("global_search", "GET", "/api/search",
+                 lambda c, r: (f"/api/search?q={r.choice(WORDS)}", None, None)),
+        Scenario("global_search_due", "GET", "/api/search",
+                 lambda c, r: (f"/api/search?q={r.choice(WORDS)}&types=task&due_from=2024-01-01", None, None)),
+        Scenario("metrics", "GET", "/metrics",lambda c, r: ("/metrics", None, None)),
+        Scenario("export_ndjson", "GET", "/api/export", lambda c, r: ("/api/export", None, None)),
+        Scenario("export_tar", "GET", "/api/export", lambda c, r: ("/api/export?format=tar", None, None)),
+        Scenario("import_ndjson", "POST", "/api/import",
+                 lambda c, r: ("/api/import", c["import_body"], None), prepare=_import_body),
+        # 清空聊天记录放在最后，之后由调用方重新生成聊天数据
+        Scenario("chat_clear", "DELETE", "/api/chat/clear", lambda c, r: ("/api/chat/clear", None, None)),
+    ]
+
+
+# ---------------------------------------------------------------- 驱动
+
+class ClientDriver:
+    """通过 Flask 测试客户端发送请求"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, url, json_body=None, headers=None, want_body=False, want_headers=False):
+        response = self.client.open(url, method=method, headers=headers, **_body_args(json_body))
+        body = response.get_data()
+        if want_headers:
+            return response.status_code, dict(response.headers)
+        return response.status_code, body if want_body else len(body)
+
+
+def _body_args(body):
+    """请求体为 bytes 时原样发送，否则按JSON发送"""
+    return {"data": body} if isinstance(body, bytes) else {"json": body}
+
+
+class HttpDriver:
+    """通过HTTP请求真实的WSGI服务，每个线程一个连接"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._local = threading.local()
+
+    def request(self, method, url, json_body=None, headers=None, want_body=False, want_headers=False):
+        import requests
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.request(method, self.base_url + url, headers=headers, timeout=120,
+                                   **_body_args(json_body))
+        body = response.content
+        if want_headers:
+            return response.status_code, dict(response.headers)
+        return response.status_code, body if want_body else len(body)
+
+
+def _percentile(ordered, fraction):
+    """最近秩法百分位数"""
+    if not ordered:
+        return None
+    index = max(int(len(ordered) * fraction + 0.999999) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def run_scenario(scenario, driver, ctx, count, concurrency, seed_value):
+    """执行一个场景 count 次，返回延迟分布和吞吐量"""
+    if scenario.prepare is not None:
+        scenario.prepare(ctx, driver, count)
+    latencies = []
+    statuses = {}
+    sizes = []
+    lock = threading.Lock()
+    remaining = iter(range(count))
+
+    def worker(worker_id):
+        rng = random.Random(f"{seed_value}-{scenario.name}-{worker_id}")
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.perf_counter()
+            try:
+                url, body, headers = scenario.build(ctx, rng)
+                started = time.perf_counter()
+                status, size = driver.request(scenario.method, url, json_body=body, headers=headers)
+            except Exception as e:
+                status, size = f"error: {type(e).__name__}", 0
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                sizes.append(size)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 3) if value is not None else None  # noqa: E731
+    return {
+        "method": scenario.method,
+        "rule": scenario.rule,
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if not status.isdigit()
+                      or int(status) not in scenario.expect),
+        "status": statuses,
+        "p50_ms": ms(_percentile(latencies, 0.50)),
+        "p95_ms": ms(_percentile(latencies, 0.95)),
+        "p99_ms": ms(_percentile(latencies, 0.99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": ms(latencies[-1]) if latencies else None,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "mean_response_bytes": int(sum(sizes) / len(sizes)) if sizes else 0,
+    }
+
+
+def run_all(driver, manifest, routes, args):
+    """按顺序执行全部场景，返回每个场景的结果和没有覆盖到的路由"""
+    selected = set(args.scenarios.split(",")) if args.scenarios else None
+    ctx = {"samples": manifest["samples"]}
+    results = {}
+    scenarios = build_scenarios()
+    for scenario in scenarios:
+        if selected and scenario.name not in selected:
+            continue
+        # 不分页的完整列表响应很大，减少请求次数
+        count = max(args.requests // 5, 1) if scenario.name == "notes_all" else args.requests
+        results[scenario.name] = run_scenario(scenario, driver, ctx, count, args.concurrency, args.seed)
+        print(f"  {scenario.name:<20} p50={results[scenario.name]['p50_ms']}ms "
+              f"p99={results[scenario.name]['p99_ms']}ms errors={results[scenario.name]['errors']}",
+              file=sys.stderr)
+    covered = {(s.method, s.rule) for s in scenarios}
+    uncovered = sorted(f"{method} {rule}" for method, rule in routes if (method, rule) not in covered)
+    return results, uncovered
+
+
+def app_routes(app):
+    return {(method, rule.rule) for rule in app.url_map.iter_rules()
+            for method in rule.methods - {"HEAD", "OPTIONS"}}
+
+
+# ---------------------------------------------------------------- 子命令
+
+def cmd_client(args):
+    """在本进程中导入应用，通过测试客户端执行全部场景（由 run 在子进程中调用）"""
+    with open(os.path.join(args.data_dir, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    # 应用的日志输出到标准错误，标准输出只用于返回结果
+    output, sys.stdout = sys.stdout, sys.stderr
+    started = time.perf_counter()
+    import app as app_module
+    startup = time.perf_counter() - started
+    startup_rss = _rss_bytes()
+    results, uncovered = run_all(ClientDriver(app_module.app), manifest, app_routes(app_module.app), args)
+    json.dump({"startup_seconds": round(startup, 3), "startup_peak_rss_bytes": startup_rss,
+               "peak_rss_bytes": _rss_bytes(), "concurrency": args.concurrency, "routes": results,
+               "uncovered_routes": uncovered}, output)
+
+
+def cmd_serve(args):
+    """以多线程WSGI服务运行应用；收到SIGTERM时把峰值内存写入 --report 文件后退出"""
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    output, sys.stdout = sys.stdout, sys.stderr
+    started = time.perf_counter()
+    import app as app_module
+    startup = time.perf_counter() - started
+    startup_rss = _rss_bytes()
+    server = make_server("127.0.0.1", args.port, app_module.app, threaded=True)
+
+    def stop(signum, frame):
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"startup_seconds": round(startup, 3), "startup_peak_rss_bytes": startup_rss,
+                       "peak_rss_bytes": _rss_bytes(),
+                       "routes": sorted(f"{m} {r}" for m, r in app_routes(app_module.app))}, f)
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    print("ready", file=output, flush=True)
+    server.serve_forever()
+
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_stub(delay):
+    """在后台线程中启动模拟的AI服务，返回其地址"""
+    from http.server import ThreadingHTTPServer
+    from stub_openai import StubHandler
+    StubHandler.delay = delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def _child_args(args):
+    forwarded = ["--data-dir", args.data_dir, "--requests", str(args.requests), "--seed", str(args.seed)]
+    if args.scenarios:
+        forwarded += ["--scenarios", args.scenarios]
+    return forwarded
+
+
+def _run_server_mode(args, env):
+    port = _free_port()
+    report = os.path.join(args.data_dir, f"bench_server_{port}.json")
+    process = subprocess.Popen([sys.executable, __file__, "serve", "--data-dir", args.data_dir,
+                                "--port", str(port), "--report", report],
+                               env=env, stdout=subprocess.PIPE, text=True)
+    try:
+        if process.stdout.readline().strip() != "ready":
+            raise RuntimeError("WSGI服务启动失败")
+        with open(os.path.join(args.data_dir, MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        driver = HttpDriver(f"http://127.0.0.1:{port}")
+        results, _ = run_all(driver, manifest, set(), args)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+    with open(report, "r", encoding="utf-8") as f:
+        server = json.load(f)
+    os.remove(report)
+    covered = {f"{s.method} {s.rule}" for s in build_scenarios()}
+    return {"startup_seconds": server["startup_seconds"], "startup_peak_rss_bytes": server["startup_peak_rss_bytes"],
+            "peak_rss_bytes": server["peak_rss_bytes"], "concurrency": args.concurrency, "routes": results,
+            "uncovered_routes": [route for route in server["routes"] if route not in covered]}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cmd_run(args, sizes):
+    temporary = args.data_dir is None
+    args.data_dir = os.path.abspath(args.data_dir or tempfile.mkdtemp(prefix="notebook-bench-"))
+    env = dict(os.environ, DATA_DIR=args.data_dir, OPENAI_API_KEY="bench",
+               OPENAI_BASE_URL=_start_stub(args.upstream_delay))
+    env.pop("SQLITE_PATH", None)
+    result = {
+        "revision": _git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"profile": args.profile, "sizes": sizes, "backend": env.get("STORAGE_BACKEND", "json"),
+                   "requests": args.requests, "concurrency": args.concurrency,
+                   "upstream_delay": args.upstream_delay, "seed": args.seed},
+        "modes": {},
+    }
+    try:
+        manifest_path = os.path.join(args.data_dir, MANIFEST)
+        existing = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                existing = json.load(f)
+        if existing is None or existing.get("sizes") != sizes or existing.get("seed") != args.seed \
+                or existing.get("backend") != result["config"]["backend"]:
+            print(f"生成数据: {sizes}", file=sys.stderr)
+            _seed_subprocess(args, sizes, env)
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            result["seed_seconds"] = json.load(f)["seconds"]
+
+        modes = args.modes.split(",")
+        for i, mode in enumerate(modes):
+            print(f"[{mode}]", file=sys.stderr)
+            if mode == "client":
+                output = subprocess.run([sys.executable, __file__, "client", *_child_args(args),
+                                         "--concurrency", "1"], env=env, stdout=subprocess.PIPE,
+                                        text=True, check=True).stdout
+                result["modes"]["client"] = json.loads(output)
+            elif mode == "server":
+                result["modes"]["server"] = _run_server_mode(args, env)
+            else:
+                raise ValueError(f"未知的模式: {mode}")
+            # chat_clear 清空了聊天记录，下一个模式前重新生成
+            if i < len(modes) - 1:
+                _seed_subprocess(args, sizes, env, only="chat")
+    finally:
+        if temporary:
+            shutil.rmtree(args.data_dir, ignore_errors=True)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"结果已保存: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def _seed_subprocess(args, sizes, env, only=None):
+    """在子进程中生成数据，避免影响基准进程的内存统计"""
+    command = [sys.executable, __file__, "seed", "--data-dir", args.data_dir, "--seed", str(args.seed)]
+    for name, value in sizes.items():
+        command += [f"--{name}", str(value)]
+    if only:
+        command += ["--only", only]
+    subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def cmd_compare(args):
+    """比较两次结果的 p95 延迟，任一路由变慢超过阈值时返回非0"""
+    with open(args.old, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    regressions = 0
+    print(f"{'模式':<8} {'场景':<20} {'旧p95(ms)':>10} {'新p95(ms)':>10} {'变化':>8}")
+    for mode, result in new["modes"].items():
+        for name, route in result["routes"].items():
+            before = old["modes"].get(mode, {}).get("routes", {}).get(name)
+            if not before or not before["p95_ms"] or route["p95_ms"] is None:
+                continue
+            change = route["p95_ms"] / before["p95_ms"] - 1
+            flag = ""
+            if change > args.threshold:
+                regressions += 1
+                flag = " !"
+            print(f"{mode:<8} {name:<20} {before['p95_ms']:>10.2f} {route['p95_ms']:>10.2f} {change:>+7.0%}{flag}")
+        if mode in old["modes"]:
+            print(f"{mode:<8} {'峰值内存(MB)':<20} {old['modes'][mode]['peak_rss_bytes'] / 2**20:>10.1f} "
+                  f"{result['peak_rss_bytes'] / 2**20:>10.1f}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API基准与压测")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(p):
+        p.add_argument("--data-dir", help="数据目录（默认使用临时目录）")
+        p.add_argument("--seed", type=int, default=42, help="随机种子")
+
+    def add_sizes(p):
+        p.add_argument("--profile", choices=sorted(PROFILES), default="small", help="数据规模")
+        for name in PROFILES["small"]:
+            p.add_argument(f"--{name}", type=int, help=f"覆盖规模中的 {name} 数量")
+
+    def add_load(p):
+        p.add_argument("--requests", type=int, default=50, help="每个场景的请求数")
+        p.add_argument("--scenarios", help="只执行指定的场景（逗号分隔）")
+
+    p = sub.add_parser("run", help="生成数据并执行基准")
+    add_common(p)
+    add_sizes(p)
+    add_load(p)
+    p.add_argument("--modes", default="client,server", help="client（测试客户端）、server（WSGI服务）")
+    p.add_argument("--concurrency", type=int, default=8, help="server 模式的并发线程数")
+    p.add_argument("--upstream-delay", type=float, default=0.0, help="模拟AI服务每个字的延迟（秒）")
+    p.add_argument("--output", help="结果JSON文件（默认输出到标准输出）")
+
+    p = sub.add_parser("seed", help="只生成数据")
+    add_common(p)
+    add_sizes(p)
+    p.add_argument("--only", choices=COLLECTIONS, help="只重新生成一个集合")
+
+    p = sub.add_parser("client", help=argparse.SUPPRESS)
+    add_common(p)
+    add_load(p)
+    p.add_argument("--concurrency", type=int, default=1)
+
+    p = sub.add_parser("serve", help=argparse.SUPPRESS)
+    add_common(p)
+    p.add_argument("--port", type=int, required=True)
+    p.add_argument("--report", required=True)
+
+    p = sub.add_parser("compare", help="比较两次基准结果")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.2, help="p95 变慢超过该比例时视为退化")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(cmd_compare(args))
+
+    if getattr(args, "data_dir", None):
+        args.data_dir = os.path.abspath(args.data_dir)
+        os.environ["DATA_DIR"] = args.data_dir
+    sizes = None
+    if hasattr(args, "profile"):
+        sizes = dict(PROFILES[args.profile])
+        sizes.update({name: getattr(args, name) for name in sizes if getattr(args, name) is not None})
+
+    if args.command == "run":
+        cmd_run(args, sizes)
+    elif args.command == "seed":
+        if not args.data_dir:
+            parser.error("seed 需要 --data-dir")
+        manifest = seed(args.data_dir, sizes, args.seed, [args.only] if args.only else None)
+        print(json.dumps({"sizes": manifest["sizes"], "seconds": manifest["seconds"]}, ensure_ascii=False))
+    elif args.command == "client":
+        cmd_client(args)
+    else:
+        cmd_serve(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""意图匹配微基准：比较逐关键词子串查找与 Aho-Corasick 自动机随意图数量增长的单条消息耗时
+
+用法: python scripts/bench_intents.py [--messages 2000] [--sizes 10,100,1000,5000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intents import IntentMatcher  # noqa: E402
+
+CJK = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严"
+LATIN = "abcdefghijklmnopqrstuvwxyz"
+
+
+def random_keyword(rng):
+    if rng.random() < 0.6:
+        return "".join(rng.choice(CJK) for _ in range(rng.randint(2, 4)))
+    return "".join(rng.choice(LATIN) for _ in range(rng.randint(4, 8)))
+
+
+def build_config(size, rng):
+    return {
+        "default": "默认回复",
+        "intents": [{"name": f"intent{i}", "keywords": [random_keyword(rng) for _ in range(rng.randint(2, 6))],
+                     "response": f"回复{i}"} for i in range(size)]
+    }
+
+
+def random_message(rng, keywords):
+    parts = [rng.choice(CJK) for _ in range(rng.randint(10, 40))]
+    # 约一半的消息包含一个关键词
+    if keywords and rng.random() < 0.5:
+        parts.insert(rng.randint(0, len(parts)), rng.choice(keywords))
+    return "".join(parts)
+
+
+def naive_respond(config, message):
+    """原有实现方式：按意图顺序逐个关键词做子串查找"""
+    message_lower = message.lower()
+    for intent in config["intents"]:
+        if any(word in message_lower for word in intent["keywords"]):
+            return intent["response"]
+    return config["default"]
+
+
+def per_message_us(func, messages):
+    start = time.perf_counter()
+    for message in messages:
+        func(message)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="意图匹配微基准")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--sizes", default="10,100,1000,5000")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'意图数':>8} {'关键词数':>8} {'编译(ms)':>10} {'子串查找(us)':>14} {'自动机(us)':>12}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        config = build_config(size, rng)
+        keywords = [k for intent in config["intents"] for k in intent["keywords"]]
+        messages = [random_message(rng, keywords) for _ in range(args.messages)]
+
+        start = time.perf_counter()
+        automaton, intents, default = IntentMatcher.compile(config)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        def automaton_respond(message):
+            priority = automaton.search(message.lower())
+            return intents[priority]["response"] if priority is not None else default
+
+        for message in messages[:200]:
+            assert automaton_respond(message) == naive_respond(config, message)
+
+        naive = per_message_us(lambda m: naive_respond(config, m), messages)
+        compiled = per_message_us(automaton_respond, messages)
+        print(f"{size:>8} {len(keywords):>8} {compile_ms:>10.1f} {naive:>14.1f} {compiled:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
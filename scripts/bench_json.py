@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""JSON序列化微基准：比较原来的落盘格式（标准库、缩进两格）、标准库紧凑格式和 orjson，
+以及 Flask 默认的 JSON provider 与 json_codec provider 生成列表响应的耗时
+
+数据由 bench.py 的生成器按规模生成，比较 todos、projects 和单个项目的任务列表。
+
+用法: python scripts/bench_json.py [--profiles small,medium] [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import bench  # noqa: E402
+
+
+def best_ms(func, repeat):
+    """重复执行 repeat 次，取最短耗时（毫秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def encoders():
+    """(名称, 序列化函数, 解析函数)，序列化结果统一为 bytes"""
+    result = [
+        ("stdlib-indent", lambda v: json.dumps(v, ensure_ascii=False, indent=2).encode("utf-8"), json.loads),
+        ("stdlib-compact",
+         lambda v: json.dumps(v, ensure_ascii=False, separators=(',', ':')).encode("utf-8"), json.loads),
+    ]
+    if orjson is not None:
+        result.append(("orjson", lambda v: orjson.dumps(v, option=orjson.OPT_NON_STR_KEYS), orjson.loads))
+    return result
+
+
+def load_dataset(data_dir, profile, rng):
+    """生成数据并读回各集合的记录列表"""
+    from storage import open_backend, open_task_store
+
+    sizes = bench.PROFILES[profile]
+    bench.seed_todos(data_dir, sizes["todos"], rng)
+    bench.seed_projects(data_dir, sizes["projects"], sizes["tasks"], rng)
+    todos = open_backend(os.path.join(data_dir, "todos", "todos.json"), "todos").load()
+    projects = open_backend(os.path.join(data_dir, "projects", "projects.json"), "projects").load()
+    tasks = open_task_store(os.path.join(data_dir, "projects", "tasks")).load(projects[0]["id"])
+    return {"todos": todos, "projects": projects, "tasks": tasks}
+
+
+def provider_ms(records, repeat):
+    """Flask 默认 provider 与 json_codec provider 生成完整列表响应的耗时"""
+    from flask import Flask
+    from app import CodecJSONProvider
+
+    default_app = Flask("default")
+    codec_app = Flask("codec")
+    codec_app.json = CodecJSONProvider(codec_app)
+    result = []
+    for flask_app in (default_app, codec_app):
+        with flask_app.app_context():
+            result.append(best_ms(lambda: flask_app.json.response(records).get_data(), repeat))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON序列化微基准")
+    parser.add_argument("--profiles", default="small,medium", help="数据规模（bench.py 中的 PROFILES）")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数（取最短耗时）")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 导入 app 时会在数据目录下创建各集合的目录
+        os.environ["DATA_DIR"] = os.path.join(tmp, "app")
+        os.makedirs(os.environ["DATA_DIR"])
+
+        print(f"{'规模':<8} {'集合':<9} {'记录数':>7} {'编码':<15} {'大小(KB)':>9} {'序列化(ms)':>11} {'解析(ms)':>9}")
+        for profile in args.profiles.split(","):
+            data_dir = os.path.join(tmp, profile)
+            dataset = load_dataset(data_dir, profile, random.Random(args.seed))
+            for name, records in dataset.items():
+                for encoder, dumps, loads in encoders():
+                    data = dumps(records)
+                    dump_ms = best_ms(lambda: dumps(records), args.repeat)
+                    load_ms = best_ms(lambda: loads(data), args.repeat)
+                    print(f"{profile:<8} {name:<9} {len(records):>7} {encoder:<15} "
+                          f"{len(data) / 1024:>9.1f} {dump_ms:>11.2f} {load_ms:>9.2f}")
+
+            default, codec = provider_ms(dataset["todos"], args.repeat)
+            print(f"{profile:<8} {'jsonify':<9} {len(dataset['todos']):>7} "
+                  f"默认 {default:.2f}ms / json_codec {codec:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""记录类型的内存与加载基准：比较直接解析出的字典和经记录类型（models.py）整理后的字典
+每条记录的内存占用，以及加载（解析、整理）和序列化整个集合的耗时
+
+数据由 bench.py 的生成器按规模生成，按应用加载数据的方式从JSON解析（解析出的字符串都是独立的对象）。
+整理只改变字符串值的共用，序列化的输入仍是字典，两列序列化耗时应当相同。
+
+用法: python scripts/bench_models.py [--profile small] [--repeat 3]
+"""
+
+import os
+import sys
+import gc
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench  # noqa: E402
+
+
+def best_ms(func, repeat):
+    """重复执行 repeat 次，取最短耗时（毫秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def traced_bytes(build):
+    """build() 的返回值占用的内存（字节）"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        value = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del value
+    return size
+
+
+def load_dataset(data_dir, profile, rng):
+    """生成数据并读回各集合的记录（字典）"""
+    from storage import open_backend, open_message_log, open_task_store
+    from models import Message, Project, Session, Task, Todo
+
+    sizes = bench.PROFILES[profile]
+    bench.seed_todos(data_dir, sizes["todos"], rng)
+    bench.seed_projects(data_dir, sizes["projects"], sizes["tasks"], rng)
+    bench.seed_chat(data_dir, sizes["sessions"], sizes["messages"], rng)
+    todos = open_backend(os.path.join(data_dir, "todos", "todos.json"), "todos").load()
+    projects = open_backend(os.path.join(data_dir, "projects", "projects.json"), "projects").load()
+    task_store = open_task_store(os.path.join(data_dir, "projects", "tasks"))
+    tasks = [task for project in projects for task in task_store.load(project["id"])]
+    sessions = open_backend(os.path.join(data_dir, "chats", "sessions.json"), "chat_sessions").load()
+    messages = list(open_message_log(os.path.join(data_dir, "chats")).iter_forward())
+    return [("todos", Todo, todos), ("projects", Project, projects), ("tasks", Task, tasks),
+            ("sessions", Session, sessions), ("messages", Message, messages)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记录类型的内存与加载基准")
+    parser.add_argument("--profile", default="small", help="数据规模（bench.py 中的 PROFILES）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数（取最短耗时）")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATA_DIR"] = tmp
+        import json_codec
+
+        dataset = load_dataset(tmp, args.profile, random.Random(args.seed))
+        print(f"JSON: {json_codec.BACKEND}")
+        print(f"{'集合':<9} {'记录数':>7} {'解析(B/条)':>11} {'整理后(B/条)':>12} {'节省':>6} "
+              f"{'加载 解析/整理(ms)':>20} {'序列化 解析/整理(ms)':>22}")
+        for name, model, records in dataset:
+            data = json_codec.dumps_bytes(records)
+            dict_bytes = traced_bytes(lambda: json_codec.loads(data))
+            record_bytes = traced_bytes(lambda: model.from_list(json_codec.loads(data)))
+            as_records = model.from_list(json_codec.loads(data))
+            assert as_records == records
+
+            load_dicts = best_ms(lambda: json_codec.loads(data), args.repeat)
+            load_records = best_ms(lambda: model.from_list(json_codec.loads(data)), args.repeat)
+            dump_dicts = best_ms(lambda: json_codec.dumps_bytes(records), args.repeat)
+            dump_records = best_ms(lambda: json_codec.dumps_bytes(as_records), args.repeat)
+            count = len(records)
+            print(f"{name:<9} {count:>7} {dict_bytes / count:>11.0f} {record_bytes / count:>12.0f} "
+                  f"{1 - record_bytes / dict_bytes:>6.0%} {load_dicts:>9.2f} / {load_records:<8.2f} "
+                  f"{dump_dicts:>10.2f} / {dump_records:<8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""模拟 OpenAI 聊天补全接口的本地服务，用于测试流式聊天和连接池
+
+用法: python scripts/stub_openai.py [--port 8008] [--delay 0.05] [--fail-rate 0]
+然后以 OPENAI_API_KEY=test OPENAI_BASE_URL=http://127.0.0.1:8008/v1 启动应用。
+回复内容是对最后一条用户消息的复述，流式模式下按字逐段返回。
+"""
+
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    fail_rate = 0.0
+    requests_served = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply_text(self, messages):
+        last = messages[-1]["content"] if messages else ""
+        return f"你说的是：{last}"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        StubHandler.requests_served += 1
+
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+        if random.random() < self.fail_rate:
+            self._send_json(503, {"error": "upstream unavailable"})
+            return
+
+        text = self._reply_text(payload.get("messages", []))
+        if not payload.get("stream"):
+            time.sleep(self.delay * len(text))
+            self._send_json(200, {
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}]
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for char in text:
+            time.sleep(self.delay)
+            chunk = {"choices": [{"index": 0, "delta": {"content": char}}]}
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟OpenAI聊天补全接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--delay", type=float, default=0.05, help="每个字之间的延迟（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回503的概率，用于测试重试")
+    args = parser.parse_args()
+
+    StubHandler.delay = args.delay
+    StubHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"模拟服务已启动: http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
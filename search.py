@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import math
+import heapq
+import atexit
+import threading
+from operator import itemgetter
+
+import json_codec
+from storage import file_lock
+
+# 拉丁字母和数字按词切分，中日韩文字按字切分后组成二元组
+_WORD_RE = re.compile(r"[0-9a-z_]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]+")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+
+
+def tokenize(text, unigrams=True):
+    """把文本切分为词项列表
+
+    中日韩文字连续片段切为二元组（bigram）；unigrams 为 True 时同时产生单字，
+    用于索引，使单字查询也能命中。查询时只在片段只有一个字时使用单字。
+    """
+    tokens = []
+    for match in _WORD_RE.finditer(text.lower()):
+        word = match.group()
+        if not _CJK_RE.match(word):
+            tokens.append(word)
+            continue
+        if len(word) == 1:
+            tokens.append(word)
+            continue
+        if unigrams:
+            tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class InvertedIndex:
+    """增量维护的倒排索引
+
+    postings: 词项 -> {文档id: 加权词频}
+    docs:     文档id -> {"sig": 签名, "terms": {词项: 加权词频}}，用于删除和持久化
+    fields 中给出各字段的权重，例如标题命中比正文命中更重要。
+    """
+
+    def __init__(self, fields, path=None, save_interval=5.0):
+        self.fields = fields
+        self.path = path
+        self.save_interval = save_interval
+        self.postings = {}
+        self.docs = {}
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._timer = None
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def signature(self, doc_id):
+        """文档被索引时的签名，None表示未索引"""
+        doc = self.docs.get(doc_id)
+        return doc["sig"] if doc else None
+
+    def add(self, doc_id, values, sig=None):
+        """索引（或重新索引）一个文档，values 为 {字段名: 文本}"""
+        terms = {}
+        for field, weight in self.fields.items():
+            for token in tokenize(values.get(field) or ""):
+                terms[token] = terms.get(token, 0) + weight
+        with self._lock:
+            self._remove(doc_id)
+            self.docs[doc_id] = {"sig": sig, "terms": terms}
+            for token, tf in terms.items():
+                self.postings.setdefault(token, {})[doc_id] = tf
+            self._mark_dirty()
+
+    def remove(self, doc_id):
+        """从索引中删除文档"""
+        with self._lock:
+            if self._remove(doc_id):
+                self._mark_dirty()
+
+    def _remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return False
+        for token in doc["terms"]:
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[token]
+        return True
+
+    def doc_freq(self, token):
+        """包含词项的文档数"""
+        posting = self.postings.get(token)
+        return len(posting) if posting else 0
+
+    def search(self, query, limit=20, match=None, total=None, doc_freq=None):
+        """查询同时包含所有词项的文档，返回按相关度排序的 [(文档id, 得分)]
+
+        match 为文档id的过滤条件，在排序前逐个检查命中的文档。
+        total 和 doc_freq（{词项: 文档数}）为计算IDF用的统计，默认为本索引的；
+        合并多个索引的结果时传入合并后的统计，各索引的得分才可以比较。
+        """
+        tokens = set(tokenize(query, unigrams=False))
+        if not tokens:
+            return []
+        with self._lock:
+            postings = [(token, self.postings.get(token)) for token in tokens]
+            if not all(posting for _, posting in postings):
+                return []
+            # 从最短的倒排表开始求交集
+            postings.sort(key=lambda item: len(item[1]))
+            if total is None:
+                total = len(self.docs)
+            weighted = [(posting, math.log(1 + total / (doc_freq[token] if doc_freq else len(posting))))
+                        for token, posting in postings]
+            first, first_idf = weighted[0]
+            rest = weighted[1:]
+            scored = []
+            for doc_id, tf in first.items():
+                score = tf * first_idf
+                for posting, idf in rest:
+                    other = posting.get(doc_id)
+                    if other is None:
+                        break
+                    score += other * idf
+                else:
+                    if match is None or match(doc_id):
+                        scored.append((doc_id, score))
+        return heapq.nlargest(limit, scored, key=itemgetter(1))
+
+    def _mark_dirty(self):
+        """标记需要持久化，在 save_interval 秒后统一写盘"""
+        self._dirty = True
+        if self.path and self._timer is None:
+            self._timer = threading.Timer(self.save_interval, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def load(self):
+        """从磁盘加载索引"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = json_codec.load(f)
+        except (json.JSONDecodeError, OSError):
+            return
+        with self._lock:
+            self.docs = data.get("docs", {})
+            self.postings = {}
+            for doc_id, doc in self.docs.items():
+                for token, tf in doc["terms"].items():
+                    self.postings.setdefault(token, {})[doc_id] = tf
+
+    def save(self):
+        """把索引写入磁盘"""
+        with self._lock:
+            self._timer = None
+            if not self._dirty or not self.path:
+                return
+            data = json_codec.dumps_bytes({"docs": self.docs})
+            self._dirty = False
+        with file_lock(self.path + '.lock'):
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
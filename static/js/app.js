@@ -241,16 +241,29 @@ function renderNotesList(notesToRender = notes) {
     });
 }
 
+// 获取笔记正文：较大的笔记详情中只有预览，正文从 /content 接口读取
+async function fetchNoteContent(note) {
+    if (note.content !== undefined) return note.content;
+    const response = await fetch(`/api/notes/${note.id}/content`);
+    if (!response.ok) throw new Error('获取笔记内容失败');
+    return response.text();
+}
+
 // 查看笔记
 async function viewNote(noteId) {
     try {
         const note = await fetchAPI(`/api/notes/${noteId}`);
         currentNoteId = note.id;
         
-        // 更新UI
+        // 更新UI（先显示预览，正文加载完成后替换）
         noteViewTitle.textContent = note.title;
         noteViewDate.textContent = note.created_at;
-        noteViewContent.textContent = note.content;
+        noteViewContent.textContent = note.content !== undefined ? note.content : note.preview;
+        if (note.content === undefined) {
+            fetchNoteContent(note).then(content => {
+                if (currentNoteId === note.id) noteViewContent.textContent = content;
+            }).catch(error => console.error('加载笔记正文失败:', error));
+        }
         
         // 显示笔记视图
         showView('view');
@@ -283,8 +296,9 @@ function showEditNoteForm() {
     
     // 获取笔记内容
     fetchAPI(`/api/notes/${currentNoteId}`)
-        .then(fullNote => {
-            noteContent.value = fullNote.content;
+        .then(fetchNoteContent)
+        .then(content => {
+            noteContent.value = content;
             showView('edit');
         })
         .catch(error => console.error('获取笔记内容失败:', error));
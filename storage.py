@@ -0,0 +1,1459 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import gzip
+import json
+import shutil
+import sqlite3
+import atexit
+import datetime
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import json_codec
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 数据目录（notes/、todos/、projects/、chats/ 等所在的目录），默认为程序所在目录
+DATA_DIR = os.getenv('DATA_DIR', BASE_DIR)
+
+
+class IndexedCollection:
+    """按id索引的记录集合
+
+    记录保存在以id为键的字典中（保持插入顺序），查找、删除均为O(1)；
+    按排序字段倒序排列的结果会被缓存，只有增删记录时才失效。
+    按字段值分组的有序视图（用于列表过滤）在任何变更后失效，原地修改记录后需调用 touch。
+    version 在每次变更后递增。
+    """
+
+    def __init__(self, records=None, sort_key="created_at"):
+        self.sort_key = sort_key
+        self.by_id = {}
+        self.version = 0
+        self._sorted = None
+        self._positions = None
+        self._views = {}
+        for record in records or []:
+            self.by_id[record["id"]] = record
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, record_id):
+        return record_id in self.by_id
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    @property
+    def records(self):
+        """按插入顺序返回记录列表（用于持久化）"""
+        return list(self.by_id.values())
+
+    def get(self, record_id):
+        """按id获取记录"""
+        return self.by_id.get(record_id)
+
+    def add(self, record):
+        """添加记录"""
+        self.by_id[record["id"]] = record
+        self._invalidate(order=True)
+        return record
+
+    def remove(self, record_id):
+        """删除记录，返回被删除的记录"""
+        record = self.by_id.pop(record_id, None)
+        if record is not None:
+            self._invalidate(order=True)
+        return record
+
+    def touch(self, record):
+        """记录被原地修改后调用（排序字段不变）"""
+        self._invalidate(order=False)
+
+    def clear(self):
+        """清空集合"""
+        self.by_id.clear()
+        self._invalidate(order=True)
+
+    def _invalidate(self, order):
+        self.version += 1
+        self._views = {}
+        if order:
+            self._sorted = None
+            self._positions = None
+
+    def _ordered(self):
+        ordered = self._sorted
+        if ordered is None:
+            ordered = self._sorted = sorted(self.by_id.values(), key=lambda x: x[self.sort_key], reverse=True)
+        return ordered
+
+    def sorted(self):
+        """按排序字段倒序返回记录列表（结果已缓存）"""
+        return list(self._ordered())
+
+    def view(self, field=None, value=None):
+        """返回 (有序记录列表, id->位置)，可只取 field 等于 value 的记录"""
+        if field is None:
+            ordered, positions = self._ordered(), self._positions
+            if positions is None:
+                positions = self._positions = {record["id"]: i for i, record in enumerate(ordered)}
+            return ordered, positions
+        # 多个读者可能同时建立同一个视图，结果相同，后建立的覆盖先建立的
+        key = (field, value)
+        views = self._views
+        entry = views.get(key)
+        if entry is None:
+            ordered = [record for record in self._ordered() if record.get(field) == value]
+            entry = views[key] = (ordered, {record["id"]: i for i, record in enumerate(ordered)})
+        return entry
+
+    def page(self, after=None, limit=None, where=None, match=None, created_from=None, created_to=None):
+        """在缓存的有序视图上分页查询，返回 (本页记录, 下一页游标)
+
+        where 为等值过滤条件 {字段: 值}（值为None的条件忽略），第一个条件使用分组视图，
+        其余条件与 match 一起逐条过滤。
+        """
+        conditions = [(field, value) for field, value in (where or {}).items() if value is not None]
+        ordered, positions = self.view(*conditions[0]) if conditions else self.view()
+        rest = conditions[1:]
+        if rest:
+            extra = match
+            match = lambda record: (all(record.get(f) == v for f, v in rest)
+                                    and (extra is None or extra(record)))
+        return paginate(ordered, after, limit, match, created_from, created_to,
+                        time_key=self.sort_key, positions=positions)
+
+
+def _time_value(value, length=None):
+    """统一时间字符串格式（ISO格式的 T 视为空格），可截取前缀用于按日期比较"""
+    value = (value or "").replace("T", " ")
+    return value[:length] if length else value
+
+
+def in_time_range(value, start=None, end=None):
+    """时间是否在闭区间 [start, end] 内（start/end 可以只给日期等前缀，与 paginate 的时间范围语义相同），
+    value 为空时视为不在区间内"""
+    if not value:
+        return False
+    value = _time_value(value)
+    if start and value < _time_value(start):
+        return False
+    if end:
+        end = _time_value(end)
+        if value[:len(end)] > end:
+            return False
+    return True
+
+
+def _bisect(ordered, predicate):
+    """返回第一个使 predicate 为真的位置（predicate 在序列上单调）"""
+    lo, hi = 0, len(ordered)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if predicate(ordered[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class InvalidCursor(ValueError):
+    """分页游标指向的记录不存在"""
+
+
+def paginate(ordered, after=None, limit=None, match=None, created_from=None, created_to=None,
+             time_key="created_at", descending=True, positions=None):
+    """在按时间排好序的记录上做游标分页
+
+    after 为上一页最后一条记录的id；created_from/created_to 为闭区间（可以只给日期），
+    在有序序列上二分查找确定范围；match 为逐条过滤的条件函数。
+    返回 (本页记录, 下一页游标)，没有更多记录时游标为 None。
+    """
+    lo, hi = 0, len(ordered)
+    if created_from:
+        start = _time_value(created_from)
+        if descending:
+            hi = _bisect(ordered, lambda r: _time_value(r.get(time_key)) < start)
+        else:
+            lo = _bisect(ordered, lambda r: _time_value(r.get(time_key)) >= start)
+    if created_to:
+        end = _time_value(created_to)
+        if descending:
+            lo = max(lo, _bisect(ordered, lambda r: _time_value(r.get(time_key), len(end)) <= end))
+        else:
+            hi = min(hi, _bisect(ordered, lambda r: _time_value(r.get(time_key), len(end)) > end))
+
+    if after is not None:
+        if positions is not None:
+            position = positions.get(after)
+        else:
+            position = next((i for i, record in enumerate(ordered) if record["id"] == after), None)
+        if position is None:
+            raise InvalidCursor(after)
+        lo = max(lo, position + 1)
+
+    items = []
+    for i in range(lo, hi):
+        record = ordered[i]
+        if match is not None and not match(record):
+            continue
+        if limit is not None and len(items) >= limit:
+            return items, items[-1]["id"]
+        items.append(record)
+    return items, None
+
+
+def project_fields(records, fields):
+    """只保留指定字段"""
+    if not fields:
+        return records
+    return [{field: record[field] for field in fields if field in record} for record in records]
+
+
+class CollectionLock:
+    """集合锁：进程内为读写锁（多个读者并发、写者独占），进程间使用 fcntl 建议锁
+
+    锁文件中保存集合的代数（generation），写锁内调用 changed() 标记修改了数据时，退出写锁后加一。
+    读写前发现代数与本进程已知的不同，说明其他进程修改过数据，在进程内独占的情况下调用 reload 重新加载。
+    同一线程可以重入：读锁内可以再取读锁，写锁内可以再取读锁或写锁；读锁内不能取写锁
+    （两个读者同时升级会互相等待），需要写入时先退出读锁。有写者等待时新的读者排在它之后。
+    """
+
+    def __init__(self, path, reload):
+        self.path = path
+        self.reload = reload
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writers_waiting = 0
+        # 本线程持有的锁：mode 为 "r" 或 "w"，depth 为嵌套层数
+        self._local = threading.local()
+        # 进程内持有共享文件锁的次数（多个快照共用一次 flock）
+        self._shared_files = 0
+        self._file_mutex = threading.Lock()
+        self._pid = None
+        self._known = self._read_generation()
+        # 当前写锁内是否修改了数据（只由持有写锁的线程读写）
+        self._changed = False
+
+    @property
+    def _fd(self):
+        # fork 出的子进程（如预加载应用的 gunicorn worker）必须重新打开锁文件，
+        # 否则会与父进程共享同一个文件描述，fcntl 锁无法互斥
+        with self._file_mutex:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._fd_value = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._shared_files = 0
+            return self._fd_value
+
+    @property
+    def generation(self):
+        """本进程已知的集合代数，在读锁或写锁内与加载的数据一致（写入失败后为None）"""
+        return self._known
+
+    def _read_generation(self):
+        # pread 不移动文件位置，多个读者可以同时读取
+        data = os.pread(self._fd, 32, 0)
+        return int(data) if data.strip() else 0
+
+    def _write_generation(self, generation):
+        os.pwrite(self._fd, str(generation).encode().ljust(20), 0)
+
+    # ---- 进程内的读写锁 ----
+
+    def _acquire_shared(self):
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def _release_shared(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def _acquire_exclusive(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = threading.get_ident()
+
+    def _release_exclusive(self, downgrade=False):
+        """释放独占锁，downgrade 为真时原子地转为共享锁（期间没有写者插入）"""
+        with self._cond:
+            self._writer = None
+            if downgrade:
+                self._readers += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def _shared_file_lock(self):
+        """进程内计数的共享文件锁：第一个持有者加锁，最后一个释放"""
+        fd = self._fd
+        with self._file_mutex:
+            if self._shared_files == 0 and fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+            self._shared_files += 1
+        try:
+            yield
+        finally:
+            with self._file_mutex:
+                self._shared_files -= 1
+                if self._shared_files == 0 and fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _reentered(self, local):
+        local.depth += 1
+        try:
+            yield
+        finally:
+            local.depth -= 1
+
+    # ---- 对外的锁 ----
+
+    @contextmanager
+    def read(self):
+        """读锁：与其他读者共享，数据过期时独占地在共享文件锁下重新加载"""
+        local = self._local
+        if getattr(local, "depth", 0):
+            with self._reentered(local):
+                yield
+            return
+
+        self._acquire_shared()
+        if self._read_generation() != self._known:
+            # 重新加载会替换内存中的数据，先等其他读者退出
+            self._release_shared()
+            self._acquire_exclusive()
+            try:
+                with self._shared_file_lock():
+                    generation = self._read_generation()
+                    if generation != self._known:
+                        self.reload()
+                        self._known = generation
+            except BaseException:
+                self._release_exclusive()
+                raise
+            self._release_exclusive(downgrade=True)
+
+        local.mode, local.depth = "r", 1
+        try:
+            yield
+        finally:
+            local.mode, local.depth = None, 0
+            self._release_shared()
+
+    @contextmanager
+    def snapshot(self):
+        """快照读锁：在读锁的基础上持有共享文件锁，期间其他进程不能写入
+
+        用于导出等需要一致快照的读取：按需从磁盘加载的数据（如任务列表、聊天分段）
+        与内存中的数据属于同一代数。其中不能再获取写锁。
+        """
+        while True:
+            with self.read(), self._shared_file_lock():
+                # 读锁检查代数之后、加文件锁之前其他进程可能又写入了，这时退出读锁重新加载
+                if self._read_generation() == self._known or self._local.depth > 1:
+                    yield
+                    return
+
+    def changed(self):
+        """标记当前写锁内修改了数据，退出最外层写锁时递增代数，其他进程据此重新加载"""
+        self._changed = True
+
+    @contextmanager
+    def write(self):
+        """写锁：进程内独占并持有独占文件锁，修改了数据时退出后递增代数（可以嵌套在写锁内，不能嵌套在读锁内）"""
+        local = self._local
+        if getattr(local, "depth", 0):
+            if local.mode != "w":
+                raise RuntimeError("不能在读锁内获取写锁")
+            with self._reentered(local):
+                yield
+            return
+
+        self._acquire_exclusive()
+        local.mode, local.depth = "w", 1
+        try:
+            with _flock(self._fd, exclusive=True):
+                generation = self._read_generation()
+                if generation != self._known:
+                    self.reload()
+                    self._known = generation
+                self._changed = False
+                try:
+                    yield
+                except BaseException:
+                    # 内存中的数据可能只修改了一半，下次访问时从磁盘重新加载
+                    self._known = None
+                    raise
+                finally:
+                    # 没有修改数据（如更新不存在的记录）时不递增代数，其他进程不必重新加载
+                    if self._changed:
+                        self._changed = False
+                        self._write_generation(generation + 1)
+                        if self._known is not None:
+                            self._known = generation + 1
+        finally:
+            local.mode, local.depth = None, 0
+            self._release_exclusive()
+
+
+@contextmanager
+def _flock(fd, exclusive=True):
+    """在文件描述符上加 fcntl 建议锁（不支持 fcntl 的平台上为空操作）"""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(path, exclusive=True):
+    """打开锁文件并加锁，供不经过 CollectionLock 的代码使用"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        with _flock(fd, exclusive):
+            yield
+    finally:
+        os.close(fd)
+
+
+def _try_flock(path):
+    """非阻塞地获取独占文件锁，成功时返回文件描述符，否则返回None"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+    return fd
+
+
+def _write_json_atomic(path, data):
+    """先写临时文件再替换，读者不会看到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        json_codec.write_file(f, data)
+    os.replace(tmp_path, path)
+
+
+class JsonFileBackend:
+    """整文件JSON存储：每次变更都重写整个文件"""
+
+    # 不支持 query()，列表在内存中的 IndexedCollection 上分页
+    supports_query = False
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+
+    def load(self):
+        """加载全部记录"""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    return json_codec.load(f)
+            except json.JSONDecodeError:
+                return []
+        return []
+
+    def write(self, puts, deletes, records):
+        """写入变更（整文件重写）"""
+        self.snapshot(records)
+
+    def snapshot(self, records):
+        """写入完整快照"""
+        _write_json_atomic(self.path, list(records))
+
+
+class JournalBackend:
+    """快照+追加日志存储
+
+    每次变更只向 <path>.log 追加一行紧凑的JSON记录，写入代价为O(1)；
+    日志条数达到阈值后把日志轮转为 <path>.log.old，在后台线程生成新的快照并删除旧日志。
+    加载时先读快照，再依次重放 <path>.log.old 和 <path>.log。
+    写入由调用方的 CollectionLock 保护；同一时刻全局只有一个压缩任务（<path>.compact.lock）。
+    """
+
+    supports_query = False
+
+    def __init__(self, path, compact_every=1000):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.log_path = path + '.log'
+        self.old_log_path = path + '.log.old'
+        self.compact_lock_path = path + '.compact.lock'
+        self.compact_every = compact_every
+        self._log = None
+        self._pending = 0
+        self._compacting = False
+
+    def load(self):
+        """加载快照并重放日志"""
+        records = {}
+        for record in JsonFileBackend(self.path).load():
+            records[record["id"]] = record
+        self._pending = 0
+        for log_path in (self.old_log_path, self.log_path):
+            self._pending += self._replay(log_path, records)
+
+        # 其他进程可能已经轮转了日志，下次写入时重新打开
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        return list(records.values())
+
+    def _replay(self, log_path, records):
+        """把日志中的变更应用到records，返回应用的条数"""
+        if not os.path.exists(log_path):
+            return 0
+        count = 0
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json_codec.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下写了一半的行
+                    continue
+                if entry["op"] == "put":
+                    records[entry["data"]["id"]] = entry["data"]
+                elif entry["op"] == "del":
+                    records.pop(entry["id"], None)
+                elif entry["op"] == "reset":
+                    records.clear()
+                count += 1
+        return count
+
+    def write(self, puts, deletes, records):
+        """向日志追加变更"""
+        lines = [json_codec.dumps({"op": "put", "data": record})
+                 for record in puts]
+        lines += [json_codec.dumps({"op": "del", "id": record_id})
+                  for record_id in deletes]
+        self._append(lines, records)
+
+    def snapshot(self, records):
+        """以一条 reset 记录加上全部记录的形式写入完整状态"""
+        records = list(records)
+        lines = ['{"op":"reset"}']
+        lines += [json_codec.dumps({"op": "put", "data": record})
+                  for record in records]
+        self._append(lines, records)
+
+    def _append(self, lines, records):
+        if self._log is None:
+            self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._log.write(''.join(line + '\n' for line in lines))
+        self._log.flush()
+        self._pending += len(lines)
+        if self._pending >= self.compact_every:
+            self._start_compaction(records)
+
+    def _start_compaction(self, records):
+        """冻结当前状态、轮转日志并启动后台压缩（调用方持有写锁）"""
+        if self._compacting:
+            return
+        compact_fd = _try_flock(self.compact_lock_path)
+        if compact_fd is None:
+            # 其他进程正在压缩
+            return
+        self._compacting = True
+        frozen = [_copy_record(record) for record in records]
+
+        self._log.close()
+        self._log = None
+        if os.path.exists(self.old_log_path):
+            # 上次压缩没有完成，把当前日志接到旧日志后面
+            with open(self.log_path, 'r', encoding='utf-8') as src, \
+                    open(self.old_log_path, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+            open(self.log_path, 'w').close()
+        else:
+            os.replace(self.log_path, self.old_log_path)
+        self._pending = 0
+
+        threading.Thread(target=self._compact, args=(frozen, compact_fd), daemon=True).start()
+
+    def _compact(self, records, compact_fd):
+        """后台压缩：写入快照后删除旧日志"""
+        tmp_path = self.path + '.compact.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                json_codec.write_file(f, records)
+            with file_lock(self.lock_path):
+                os.replace(tmp_path, self.path)
+                if os.path.exists(self.old_log_path):
+                    os.remove(self.old_log_path)
+        finally:
+            self._compacting = False
+            os.close(compact_fd)
+
+
+def _copy_record(record):
+    """复制记录（包括一层嵌套的字典和列表），供后台线程安全地序列化"""
+    return {key: value.copy() if isinstance(value, (dict, list)) else value
+            for key, value in record.items()}
+
+
+class SqliteDatabase:
+    """共享的SQLite连接（WAL模式），同一数据库文件的所有集合共用一个连接"""
+
+    _instances = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._pid = None
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                status TEXT,
+                created_at TEXT,
+                data TEXT NOT NULL
+            )""")
+        # 按项目（和状态）读取、分页查询任务，以及按创建时间过滤
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_project ON tasks (project_id, status)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (project_id, created_at)")
+
+    @property
+    def conn(self):
+        """当前进程的数据库连接（fork 之后重新连接）"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        return self._conn
+
+    @classmethod
+    def open(cls, path):
+        """按路径获取（或创建）数据库实例"""
+        if path not in cls._instances:
+            cls._instances[path] = cls(path)
+        return cls._instances[path]
+
+    def ensure_table(self, table, indexes=True):
+        """创建记录表，indexes 为真时建立分页查询（SqliteBackend.query）使用的索引
+
+        索引按 created_at 倒序排列，相同时间的记录按 rowid（插入顺序）排列，与内存中的有序视图一致；
+        只按 rowid 读取的表（聊天消息）不建索引，删除旧版本建立的索引以减少写入开销。
+        """
+        with self.lock:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id TEXT PRIMARY KEY,
+                    created_at TEXT,
+                    status TEXT,
+                    data TEXT NOT NULL
+                )""")
+            if indexes:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_created ON {table} (created_at DESC)")
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_status ON {table} (status, created_at DESC)")
+            else:
+                self.conn.execute(f"DROP INDEX IF EXISTS idx_{table}_created")
+                self.conn.execute(f"DROP INDEX IF EXISTS idx_{table}_status")
+
+    def transaction(self):
+        """返回在锁内执行的事务上下文"""
+        return _Transaction(self)
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.lock.acquire()
+        self.db.conn.execute("BEGIN IMMEDIATE")
+        return self.db.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.db.lock.release()
+
+
+def _time_column(value):
+    """表中的时间列：统一为 paginate 比较时使用的格式（ISO格式的 T 视为空格）"""
+    return _time_value(value) if value else None
+
+
+def _record_row(record):
+    """记录转为表中的一行，created_at 兼容聊天消息的 timestamp 字段"""
+    return (record["id"], _time_column(record.get("created_at", record.get("timestamp"))), record.get("status"),
+            json_codec.dumps(record))
+
+
+def _time_range_sql(column, created_from=None, created_to=None):
+    """时间范围（闭区间，可以只给日期等前缀）的SQL条件和参数，与 paginate 的语义相同"""
+    clauses, params = [], []
+    if created_from:
+        clauses.append(f"{column} >= ?")
+        params.append(_time_value(created_from))
+    if created_to:
+        # 前缀不大于 end 等价于不大于 end 后接最大的字符
+        clauses.append(f"{column} <= ?")
+        params.append(_time_value(created_to) + "\U0010ffff")
+    return clauses, params
+
+
+def _fetch_page(db, sql, params, limit):
+    """执行查询并取一页（多取一条判断是否还有下一页），返回 (本页记录, 下一页游标)"""
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = params + [limit + 1]
+    with db.lock:
+        rows = db.conn.execute(sql, params).fetchall()
+    records = [json_codec.loads(row[0]) for row in rows]
+    if limit is not None and len(records) > limit:
+        return records[:limit], records[limit - 1]["id"]
+    return records, None
+
+
+class SqliteBackend:
+    """SQLite存储：每次变更只写入涉及的行，列表的过滤和分页由 query() 在索引上完成"""
+
+    # 有独立索引列的字段，其他过滤字段从记录的JSON中取值
+    COLUMNS = ("status",)
+    supports_query = True
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.lock_path = f"{db.path}.{table}.lock"
+        db.ensure_table(table)
+
+    def load(self):
+        """按插入顺序加载全部记录"""
+        with self.db.lock:
+            rows = self.db.conn.execute(f"SELECT data FROM {self.table} ORDER BY rowid").fetchall()
+        return [json_codec.loads(row[0]) for row in rows]
+
+    def write(self, puts, deletes, records):
+        """在一个事务中写入变更"""
+        with self.db.transaction() as conn:
+            # UPSERT 保留原有 rowid，从而保持记录的插入顺序
+            conn.executemany(
+                f"INSERT INTO {self.table} (id, created_at, status, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET created_at=excluded.created_at, "
+                "status=excluded.status, data=excluded.data",
+                [_record_row(record) for record in puts])
+            conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", [(record_id,) for record_id in deletes])
+
+    def snapshot(self, records):
+        """用给定的记录替换整张表"""
+        with self.db.transaction() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.executemany(f"INSERT INTO {self.table} (id, created_at, status, data) VALUES (?, ?, ?, ?)",
+                             [_record_row(record) for record in records])
+
+    def query(self, after=None, limit=None, where=None, created_from=None, created_to=None):
+        """按 created_at 倒序分页查询，返回 (本页记录, 下一页游标)，结果与 IndexedCollection.page 相同
+
+        where 为等值过滤条件 {字段: 值}（值为None的条件忽略）；after 为上一页最后一条记录的id，
+        不满足过滤条件时抛出 InvalidCursor。
+        """
+        clauses, params = [], []
+        for field, value in (where or {}).items():
+            if value is not None:
+                clauses.append(f"{field} = ?" if field in self.COLUMNS else f"json_extract(data, '$.{field}') = ?")
+                params.append(value)
+
+        if after is not None:
+            sql = f"SELECT created_at, rowid FROM {self.table} WHERE " + " AND ".join(["id = ?"] + clauses)
+            with self.db.lock:
+                row = self.db.conn.execute(sql, [after] + params).fetchone()
+            if row is None:
+                raise InvalidCursor(after)
+            # 排在游标之后：时间更早，或时间相同且插入更晚
+            clauses.append("created_at <= ? AND (created_at < ? OR rowid > ?)")
+            params += [row[0], row[0], row[1]]
+
+        time_clauses, time_params = _time_range_sql("created_at", created_from, created_to)
+        clauses += time_clauses
+        params += time_params
+        sql = f"SELECT data FROM {self.table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return _fetch_page(self.db, sql + " ORDER BY created_at DESC, rowid", params, limit)
+
+
+class TaskFileStore:
+    """项目任务存储：每个项目一个 tasks/<project_id>.json 文件"""
+
+    # 不支持 query()，任务在内存中的列表上过滤和分页
+    supports_query = False
+
+    def __init__(self, tasks_dir):
+        self.tasks_dir = tasks_dir
+
+    def _path(self, project_id):
+        return os.path.join(self.tasks_dir, f"{project_id}.json")
+
+    def create(self, project_id):
+        """为新项目创建空的任务列表"""
+        self.save(project_id, [])
+
+    def load(self, project_id, status=None):
+        """加载项目任务，可按状态过滤"""
+        tasks = JsonFileBackend(self._path(project_id)).load()
+        if status is not None:
+            tasks = [task for task in tasks if task["status"] == status]
+        return tasks
+
+    def save(self, project_id, tasks):
+        """保存项目的全部任务"""
+        JsonFileBackend(self._path(project_id)).snapshot(tasks)
+
+    def drop(self, project_id):
+        """删除项目的任务文件"""
+        tasks_file = self._path(project_id)
+        if os.path.exists(tasks_file):
+            os.remove(tasks_file)
+
+
+class SqliteTaskStore:
+    """项目任务存储：SQLite tasks 表，按 project_id/status 索引查询"""
+
+    supports_query = True
+
+    def __init__(self, db):
+        self.db = db
+
+    def create(self, project_id):
+        """SQLite中无需为新项目预先创建任何内容"""
+
+    def load(self, project_id, status=None):
+        """加载项目任务，可按状态过滤"""
+        sql = "SELECT data FROM tasks WHERE project_id = ?"
+        params = [project_id]
+        if status is not None:
+            sql += " AND status = ?"
+            params.append(status)
+        with self.db.lock:
+            rows = self.db.conn.execute(sql + " ORDER BY rowid", params).fetchall()
+        return [json_codec.loads(row[0]) for row in rows]
+
+    def save(self, project_id, tasks):
+        """保存项目的全部任务（删除已不存在的任务，其余按id更新）"""
+        with self.db.transaction() as conn:
+            existing = {row[0] for row in conn.execute("SELECT id FROM tasks WHERE project_id = ?", (project_id,))}
+            removed = existing - {task["id"] for task in tasks}
+            conn.executemany("DELETE FROM tasks WHERE id = ?", [(task_id,) for task_id in removed])
+            conn.executemany(
+                "INSERT INTO tasks (id, project_id, status, created_at, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status=excluded.status, data=excluded.data",
+                [(task["id"], project_id, task.get("status"), _time_column(task.get("created_at")),
+                  json_codec.dumps(task)) for task in tasks])
+
+    def query(self, project_id, after=None, limit=None, status=None, priority=None, due_from=None, due_to=None,
+              created_from=None, created_to=None):
+        """按创建顺序分页查询项目任务，返回 (本页任务, 下一页游标)，结果与内存中的过滤和分页相同"""
+        clauses, params = ["project_id = ?"], [project_id]
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if after is not None:
+            sql = "SELECT rowid FROM tasks WHERE " + " AND ".join(["id = ?"] + clauses)
+            with self.db.lock:
+                row = self.db.conn.execute(sql, [after] + params).fetchone()
+            if row is None:
+                raise InvalidCursor(after)
+            clauses.append("rowid > ?")
+            params.append(row[0])
+
+        if priority is not None:
+            clauses.append("json_extract(data, '$.priority') = ?")
+            params.append(priority)
+        if due_from:
+            clauses.append("json_extract(data, '$.due_date') >= ?")
+            params.append(due_from)
+        if due_to:
+            # 没有截止日期的任务不在范围内；截止日期按前缀与 due_to 比较
+            clauses.append("json_extract(data, '$.due_date') <> '' AND json_extract(data, '$.due_date') <= ?")
+            params.append(due_to + "\U0010ffff")
+        time_clauses, time_params = _time_range_sql("created_at", created_from, created_to)
+        sql = "SELECT data FROM tasks WHERE " + " AND ".join(clauses + time_clauses) + " ORDER BY rowid"
+        return _fetch_page(self.db, sql, params + time_params, limit)
+
+    def drop(self, project_id):
+        """删除项目的全部任务"""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM tasks WHERE project_id = ?", (project_id,))
+
+
+class TaskCache:
+    """项目任务列表的LRU缓存，支持写回（write-behind）
+
+    load 返回缓存中的列表本身，调用方原地修改后调用 save。
+    flush_interval 为0时 save 直接写入底层存储（直写）；大于0时 save 只把项目标记为脏，
+    由后台定时器每 flush_interval 秒统一写盘，脏项目数达到 max_dirty 时立即写盘，
+    从而把一连串修改合并为一次写入。淘汰脏项目前先写盘，进程退出时写入全部脏项目。
+    写回模式下其他进程看不到尚未写盘的修改，多进程部署应使用直写。
+    model 为记录类型（models.Task）时，从底层存储读到的任务由它整理（驻留取值有限的字段）。
+    """
+
+    def __init__(self, store, capacity=256, flush_interval=0, max_dirty=64, lock=None, model=None):
+        self.store = store
+        self.model = model
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        # 后台写盘时持有的集合锁（CollectionLock）
+        self.lock = lock
+        self.entries = OrderedDict()
+        self.dirty = set()
+        self.hits = 0
+        self.misses = 0
+        self._mutex = threading.RLock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    def create(self, project_id):
+        """为新项目创建空的任务列表"""
+        with self._mutex:
+            self._changed()
+            self.store.create(project_id)
+            self._put(project_id, [])
+
+    def load(self, project_id, status=None):
+        """获取项目任务列表，可按状态过滤（过滤时返回新列表）"""
+        with self._mutex:
+            tasks = self.entries.get(project_id)
+            if tasks is None:
+                self.misses += 1
+                tasks = self._load(project_id)
+                self._put(project_id, tasks)
+            else:
+                self.hits += 1
+                self.entries.move_to_end(project_id)
+        if status is not None:
+            return [task for task in tasks if task["status"] == status]
+        return tasks
+
+    def queryable(self, project_id):
+        """能否直接在底层存储上查询项目任务（存储支持查询，且项目没有未写盘的修改）"""
+        return self.store.supports_query and project_id not in self.dirty
+
+    def query(self, project_id, *args, **kwargs):
+        """在底层存储上分页查询项目任务（先用 queryable 检查），返回 (本页任务, 下一页游标)"""
+        tasks, cursor = self.store.query(project_id, *args, **kwargs)
+        return (self.model.from_list(tasks) if self.model is not None else tasks), cursor
+
+    def peek(self, project_id):
+        """获取项目任务列表但不放入缓存（用于导出等一次性遍历，不挤掉常用的项目）"""
+        with self._mutex:
+            tasks = self.entries.get(project_id)
+        return tasks if tasks is not None else self._load(project_id)
+
+    def _load(self, project_id):
+        tasks = self.store.load(project_id)
+        return self.model.from_list(tasks) if self.model is not None else tasks
+
+    def save(self, project_id, tasks):
+        """保存项目任务列表"""
+        with self._mutex:
+            self._changed()
+            self._put(project_id, tasks)
+            if self.flush_interval <= 0:
+                self.store.save(project_id, tasks)
+                return
+            self.dirty.add(project_id)
+            if len(self.dirty) >= self.max_dirty:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def drop(self, project_id):
+        """删除项目的全部任务"""
+        with self._mutex:
+            self._changed()
+            self.entries.pop(project_id, None)
+            self.dirty.discard(project_id)
+            self.store.drop(project_id)
+
+    def flush(self):
+        """把所有脏项目写入底层存储"""
+        with self._mutex:
+            for project_id in list(self.dirty):
+                self.store.save(project_id, self.entries[project_id])
+            self.dirty.clear()
+
+    def clear(self):
+        """写入脏项目后清空缓存（其他进程修改了数据时调用）"""
+        with self._mutex:
+            self.flush()
+            self.entries.clear()
+
+    def _flush_in_background(self):
+        self._timer = None
+        if self.lock is None:
+            self.flush()
+            return
+        with self.lock.write():
+            if self.dirty:
+                self.lock.changed()
+            self.flush()
+
+    def _changed(self):
+        # 在调用方的写锁内修改了任务，退出写锁时递增代数
+        if self.lock is not None:
+            self.lock.changed()
+
+    def _put(self, project_id, tasks):
+        self.entries[project_id] = tasks
+        self.entries.move_to_end(project_id)
+        while len(self.entries) > self.capacity:
+            evicted_id, evicted = self.entries.popitem(last=False)
+            if evicted_id in self.dirty:
+                self.store.save(evicted_id, evicted)
+                self.dirty.discard(evicted_id)
+
+
+def _time_digits(value):
+    """时间字符串只保留数字，用于段文件名和按前缀比较"""
+    return "".join(ch for ch in value if ch.isdigit())
+
+
+def _time_window(messages, start=None, end=None, time_key="timestamp", reverse=False):
+    """按闭区间 [start, end] 过滤按时间排序的消息，越过区间边界后提前结束
+
+    start/end 可以只给日期等前缀，与 paginate 的时间范围语义相同。
+    """
+    start = _time_value(start) if start else None
+    end = _time_value(end) if end else None
+    for message in messages:
+        value = _time_value(message.get(time_key))
+        if start is not None and value < start:
+            if reverse:
+                return
+            continue
+        if end is not None and value[:len(end)] > end:
+            if reverse:
+                continue
+            return
+        yield message
+
+
+def paginate_iter(messages, limit=None, match=None):
+    """从（惰性的）消息序列中取一页，返回 (本页消息, 下一页游标)"""
+    items = []
+    for message in messages:
+        if match is not None and not match(message):
+            continue
+        if limit is not None and len(items) >= limit:
+            return items, items[-1]["id"]
+        items.append(message)
+    return items, None
+
+
+class SegmentedLog:
+    """按时间顺序分段存储的追加日志（用于聊天记录）
+
+    每段是一个 JSONL 文件，文件名为 <序号>_<首条消息时间>.jsonl，写满 segment_size 条后开始新段，
+    追加一条消息只写一行。内存中只保留当前段，更早的段在分页读取时按需加载，
+    最近用到的 cache_segments 段缓存在内存中。
+    开始新段时执行保留策略：删除全部消息都早于 retention_days 天前的段，
+    并只保留最新的 max_segments 段（0表示不限制）；compress 为真时把写满的段压缩为 .jsonl.gz。
+    model 为记录类型（models.Message）时，读到的消息由它整理（驻留取值有限的字段）。
+    写入由调用方的 CollectionLock 保护；读取可以在多个读锁内并发进行，段缓存由单独的互斥锁保护。
+    """
+
+    _NAME_RE = re.compile(r"^(\d{8})_(\d+)\.jsonl(\.gz)?$")
+
+    def __init__(self, directory, segment_size=1000, cache_segments=4, retention_days=0,
+                 max_segments=0, compress=False, time_key="timestamp", model=None):
+        self.directory = directory
+        self.lock_path = os.path.join(directory, 'segments.lock')
+        self.segment_size = segment_size
+        self.cache_segments = cache_segments
+        self.retention_days = retention_days
+        self.max_segments = max_segments
+        self.compress = compress
+        self.time_key = time_key
+        self.model = model
+        self._cache_mutex = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.reload()
+
+    def reload(self):
+        """重新扫描段文件并加载当前段"""
+        segments = []
+        for filename in os.listdir(self.directory):
+            match = self._NAME_RE.match(filename)
+            if match:
+                segments.append((int(match.group(1)), match.group(2), filename))
+        segments.sort()
+        # [序号, 首条消息时间（数字）, 文件名]
+        self.segments = [list(segment) for segment in segments]
+        self._cache = OrderedDict()
+        self.current = self._read(self.segments[-1][2]) if self.segments else []
+        self.current_ids = {message["id"]: i for i, message in enumerate(self.current)}
+
+    def __len__(self):
+        """消息条数（未加载的段按写满计算，只用于统计）"""
+        if not self.segments:
+            return 0
+        return (len(self.segments) - 1) * self.segment_size + len(self.current)
+
+    def _read(self, filename):
+        path = os.path.join(self.directory, filename)
+        messages = []
+        try:
+            f = gzip.open(path, 'rt', encoding='utf-8') if filename.endswith('.gz') \
+                else open(path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            # 其他进程已经压缩或按保留策略删除了这一段
+            if not filename.endswith('.gz') and os.path.exists(path + '.gz'):
+                return self._read(filename + '.gz')
+            return messages
+        with f:
+            for line in f:
+                try:
+                    messages.append(json_codec.loads(line))
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下写了一半的行
+                    continue
+        return self.model.from_list(messages) if self.model is not None else messages
+
+    def _segment(self, index):
+        """返回第 index 段的消息列表（按需加载并缓存）"""
+        if index == len(self.segments) - 1:
+            return self.current
+        filename = self.segments[index][2]
+        with self._cache_mutex:
+            messages = self._cache.get(filename)
+            if messages is not None:
+                self._cache.move_to_end(filename)
+                return messages
+        # 在互斥锁外读取文件，两个读者同时加载同一段时结果相同，后放入缓存的覆盖先放入的
+        messages = self._read(filename)
+        with self._cache_mutex:
+            self._cache[filename] = messages
+            while len(self._cache) > self.cache_segments:
+                self._cache.popitem(last=False)
+        return messages
+
+    def append(self, message):
+        """追加一条消息"""
+        if not self.segments or len(self.current) >= self.segment_size:
+            self._start_segment(message)
+        path = os.path.join(self.directory, self.segments[-1][2])
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json_codec.dumps(message) + '\n')
+        self.current_ids[message["id"]] = len(self.current)
+        self.current.append(message)
+
+    def extend(self, messages):
+        """追加多条消息，每段只打开一次文件"""
+        batch = []
+        for message in messages:
+            if not self.segments or len(self.current) + len(batch) >= self.segment_size:
+                self._write_batch(batch)
+                batch = []
+                self._start_segment(message)
+            batch.append(message)
+        self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        path = os.path.join(self.directory, self.segments[-1][2])
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write("".join(json_codec.dumps(message) + '\n'
+                            for message in batch))
+        for message in batch:
+            self.current_ids[message["id"]] = len(self.current)
+            self.current.append(message)
+
+    def _start_segment(self, message):
+        if self.segments and self.compress:
+            self._compress(self.segments[-1])
+        seq = self.segments[-1][0] + 1 if self.segments else 1
+        stamp = _time_digits(message.get(self.time_key) or "") or "0"
+        filename = f"{seq:08d}_{stamp}.jsonl"
+        open(os.path.join(self.directory, filename), 'a').close()
+        self.segments.append([seq, stamp, filename])
+        self.current = []
+        self.current_ids = {}
+        self._apply_retention(stamp)
+
+    def _compress(self, segment):
+        path = os.path.join(self.directory, segment[2])
+        with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + '.gz.tmp', path + '.gz')
+        os.remove(path)
+        segment[2] += '.gz'
+
+    def _apply_retention(self, now_stamp):
+        """删除超出保留期限或段数上限的旧段（不会删除当前段）"""
+        drop = 0
+        if self.max_segments > 0:
+            drop = max(drop, len(self.segments) - self.max_segments)
+        if self.retention_days > 0:
+            cutoff = _time_digits((datetime.datetime.now()
+                                   - datetime.timedelta(days=self.retention_days)).isoformat())
+            # 下一段的首条消息早于截止时间，说明这一段的消息全部过期
+            while drop < len(self.segments) - 1 and self.segments[drop + 1][1] < cutoff:
+                drop += 1
+        for segment in self.segments[:drop]:
+            self._cache.pop(segment[2], None)
+            try:
+                os.remove(os.path.join(self.directory, segment[2]))
+            except FileNotFoundError:
+                pass
+        del self.segments[:drop]
+
+    def _locate(self, message_id):
+        """返回消息所在的 (段号, 段内位置)，优先查找当前段和已缓存的段"""
+        if message_id in self.current_ids:
+            return len(self.segments) - 1, self.current_ids[message_id]
+        by_name = {segment[2]: i for i, segment in enumerate(self.segments)}
+        with self._cache_mutex:
+            recent = list(reversed(self._cache))
+        cached = [by_name[name] for name in recent if name in by_name]
+        others = [i for i in range(len(self.segments) - 2, -1, -1) if i not in cached]
+        for index in cached + others:
+            for position, message in enumerate(self._segment(index)):
+                if message["id"] == message_id:
+                    return index, position
+        raise InvalidCursor(message_id)
+
+    def iter_reverse(self, before=None, created_from=None, created_to=None):
+        """从新到旧遍历消息，从游标 before 之前开始"""
+        return _time_window(self._reverse(before, created_from, created_to), created_from,
+                            created_to, self.time_key, reverse=True)
+
+    def _reverse(self, before, created_from, created_to):
+        index, position = len(self.segments) - 1, None
+        if before is not None:
+            index, position = self._locate(before)
+        from_digits = _time_digits(_time_value(created_from)) if created_from else None
+        to_digits = _time_digits(_time_value(created_to)) if created_to else None
+        while index >= 0:
+            # 按文件名中的时间跳过整段都晚于结束时间的段
+            if to_digits is None or self.segments[index][1][:len(to_digits)] <= to_digits:
+                messages = self._segment(index)
+                end = len(messages) if position is None else position
+                for i in range(end - 1, -1, -1):
+                    yield messages[i]
+            if from_digits is not None and self.segments[index][1] < from_digits:
+                return
+            index, position = index - 1, None
+
+    def iter_forward(self, after=None, created_from=None, created_to=None):
+        """从旧到新遍历消息，从游标 after 之后开始"""
+        return _time_window(self._forward(after, created_from), created_from, created_to, self.time_key)
+
+    def _forward(self, after, created_from):
+        index, position = 0, None
+        if after is not None:
+            index, position = self._locate(after)
+        from_digits = _time_digits(_time_value(created_from)) if created_from else None
+        while index < len(self.segments):
+            # 下一段的首条消息早于开始时间，这一段整段都可以跳过
+            skip = (from_digits is not None and index + 1 < len(self.segments)
+                    and self.segments[index + 1][1] < from_digits)
+            if not skip:
+                messages = self._segment(index)
+                start = 0 if position is None else position + 1
+                for i in range(start, len(messages)):
+                    yield messages[i]
+            index, position = index + 1, None
+
+    def recent(self, count):
+        """最近的 count 条消息（按时间顺序）"""
+        messages = []
+        for message in self.iter_reverse():
+            if len(messages) >= count:
+                break
+            messages.append(message)
+        messages.reverse()
+        return messages
+
+    def clear(self):
+        """删除全部消息"""
+        for segment in self.segments:
+            try:
+                os.remove(os.path.join(self.directory, segment[2]))
+            except FileNotFoundError:
+                pass
+        self.segments = []
+        self._cache = OrderedDict()
+        self.current = []
+        self.current_ids = {}
+
+
+class SqliteMessageLog:
+    """SQLite中的消息日志，接口与 SegmentedLog 相同，按 rowid 分批读取"""
+
+    def __init__(self, db, table="chat_messages", time_key="timestamp", batch_size=256, model=None):
+        self.db = db
+        self.table = table
+        self.time_key = time_key
+        self.batch_size = batch_size
+        self.model = model
+        self.lock_path = f"{db.path}.{table}.lock"
+        db.ensure_table(table, indexes=False)
+
+    def reload(self):
+        """数据都在数据库中，无需重新加载"""
+
+    def __len__(self):
+        with self.db.lock:
+            return self.db.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def append(self, message):
+        """追加一条消息"""
+        with self.db.transaction() as conn:
+            conn.execute(f"INSERT INTO {self.table} (id, created_at, status, data) VALUES (?, ?, ?, ?)",
+                         _record_row(message))
+
+    def extend(self, messages):
+        """在一个事务中追加多条消息"""
+        with self.db.transaction() as conn:
+            conn.executemany(f"INSERT INTO {self.table} (id, created_at, status, data) VALUES (?, ?, ?, ?)",
+                             (_record_row(message) for message in messages))
+
+    def _rowid(self, message_id):
+        with self.db.lock:
+            row = self.db.conn.execute(f"SELECT rowid FROM {self.table} WHERE id = ?", (message_id,)).fetchone()
+        if row is None:
+            raise InvalidCursor(message_id)
+        return row[0]
+
+    def _scan(self, rowid, descending):
+        """从 rowid 开始（不含）分批读取，每批读取时才持有数据库锁"""
+        op, order = ("<", "DESC") if descending else (">", "ASC")
+        while True:
+            with self.db.lock:
+                rows = self.db.conn.execute(
+                    f"SELECT rowid, data FROM {self.table} WHERE rowid {op} ? ORDER BY rowid {order} LIMIT ?",
+                    (rowid, self.batch_size)).fetchall()
+            for rowid, data in rows:
+                message = json_codec.loads(data)
+                yield self.model.from_dict(message) if self.model is not None else message
+            if len(rows) < self.batch_size:
+                return
+
+    def iter_reverse(self, before=None, created_from=None, created_to=None):
+        """从新到旧遍历消息，从游标 before 之前开始"""
+        rowid = self._rowid(before) if before is not None else 2 ** 63 - 1
+        return _time_window(self._scan(rowid, True), created_from, created_to, self.time_key, reverse=True)
+
+    def iter_forward(self, after=None, created_from=None, created_to=None):
+        """从旧到新遍历消息，从游标 after 之后开始"""
+        rowid = self._rowid(after) if after is not None else 0
+        return _time_window(self._scan(rowid, False), created_from, created_to, self.time_key)
+
+    def recent(self, count):
+        """最近的 count 条消息（按时间顺序）"""
+        messages = []
+        for message in self.iter_reverse():
+            if len(messages) >= count:
+                break
+            messages.append(message)
+        messages.reverse()
+        return messages
+
+    def clear(self):
+        """删除全部消息"""
+        with self.db.transaction() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+
+def sqlite_path():
+    """SQLite数据库文件路径（SQLITE_PATH 环境变量，默认为 workspace.db）"""
+    return os.getenv('SQLITE_PATH', os.path.join(DATA_DIR, 'workspace.db'))
+
+
+def open_backend(path, table):
+    """按 STORAGE_BACKEND 环境变量创建存储后端（json、journal 或 sqlite）
+
+    json/journal 后端使用 path 指向的文件，sqlite 后端使用数据库中的 table 表。
+    """
+    kind = os.getenv('STORAGE_BACKEND', 'json')
+    if kind == 'sqlite':
+        return SqliteBackend(SqliteDatabase.open(sqlite_path()), table)
+    if kind == 'journal':
+        return JournalBackend(path, compact_every=int(os.getenv('JOURNAL_COMPACT_EVERY', 1000)))
+    if kind == 'json':
+        return JsonFileBackend(path)
+    raise ValueError(f"未知的存储后端: {kind}")
+
+
+def open_task_store(tasks_dir):
+    """按 STORAGE_BACKEND 环境变量创建项目任务存储"""
+    if os.getenv('STORAGE_BACKEND', 'json') == 'sqlite':
+        return SqliteTaskStore(SqliteDatabase.open(sqlite_path()))
+    return TaskFileStore(tasks_dir)
+
+
+def open_note_content(path, mode='r'):
+    """打开笔记正文文件，.gz 结尾的文件为压缩存储（mode 为 'r' 或 'rb'）"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt' if mode == 'r' else mode, encoding='utf-8' if mode == 'r' else None)
+    return open(path, mode, encoding='utf-8' if mode == 'r' else None)
+
+
+def load_json_records(path):
+    """加载JSON索引文件（存在日志时一并重放）"""
+    if os.path.exists(path + '.log'):
+        return JournalBackend(path).load()
+    return JsonFileBackend(path).load()
+
+
+def open_message_log(chat_dir, model=None):
+    """按 STORAGE_BACKEND 环境变量创建聊天消息日志
+
+    sqlite 后端使用 chat_messages 表，其他后端使用 chats/segments/ 下的分段文件。
+    第一次创建分段目录时导入旧的 chat_history.json。model 为消息的记录类型。
+    """
+    if os.getenv('STORAGE_BACKEND', 'json') == 'sqlite':
+        return SqliteMessageLog(SqliteDatabase.open(sqlite_path()), model=model)
+
+    directory = os.path.join(chat_dir, 'segments')
+    legacy = os.path.join(chat_dir, 'chat_history.json')
+    needs_import = not os.path.isdir(directory) and os.path.exists(legacy)
+    log = SegmentedLog(
+        directory,
+        segment_size=int(os.getenv('CHAT_SEGMENT_SIZE', 1000)),
+        cache_segments=int(os.getenv('CHAT_SEGMENT_CACHE', 4)),
+        retention_days=float(os.getenv('CHAT_RETENTION_DAYS', 0)),
+        max_segments=int(os.getenv('CHAT_MAX_SEGMENTS', 0)),
+        compress=os.getenv('CHAT_COMPRESS_SEGMENTS', '').lower() in ('true', '1', 'yes'),
+        model=model
+    )
+    if needs_import:
+        with file_lock(log.lock_path):
+            for message in load_json_records(legacy):
+                log.append(model.from_dict(message) if model is not None else message)
+    return log
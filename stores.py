@@ -0,0 +1,775 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""待办、项目（含项目任务）和聊天记录的存储
+
+与 note_store.NoteStore 一样由Web服务和命令行（工作区导出/导入）共用：所有修改都在集合锁内进行
+并记录到变更序列，多个进程同时读写同一数据目录时互不覆盖。
+"""
+
+import os
+import uuid
+import datetime
+
+from storage import (DATA_DIR, CollectionLock, IndexedCollection, TaskCache, open_backend, open_message_log,
+                     open_task_store, paginate, paginate_iter)
+from changes import open_change_feed
+from models import UNSET, Message, Project, Session, Task, Todo
+from metrics import STORAGE_SECONDS
+
+
+class TodoStore:
+    """待办存储（Web服务和命令行共用）"""
+
+    def __init__(self, change_feed=None):
+        self.change_feed = change_feed if change_feed is not None else open_change_feed()
+        
+        # 创建待办存储目录
+        self.todos_dir = os.path.join(DATA_DIR, "todos")
+        if not os.path.exists(self.todos_dir):
+            os.makedirs(self.todos_dir)
+        
+        # 待办索引文件
+        self.index_file = os.path.join(self.todos_dir, "todos.json")
+        self.store = open_backend(self.index_file, "todos")
+        self.todos_index = IndexedCollection(self.load_index())
+        self.lock = CollectionLock(self.store.lock_path, self.reload_index)
+        
+        # 如果没有待办事项，创建默认示例数据
+        with self.lock.write():
+            if not self.todos_index:
+                self.create_default_todos()
+    
+    def load_index(self):
+        """加载待办索引"""
+        with STORAGE_SECONDS.time(collection="todos", operation="load"):
+            return Todo.from_list(self.store.load())
+    
+    def reload_index(self):
+        """其他进程修改数据后重新加载待办索引"""
+        self.todos_index = IndexedCollection(self.load_index())
+    
+    def save_index(self, puts=(), deletes=()):
+        """保存待办索引的变更"""
+        self.lock.changed()
+        with STORAGE_SECONDS.time(collection="todos", operation="save"):
+            self.store.write(puts, deletes, self.todos_index)
+    
+    def create_default_todos(self):
+        """创建默认待办示例数据"""
+        default_todos = [
+            {"title": "完成项目文档", "completed": False},
+            {"title": "学习新技术", "completed": False},
+            {"title": "整理代码库", "completed": True},
+            {"title": "准备会议材料", "completed": False},
+            {"title": "回复重要邮件", "completed": True}
+        ]
+        
+        for todo_data in default_todos:
+            self.create_todo(todo_data["title"], todo_data["completed"])
+    
+    def _new_todo(self, title, completed=False):
+        """在内存中创建待办（不持久化）"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        todo_id = str(uuid.uuid4())
+        
+        todo_info = Todo.new(
+            id=todo_id,
+            title=title,
+            completed=completed,
+            created_at=timestamp,
+            completed_at=timestamp if completed else UNSET
+        )
+        
+        return self.todos_index.add(todo_info)
+    
+    def _apply_todo_update(self, todo, title=None, completed=None):
+        """在内存中修改待办（不持久化）"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if title is not None:
+            todo["title"] = title
+        
+        if completed is not None:
+            todo["completed"] = completed
+            if completed:
+                todo["completed_at"] = timestamp
+            else:
+                todo.pop("completed_at", None)
+        
+        todo["updated_at"] = timestamp
+        self.todos_index.touch(todo)
+        return todo
+    
+    def create_todo(self, title, completed=False):
+        """创建新待办"""
+        with self.lock.write():
+            todo_info = self._new_todo(title, completed)
+            self.save_index(puts=[todo_info])
+            self.change_feed.publish([("todos", "create", todo_info)])
+            return todo_info
+    
+    def list_todos(self):
+        """列出所有待办"""
+        with self.lock.read():
+            return self.todos_index.sorted()
+    
+    def query_todos(self, after=None, limit=None, completed=None, created_from=None, created_to=None):
+        """分页查询待办，可按完成状态过滤，返回 (本页待办, 下一页游标)"""
+        with self.lock.read():
+            if self.store.supports_query:
+                todos, cursor = self.store.query(after, limit, where={"completed": completed},
+                                                 created_from=created_from, created_to=created_to)
+                return Todo.from_list(todos), cursor
+            return self.todos_index.page(after, limit, where={"completed": completed},
+                                         created_from=created_from, created_to=created_to)
+    
+    def update_todo(self, todo_id, title=None, completed=None):
+        """更新待办"""
+        with self.lock.write():
+            todo = self.todos_index.get(todo_id)
+            if todo:
+                self._apply_todo_update(todo, title, completed)
+                self.save_index(puts=[todo])
+                self.change_feed.publish([("todos", "update", todo)])
+                return todo
+            return None
+    
+    def delete_todo(self, todo_id):
+        """删除待办"""
+        with self.lock.write():
+            deleted_todo = self.todos_index.remove(todo_id)
+            if deleted_todo:
+                self.save_index(deletes=[todo_id])
+                self.change_feed.publish([("todos", "delete", deleted_todo)])
+                return deleted_todo
+            return None
+    
+    def apply_batch(self, operations):
+        """批量执行待办操作，全部校验通过后一次性应用，只持久化一次
+        
+        operations 中每一项为 {"op": "create", "title", "completed"}、
+        {"op": "update", "id", "title", "completed"} 或 {"op": "delete", "id"}。
+        任一操作无效时抛出 ValueError，不做任何修改。返回每个操作的结果。
+        """
+        with self.lock.write():
+            validate_batch(operations, set(self.todos_index.by_id), Todo)
+            
+            puts, deletes, results = {}, [], []
+            for operation in operations:
+                op = operation["op"]
+                if op == "create":
+                    todo = self._new_todo(operation["title"], operation.get("completed", False))
+                    puts[todo["id"]] = todo
+                    results.append(todo)
+                elif op == "update":
+                    todo = self._apply_todo_update(self.todos_index.get(operation["id"]),
+                                                   operation.get("title"), operation.get("completed"))
+                    puts[todo["id"]] = todo
+                    results.append(todo)
+                else:
+                    self.todos_index.remove(operation["id"])
+                    puts.pop(operation["id"], None)
+                    deletes.append(operation["id"])
+                    results.append({"id": operation["id"], "deleted": True})
+            
+            self.save_index(puts=list(puts.values()), deletes=deletes)
+            self.change_feed.publish(batch_changes("todos", operations, results))
+            return results
+    
+    def import_todos(self, records):
+        """按id批量写入待办（不存在时新建，存在时覆盖），只持久化一次，返回新建和更新的数量"""
+        with self.lock.write():
+            changes = [("todos", "update" if record["id"] in self.todos_index else "create",
+                        self.todos_index.add(Todo.from_dict(dict(record)))) for record in records]
+            if changes:
+                self.save_index(puts=[todo for _, _, todo in changes])
+                self.change_feed.publish(changes)
+            created = sum(1 for _, op, _ in changes if op == "create")
+            return {"created": created, "updated": len(changes) - created}
+
+def batch_changes(collection, operations, results):
+    """把批量操作的结果转为变更事件"""
+    return [(collection, operation["op"], result) for operation, result in zip(operations, results)]
+
+def validate_batch(operations, existing_ids, model):
+    """校验批量操作：操作类型有效、新建时有标题、更新/删除的记录存在（考虑批次内先前的删除），
+    新建/更新的字段符合记录类型 model 的要求"""
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("操作列表不能为空")
+    
+    alive = set(existing_ids)
+    for i, operation in enumerate(operations, 1):
+        if not isinstance(operation, dict):
+            raise ValueError(f"第{i}个操作格式无效")
+        op = operation.get("op")
+        if op == "create":
+            if not operation.get("title"):
+                raise ValueError(f"第{i}个操作缺少标题")
+        elif op in ("update", "delete"):
+            if operation.get("id") not in alive:
+                raise ValueError(f"第{i}个操作的记录不存在")
+            if op == "delete":
+                alive.discard(operation["id"])
+        else:
+            raise ValueError(f"第{i}个操作类型无效")
+        if op != "delete":
+            try:
+                model.validate(operation, partial=True)
+            except ValueError as e:
+                raise ValueError(f"第{i}个操作: {e}")
+
+def new_task_stats():
+    """空的项目任务统计"""
+    return {"total": 0, "completed": 0, "by_status": {}, "by_priority": {}}
+
+def task_stats_key(task):
+    """任务中影响统计的字段"""
+    return {"status": task.get("status"), "priority": task.get("priority")}
+
+def count_task(stats, key, delta):
+    """把一个任务（task_stats_key 的结果）计入或移出统计"""
+    stats["total"] += delta
+    if key["status"] == "completed":
+        stats["completed"] += delta
+    for field, counts in (("status", stats["by_status"]), ("priority", stats["by_priority"])):
+        value = key[field]
+        counts[value] = counts.get(value, 0) + delta
+        if counts[value] == 0:
+            del counts[value]
+
+def task_progress(stats):
+    """由统计计算项目进度（百分比）"""
+    if not stats["total"]:
+        return 0
+    return int((stats["completed"] / stats["total"]) * 100)
+
+class ProjectStore:
+    """项目和项目任务存储（Web服务和命令行共用）"""
+
+    def __init__(self, change_feed=None):
+        self.change_feed = change_feed if change_feed is not None else open_change_feed()
+        
+        # 创建项目存储目录
+        self.projects_dir = os.path.join(DATA_DIR, "projects")
+        if not os.path.exists(self.projects_dir):
+            os.makedirs(self.projects_dir)
+        
+        # 项目索引文件
+        self.index_file = os.path.join(self.projects_dir, "projects.json")
+        self.store = open_backend(self.index_file, "projects")
+        self.projects_index = IndexedCollection(self.load_index())
+        self.lock = CollectionLock(self.store.lock_path, self.reload_index)
+        
+        # 任务存储目录
+        self.tasks_dir = os.path.join(self.projects_dir, "tasks")
+        if not os.path.exists(self.tasks_dir):
+            os.makedirs(self.tasks_dir)
+        
+        # 任务列表缓存：TASK_FLUSH_INTERVAL 大于0时合并写盘（仅适用于单进程部署）
+        self.tasks = TaskCache(
+            open_task_store(self.tasks_dir),
+            capacity=int(os.getenv('TASK_CACHE_SIZE', 256)),
+            flush_interval=float(os.getenv('TASK_FLUSH_INTERVAL', 0)),
+            max_dirty=int(os.getenv('TASK_FLUSH_MAX_DIRTY', 64)),
+            lock=self.lock,
+            model=Task
+        )
+    
+    def load_index(self):
+        """加载项目索引"""
+        with STORAGE_SECONDS.time(collection="projects", operation="load"):
+            return Project.from_list(self.store.load())
+    
+    def reload_index(self):
+        """其他进程修改数据后重新加载项目索引，并丢弃缓存的任务列表"""
+        self.projects_index = IndexedCollection(self.load_index())
+        self.tasks.clear()
+    
+    def save_index(self, puts=(), deletes=()):
+        """保存项目索引的变更"""
+        self.lock.changed()
+        with STORAGE_SECONDS.time(collection="projects", operation="save"):
+            self.store.write(puts, deletes, self.projects_index)
+    
+    def create_project(self, name, description="", status="active"):
+        """创建新项目"""
+        with self.lock.write():
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            project_id = str(uuid.uuid4())
+        
+            project_info = Project.new(
+                id=project_id,
+                name=name,
+                description=description,
+                status=status,
+                created_at=timestamp,
+                updated_at=timestamp,
+                progress=0,
+                stats=new_task_stats()
+            )
+        
+            self.projects_index.add(project_info)
+            self.save_index(puts=[project_info])
+            self.change_feed.publish([("projects", "create", project_info)])
+        
+            # 创建项目任务列表
+            self.tasks.create(project_id)
+        
+            return project_info
+    
+    def list_projects(self):
+        """列出所有项目"""
+        with self.lock.read():
+            return self.projects_index.sorted()
+    
+    def query_projects(self, after=None, limit=None, status=None, created_from=None, created_to=None):
+        """分页查询项目，可按状态过滤，返回 (本页项目, 下一页游标)"""
+        with self.lock.read():
+            if self.store.supports_query:
+                projects, cursor = self.store.query(after, limit, where={"status": status},
+                                                    created_from=created_from, created_to=created_to)
+                return Project.from_list(projects), cursor
+            return self.projects_index.page(after, limit, where={"status": status},
+                                            created_from=created_from, created_to=created_to)
+    
+    def get_project(self, project_id):
+        """获取指定项目"""
+        with self.lock.read():
+            return self.projects_index.get(project_id)
+    
+    def update_project(self, project_id, name=None, description=None, status=None):
+        """更新项目"""
+        with self.lock.write():
+            project = self.projects_index.get(project_id)
+            if project:
+                if name is not None:
+                    project["name"] = name
+                if description is not None:
+                    project["description"] = description
+                if status is not None:
+                    project["status"] = status
+            
+                project["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.projects_index.touch(project)
+                self.save_index(puts=[project])
+                self.change_feed.publish([("projects", "update", project)])
+                return project
+            return None
+    
+    def delete_project(self, project_id):
+        """删除项目"""
+        with self.lock.write():
+            if project_id in self.projects_index:
+                # 删除项目任务
+                self.tasks.drop(project_id)
+            
+                # 更新索引
+                deleted_project = self.projects_index.remove(project_id)
+                self.save_index(deletes=[project_id])
+                self.change_feed.publish([("projects", "delete", deleted_project)])
+                return deleted_project
+            return None
+    
+    def get_project_tasks(self, project_id, status=None):
+        """获取项目任务列表，可按状态过滤"""
+        with self.lock.read(), STORAGE_SECONDS.time(collection="tasks", operation="load"):
+            return self.tasks.load(project_id, status)
+    
+    def query_tasks(self, project_id, after=None, limit=None, status=None, priority=None,
+                    due_from=None, due_to=None, created_from=None, created_to=None):
+        """分页查询项目任务（按创建顺序），返回 (本页任务, 下一页游标)"""
+        def match(task):
+            if priority is not None and task.get("priority") != priority:
+                return False
+            due_date = task.get("due_date")
+            if due_from and (not due_date or due_date < due_from):
+                return False
+            if due_to and (not due_date or due_date[:len(due_to)] > due_to):
+                return False
+            return True
+        
+        with self.lock.read():
+            if self.tasks.queryable(project_id):
+                return self.tasks.query(project_id, after, limit, status, priority, due_from, due_to,
+                                        created_from, created_to)
+            tasks = self.get_project_tasks(project_id, status)
+            return paginate(tasks, after, limit, match, created_from, created_to, descending=False)
+    
+    def save_project_tasks(self, project_id, tasks, changes=None):
+        """保存项目任务列表
+        
+        changes 为 [(旧任务统计键或None, 新任务统计键或None)]，据此增量更新项目统计；
+        为None时从任务列表重新计算。
+        """
+        self.tasks.save(project_id, tasks)
+        
+        # 更新项目统计和进度
+        project = self.projects_index.get(project_id)
+        if project is None:
+            return
+        if changes is None or "stats" not in project:
+            self._set_project_stats(project, self._compute_stats(tasks))
+            return
+        
+        # 统计以新字典替换而不是原地修改，后台压缩线程可能正在序列化旧对象
+        stats = project["stats"]
+        stats = {**stats, "by_status": dict(stats["by_status"]), "by_priority": dict(stats["by_priority"])}
+        for old, new in changes:
+            if old is not None:
+                count_task(stats, old, -1)
+            if new is not None:
+                count_task(stats, new, 1)
+        self._set_project_stats(project, stats)
+    
+    def _compute_stats(self, tasks):
+        stats = new_task_stats()
+        for task in tasks:
+            count_task(stats, task_stats_key(task), 1)
+        return stats
+    
+    def _set_project_stats(self, project, stats):
+        project["stats"] = stats
+        project["progress"] = task_progress(stats)
+        self.projects_index.touch(project)
+        self.save_index(puts=[project])
+        self.change_feed.publish([("projects", "update", project)])
+    
+    def get_project_stats(self, project_id, verify=False):
+        """获取项目任务统计；verify 为真时从任务数据重新计算以校验一致性"""
+        with self.lock.read():
+            project = self.projects_index.get(project_id)
+            if project is None:
+                return None
+            if not verify and "stats" in project:
+                return {**project["stats"], "progress": project["progress"]}
+        # 需要重新计算时在读锁之外取写锁（读锁内不能取写锁），期间项目可能已被删除
+        with self.lock.write():
+            if project_id not in self.projects_index:
+                return None
+            self.update_project_progress(project_id)
+            project = self.projects_index.get(project_id)
+            return {**project["stats"], "progress": project["progress"]}
+    
+    def _new_task(self, project_id, title, description="", status="pending", priority="medium", due_date=None):
+        """构造新任务记录"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        task_id = str(uuid.uuid4())
+        
+        return Task.new(
+            id=task_id,
+            project_id=project_id,
+            title=title,
+            description=description,
+            status=status,
+            priority=priority,
+            due_date=due_date,
+            created_at=timestamp,
+            updated_at=timestamp,
+            completed_at=timestamp if status == "completed" else UNSET
+        )
+    
+    def _apply_task_update(self, task, title=None, description=None, status=None, priority=None, due_date=None):
+        """在内存中修改任务（不持久化）"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if title is not None:
+            task["title"] = title
+        if description is not None:
+            task["description"] = description
+        if status is not None:
+            old_status = task["status"]
+            task["status"] = status
+            
+            # 处理完成状态变化
+            if status == "completed" and old_status != "completed":
+                task["completed_at"] = timestamp
+            elif status != "completed":
+                task.pop("completed_at", None)
+        
+        if priority is not None:
+            task["priority"] = priority
+        if due_date is not None:
+            task["due_date"] = due_date
+        
+        task["updated_at"] = timestamp
+        return task
+    
+    def create_task(self, project_id, title, description="", status="pending", priority="medium", due_date=None):
+        """创建新任务"""
+        with self.lock.write():
+            task_info = self._new_task(project_id, title, description, status, priority, due_date)
+            tasks = self.get_project_tasks(project_id)
+            tasks.append(task_info)
+            self.save_project_tasks(project_id, tasks, [(None, task_stats_key(task_info))])
+            self.change_feed.publish([("tasks", "create", task_info)])
+        
+            return task_info
+    
+    def update_task(self, project_id, task_id, title=None, description=None, status=None, priority=None, due_date=None):
+        """更新任务"""
+        with self.lock.write():
+            tasks = self.get_project_tasks(project_id)
+        
+            for task in tasks:
+                if task["id"] == task_id:
+                    old = task_stats_key(task)
+                    self._apply_task_update(task, title, description, status, priority, due_date)
+                    self.save_project_tasks(project_id, tasks, [(old, task_stats_key(task))])
+                    self.change_feed.publish([("tasks", "update", task)])
+                    return task
+            return None
+    
+    def delete_task(self, project_id, task_id):
+        """删除任务"""
+        with self.lock.write():
+            tasks = self.get_project_tasks(project_id)
+        
+            for i, task in enumerate(tasks):
+                if task["id"] == task_id:
+                    deleted_task = tasks.pop(i)
+                    self.save_project_tasks(project_id, tasks, [(task_stats_key(deleted_task), None)])
+                    self.change_feed.publish([("tasks", "delete", deleted_task)])
+                    return deleted_task
+            return None
+    
+    def apply_task_batch(self, project_id, operations):
+        """批量执行项目任务操作，全部校验通过后一次性应用，只保存任务和更新进度一次
+        
+        operations 格式同 TodoStore.apply_batch，create/update 可带
+        title、description、status、priority、due_date 字段。
+        """
+        fields = ("title", "description", "status", "priority", "due_date")
+        with self.lock.write():
+            tasks = self.get_project_tasks(project_id)
+            validate_batch(operations, {task["id"] for task in tasks}, Task)
+            
+            by_id = {task["id"]: task for task in tasks}
+            results, changes = [], []
+            for operation in operations:
+                op = operation["op"]
+                if op == "create":
+                    defaults = {"description": "", "status": "pending", "priority": "medium", "due_date": None}
+                    values = {field: operation.get(field, defaults.get(field)) for field in fields}
+                    task = self._new_task(project_id, **values)
+                    by_id[task["id"]] = task
+                    changes.append((None, task_stats_key(task)))
+                    results.append(task)
+                elif op == "update":
+                    task = by_id[operation["id"]]
+                    old = task_stats_key(task)
+                    values = {field: operation.get(field) for field in fields}
+                    self._apply_task_update(task, **values)
+                    changes.append((old, task_stats_key(task)))
+                    results.append(task)
+                else:
+                    task = by_id.pop(operation["id"])
+                    changes.append((task_stats_key(task), None))
+                    results.append({"id": operation["id"], "deleted": True, "project_id": project_id})
+            
+            self.save_project_tasks(project_id, list(by_id.values()), changes)
+            self.change_feed.publish(batch_changes("tasks", operations, results))
+            return results
+    
+    def import_projects(self, records):
+        """按id批量写入项目（不存在时新建并创建空的任务列表，存在时覆盖），返回新建和更新的数量"""
+        with self.lock.write():
+            changes = []
+            for record in records:
+                exists = record["id"] in self.projects_index
+                project = self.projects_index.add(Project.from_dict(dict(record)))
+                if not exists:
+                    self.tasks.create(project["id"])
+                changes.append(("projects", "update" if exists else "create", project))
+            if changes:
+                self.save_index(puts=[project for _, _, project in changes])
+                self.change_feed.publish(changes)
+            created = sum(1 for _, op, _ in changes if op == "create")
+            return {"created": created, "updated": len(changes) - created}
+    
+    def import_tasks(self, records):
+        """按id批量写入任务（按 project_id 分组，每个项目只保存一次并重新计算统计），返回新建和更新的数量"""
+        with self.lock.write():
+            by_project = {}
+            for record in records:
+                by_project.setdefault(record["project_id"], []).append(record)
+            
+            changes = []
+            for project_id, imported in by_project.items():
+                if project_id not in self.projects_index:
+                    raise ValueError(f"项目不存在: {project_id}")
+                tasks = self.get_project_tasks(project_id)
+                positions = {task["id"]: i for i, task in enumerate(tasks)}
+                for record in imported:
+                    task = Task.from_dict(dict(record))
+                    if task["id"] in positions:
+                        tasks[positions[task["id"]]] = task
+                        changes.append(("tasks", "update", task))
+                    else:
+                        positions[task["id"]] = len(tasks)
+                        tasks.append(task)
+                        changes.append(("tasks", "create", task))
+                self.save_project_tasks(project_id, tasks)
+            self.change_feed.publish(changes)
+            created = sum(1 for _, op, _ in changes if op == "create")
+            return {"created": created, "updated": len(changes) - created}
+    
+    def update_project_progress(self, project_id):
+        """从任务数据重新计算项目统计和进度（一致性检查），只在结果变化时保存"""
+        with self.lock.write():
+            stats = self._compute_stats(self.get_project_tasks(project_id))
+            project = self.projects_index.get(project_id)
+            if project and project.get("stats") != stats:
+                self._set_project_stats(project, stats)
+            return task_progress(stats)
+
+class ChatStore:
+    """聊天消息和会话存储（Web服务和命令行共用），上下文构建和AI回复见 app.ChatAPI"""
+
+    def __init__(self, change_feed=None):
+        self.change_feed = change_feed if change_feed is not None else open_change_feed()
+        
+        # 创建聊天记录存储目录
+        self.chat_dir = os.path.join(DATA_DIR, "chats")
+        if not os.path.exists(self.chat_dir):
+            os.makedirs(self.chat_dir)
+        
+        # 聊天记录按时间分段存储，内存中只保留最新的一段
+        self.log = open_message_log(self.chat_dir, Message)
+        self.lock = CollectionLock(self.log.lock_path, self.log.reload)
+        self.page_size = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', 100))
+        
+        # 会话：上下文窗口由服务端根据存储的历史构建
+        self.sessions_file = os.path.join(self.chat_dir, "sessions.json")
+        self.session_store = open_backend(self.sessions_file, "chat_sessions")
+        self.sessions = IndexedCollection(Session.from_list(self.session_store.load()))
+        self.session_lock = CollectionLock(self.session_store.lock_path, self.reload_sessions)
+    
+    def reload_sessions(self):
+        """其他进程修改数据后重新加载会话"""
+        self.sessions = IndexedCollection(Session.from_list(self.session_store.load()))
+    
+    def save_sessions(self, puts=(), deletes=()):
+        """保存会话的变更（在会话写锁内调用）"""
+        self.session_lock.changed()
+        self.session_store.write(puts, deletes, self.sessions)
+    
+    def create_session(self, title=None):
+        """创建会话"""
+        with self.session_lock.write():
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            session = self.sessions.add(Session.new(
+                id=str(uuid.uuid4()),
+                title=title or '',
+                created_at=timestamp,
+                updated_at=timestamp,
+                message_count=0,
+                summary=None,
+                # 摘要已覆盖到的最后一条消息的时间
+                summary_until=None
+            ))
+            self.save_sessions(puts=[session])
+            return session
+    
+    def get_session(self, session_id):
+        """获取会话"""
+        with self.session_lock.read():
+            return self.sessions.get(session_id)
+    
+    def query_sessions(self, after=None, limit=None, created_from=None, created_to=None):
+        """分页查询会话（按创建时间倒序）"""
+        with self.session_lock.read():
+            if self.session_store.supports_query:
+                sessions, cursor = self.session_store.query(after, limit, created_from=created_from,
+                                                            created_to=created_to)
+                return Session.from_list(sessions), cursor
+            return self.sessions.page(after, limit, created_from=created_from, created_to=created_to)
+    
+    def delete_session(self, session_id):
+        """删除会话（消息仍保留在聊天历史中）"""
+        with self.session_lock.write():
+            if self.sessions.remove(session_id) is None:
+                return False
+            self.save_sessions(deletes=[session_id])
+            return True
+    
+    def _record_session_message(self, message):
+        """更新会话的消息数和更新时间，第一条用户消息作为未命名会话的标题"""
+        with self.session_lock.write():
+            session = self.sessions.get(message['session_id'])
+            if session is None:
+                return
+            session['message_count'] += 1
+            session['updated_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if not session['title'] and message['role'] == 'user':
+                session['title'] = message['content'][:20]
+            self.sessions.touch(session)
+            self.save_sessions(puts=[session])
+    
+    def query_history(self, after=None, before=None, limit=None, role=None, session_id=None,
+                      created_from=None, created_to=None):
+        """分页查询聊天历史，返回 (本页消息, 下一页游标)
+
+        默认从最新的消息开始倒序分页，下一页游标作为 before 传入；
+        提供 after 时从该消息之后按时间顺序分页。
+        """
+        conditions = [(key, value) for key, value in (('role', role), ('session_id', session_id)) if value]
+        match = (lambda message: all(message.get(k) == v for k, v in conditions)) if conditions else None
+        limit = limit or self.page_size
+        with self.lock.read():
+            if after is not None:
+                messages = self.log.iter_forward(after, created_from, created_to)
+            else:
+                messages = self.log.iter_reverse(before, created_from, created_to)
+            return paginate_iter(messages, limit, match)
+    
+    def add_message(self, role: str, content: str, session_id: str = None):
+        """添加消息到历史记录"""
+        with self.lock.write():
+            message = Message.new(
+                id=str(uuid.uuid4()),
+                role=role,
+                content=content,
+                timestamp=datetime.datetime.now().isoformat(),
+                session_id=session_id or UNSET
+            )
+            self.log.append(message)
+            self.lock.changed()
+            self.change_feed.publish([("chat_messages", "create", message)])
+        if session_id:
+            self._record_session_message(message)
+        return message
+    
+    def clear_history(self):
+        """清空聊天历史"""
+        with self.lock.write():
+            self.log.clear()
+            self.lock.changed()
+            self.change_feed.publish([("chat_messages", "clear", {"id": None})])
+    
+    def import_sessions(self, records):
+        """按id批量写入会话（不存在时新建，存在时覆盖），返回新建和更新的数量"""
+        with self.session_lock.write():
+            created = sum(1 for record in records if record["id"] not in self.sessions)
+            sessions = [self.sessions.add(Session.from_dict(dict(record))) for record in records]
+            if sessions:
+                self.save_sessions(puts=sessions)
+            return {"created": created, "updated": len(sessions) - created}
+    
+    def import_messages(self, records):
+        """批量追加聊天消息
+        
+        消息日志只能按时间追加，只写入比现有最新消息更晚的消息，其余的计为跳过
+        （重复导入同一份数据时全部跳过）。返回追加和跳过的数量。
+        """
+        with self.lock.write():
+            latest = self.log.recent(1)
+            last = latest[0]['timestamp'] if latest else ''
+            messages = []
+            for record in records:
+                if record['timestamp'] > last:
+                    messages.append(Message.from_dict(dict(record)))
+                    last = record['timestamp']
+            if messages:
+                self.log.extend(messages)
+                self.lock.changed()
+                self.change_feed.publish([("chat_messages", "create", message) for message in messages])
+            return {"created": len(messages), "skipped": len(records) - len(messages)}
@@ -0,0 +1,127 @@
+"""分块存储：内容定义的分块边界、去重和垃圾回收"""
+
+import random
+
+import pytest
+
+import blobs
+from blobs import ChunkStore, NoteContentStore, chunk_boundaries
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def chunks_of(data):
+    start, chunks = 0, []
+    for end in chunk_boundaries(data):
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+
+def test_boundaries_cover_data_within_size_limits():
+    data = random_bytes(300_000)
+    ends = chunk_boundaries(data, min_size=2048, max_size=65536)
+    assert ends[-1] == len(data)
+    sizes = [end - start for start, end in zip([0] + ends, ends)]
+    assert all(2048 < size <= 65536 for size in sizes[:-1])
+    assert 0 < sizes[-1] <= 65536
+
+
+def test_short_and_empty_data():
+    assert chunk_boundaries(b"") == []
+    assert chunk_boundaries(b"x" * 100) == [100]
+
+
+def test_insertion_only_changes_neighbouring_chunks():
+    data = random_bytes(400_000)
+    position = 200_000
+    edited = data[:position] + b"inserted text" + data[position:]
+
+    before, after = chunks_of(data), chunks_of(edited)
+    # 插入位置前后的块都保持不变，只有包含插入位置的一两块不同
+    changed = set(after) - set(before)
+    assert len(changed) <= 2
+    assert len(set(before) & set(after)) >= len(before) - 2
+
+
+def test_boundaries_are_deterministic():
+    data = random_bytes(200_000, seed=1)
+    assert chunk_boundaries(data) == chunk_boundaries(bytes(data))
+
+
+def test_numpy_matches_byte_loop(monkeypatch):
+    pytest.importorskip("numpy")
+    data = random_bytes(3 * blobs._BLOCK // 2, seed=2)
+    for sizes in ((2048, 8192, 65536), (64, 256, 1024)):
+        vectorized = chunk_boundaries(data, *sizes)
+        monkeypatch.setattr(blobs, "numpy", None)
+        assert chunk_boundaries(data, *sizes) == vectorized
+        monkeypatch.undo()
+
+
+def test_put_dedupes_unchanged_chunks(tmp_path):
+    store = ChunkStore(str(tmp_path), compress=False)
+    data = random_bytes(200_000, seed=3)
+    blob, written = store.put(data)
+    assert written >= len(data)
+    assert store.put(data) == (blob, 0)
+
+    edited = data[:100_000] + b"!" + data[100_000:]
+    edited_blob, written = store.put(edited)
+    assert written < len(data) // 2
+    assert store.read(blob) == data
+    assert store.read(edited_blob) == edited
+
+
+def test_collect_garbage_keeps_reachable_chunks(tmp_path):
+    store = ChunkStore(str(tmp_path))
+    data = random_bytes(200_000, seed=4)
+    edited = data[:100_000] + b"!" + data[100_000:]
+    kept, _ = store.put(data)
+    dropped, _ = store.put(edited)
+
+    removed, freed = store.collect_garbage({kept})
+    assert removed > 0 and freed > 0
+    # 共用的块保留，只属于被删除内容的块和清单被删除
+    assert store.read(kept) == data
+    with pytest.raises(FileNotFoundError):
+        store.read(dropped)
+    assert store.collect_garbage({kept}) == (0, 0)
+
+
+def test_collect_garbage_waits_for_open_readers(tmp_path):
+    store = ChunkStore(str(tmp_path))
+    data = random_bytes(100_000, seed=5)
+    blob, _ = store.put(data)
+
+    reader = store.open(blob)
+    assert store.collect_garbage(set()) is None
+    assert reader.read() == data
+    reader.close()
+
+    removed, _ = store.collect_garbage(set())
+    assert removed > 0
+    with pytest.raises(FileNotFoundError):
+        store.read(blob)
+
+
+def test_note_versions_keep_content_reachable(tmp_path):
+    contents = NoteContentStore(str(tmp_path), max_versions=2, gc_threshold=0)
+    note = {"id": "n1", "title": "标题"}
+    for i in range(3):
+        contents.save(note, f"第{i}版 " * 5000)
+    other = {"id": "n2", "title": "另一篇"}
+    contents.save(other, "另一篇的正文 " * 5000)
+
+    # 超出 max_versions 的第一版不再被引用，其余版本都可以读取
+    assert contents.collect_garbage()[0] > 0
+    assert [v["version"] for v in contents.versions("n1")] == [2, 3]
+    for version in contents.versions("n1"):
+        assert contents.read(version) == f"第{version['version'] - 1}版 " * 5000
+
+    contents.drop(note)
+    assert contents.collect_garbage()[0] > 0
+    assert contents.read(other) == "另一篇的正文 " * 5000
+    assert contents.collect_garbage() == (0, 0)
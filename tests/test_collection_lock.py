@@ -0,0 +1,148 @@
+"""CollectionLock：跨进程的代数检查和进程内的读写锁"""
+
+import os
+import sys
+import subprocess
+import threading
+import time
+
+import pytest
+
+from storage import CollectionLock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Reloads:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+
+
+def write_in_other_process(path):
+    script = (f"from storage import CollectionLock\nlock = CollectionLock({path!r}, lambda: None)\n"
+              "with lock.write():\n    lock.changed()\n")
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+
+
+@pytest.fixture
+def lock_path(tmp_path):
+    return str(tmp_path / "todos.json.lock")
+
+
+def test_reloads_after_write_in_other_process(lock_path):
+    reloads = Reloads()
+    lock = CollectionLock(lock_path, reloads)
+    with lock.write():
+        lock.changed()
+    with lock.read():
+        pass
+    assert reloads.count == 0
+    assert lock.generation == 1
+
+    write_in_other_process(lock_path)
+    with lock.read():
+        assert reloads.count == 1
+        assert lock.generation == 2
+    # 只在代数变化后重新加载一次
+    with lock.read():
+        pass
+    assert reloads.count == 1
+
+
+def test_write_reloads_stale_data_before_modifying(lock_path):
+    reloads = Reloads()
+    lock = CollectionLock(lock_path, reloads)
+    write_in_other_process(lock_path)
+    with lock.write():
+        assert reloads.count == 1
+        lock.changed()
+    assert lock.generation == 2
+
+
+def test_unchanged_write_keeps_generation(lock_path):
+    reloads = Reloads()
+    lock = CollectionLock(lock_path, reloads)
+    write_in_other_process(lock_path)
+    # 没有修改数据的写锁不递增代数，但仍会先加载其他进程的修改
+    with lock.write():
+        assert reloads.count == 1
+    assert lock.generation == 1
+    with lock.write(), lock.write():
+        pass
+    other = CollectionLock(lock_path, reloads)
+    with other.read():
+        pass
+    assert reloads.count == 1
+    assert other.generation == lock.generation == 1
+
+
+def test_failed_write_forces_reload(lock_path):
+    reloads = Reloads()
+    lock = CollectionLock(lock_path, reloads)
+    with pytest.raises(KeyError):
+        with lock.write():
+            lock.changed()
+            raise KeyError("写到一半失败")
+    assert lock.generation is None
+    with lock.read():
+        assert reloads.count == 1
+    assert lock.generation == 1
+
+
+def test_readers_share_the_lock(lock_path):
+    lock = CollectionLock(lock_path, Reloads())
+    readers = 4
+    barrier = threading.Barrier(readers, timeout=5)
+    errors = []
+
+    def read():
+        with lock.read():
+            try:
+                # 所有读者同时持有读锁才能通过
+                barrier.wait()
+            except threading.BrokenBarrierError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def test_writer_excludes_readers(lock_path):
+    lock = CollectionLock(lock_path, Reloads())
+    events = []
+    writing = threading.Event()
+
+    def write():
+        with lock.write():
+            writing.set()
+            events.append("write")
+            time.sleep(0.1)
+            events.append("written")
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writing.wait(5)
+    with lock.read():
+        events.append("read")
+    writer.join()
+    assert events == ["write", "written", "read"]
+
+
+def test_nesting(lock_path):
+    lock = CollectionLock(lock_path, Reloads())
+    with lock.write():
+        with lock.read(), lock.write():
+            pass
+    with lock.read(), lock.read():
+        with pytest.raises(RuntimeError):
+            with lock.write():
+                pass
+    with lock.snapshot(), lock.read():
+        pass
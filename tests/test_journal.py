@@ -0,0 +1,97 @@
+"""JournalBackend：日志轮转、后台压缩和压缩中断后的恢复"""
+
+import os
+import time
+
+import pytest
+
+from storage import JournalBackend
+
+
+def record(record_id, title="标题"):
+    return {"id": record_id, "title": title}
+
+
+def wait_compacted(backend, timeout=5):
+    deadline = time.monotonic() + timeout
+    while backend._compacting:
+        if time.monotonic() > deadline:
+            pytest.fail("后台压缩没有结束")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "todos.json")
+
+
+def test_replays_log_without_snapshot(path):
+    backend = JournalBackend(path, compact_every=100)
+    backend.write([record("a"), record("b")], (), [])
+    backend.write([record("a", "改过")], ["b"], [])
+
+    assert JournalBackend(path).load() == [record("a", "改过")]
+    assert not os.path.exists(path)
+
+
+def test_rotation_compacts_into_snapshot(path):
+    backend = JournalBackend(path, compact_every=3)
+    records = [record("a"), record("b"), record("c")]
+    backend.write(records, (), records)
+    wait_compacted(backend)
+
+    # 快照写好之后删除轮转出的旧日志，之后的写入进入新日志
+    assert os.path.exists(path)
+    assert not os.path.exists(backend.old_log_path)
+    backend.write([record("d")], ["a"], [])
+    assert sorted(r["id"] for r in JournalBackend(path).load()) == ["b", "c", "d"]
+
+
+def test_recovers_from_interrupted_compaction(path, monkeypatch):
+    # 轮转之后、快照写入之前进程退出：旧日志还在，没有快照
+    def crash(self, records, compact_fd):
+        os.close(compact_fd)
+        self._compacting = False
+
+    monkeypatch.setattr(JournalBackend, "_compact", crash)
+    backend = JournalBackend(path, compact_every=2)
+    backend.write([record("a"), record("b")], (), [])
+    wait_compacted(backend)
+    assert os.path.exists(backend.old_log_path)
+    assert not os.path.exists(path)
+
+    # 再次轮转时当前日志接到旧日志后面，不丢失任何变更
+    backend.write([record("c")], ["a"], [])
+    wait_compacted(backend)
+    with open(backend.old_log_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 4
+    backend.write([record("d")], (), [])
+
+    restarted = JournalBackend(path, compact_every=2)
+    records = restarted.load()
+    assert sorted(r["id"] for r in records) == ["b", "c", "d"]
+
+    # 压缩恢复正常后旧日志被合并进快照
+    monkeypatch.undo()
+    records += [record("e"), record("f")]
+    restarted.write(records[-2:], (), records)
+    wait_compacted(restarted)
+    assert not os.path.exists(restarted.old_log_path)
+    assert sorted(r["id"] for r in JournalBackend(path).load()) == ["b", "c", "d", "e", "f"]
+
+
+def test_ignores_torn_last_line(path):
+    backend = JournalBackend(path, compact_every=100)
+    backend.write([record("a")], (), [])
+    with open(backend.log_path, "a", encoding="utf-8") as f:
+        f.write('{"op":"put","data":{"id":"b"')
+
+    assert JournalBackend(path).load() == [record("a")]
+
+
+def test_snapshot_resets_state(path):
+    backend = JournalBackend(path, compact_every=100)
+    backend.write([record("a"), record("b")], (), [])
+    backend.snapshot([record("c")])
+
+    assert JournalBackend(path).load() == [record("c")]
@@ -0,0 +1,82 @@
+"""SQLite后端的分页查询：结果与内存中的有序视图和任务列表分页相同"""
+
+import random
+
+import pytest
+
+from storage import (IndexedCollection, InvalidCursor, SqliteBackend, SqliteDatabase, SqliteTaskStore,
+                     paginate)
+
+
+def timestamp(rng):
+    # 秒级时间，很多记录时间相同，检查相同时间的记录按插入顺序排列
+    return f"2024-0{rng.randint(1, 3)}-1{rng.randint(0, 2)} 10:00:0{rng.randint(0, 2)}"
+
+
+@pytest.fixture
+def db(tmp_path):
+    return SqliteDatabase(str(tmp_path / "workspace.db"))
+
+
+def pages(query, limit, **filters):
+    """按游标取完全部页，返回每页的id"""
+    result, after = [], None
+    while True:
+        items, after = query(after=after, limit=limit, **filters)
+        result.append([item["id"] for item in items])
+        if after is None:
+            return result
+
+
+def test_records_match_indexed_collection(db):
+    rng = random.Random(0)
+    records = [{"id": f"r{i}", "created_at": timestamp(rng), "status": rng.choice(["active", "archived"]),
+                "completed": rng.random() < 0.5} for i in range(200)]
+    backend = SqliteBackend(db, "records")
+    backend.write(records, (), records)
+    collection = IndexedCollection(records)
+
+    for where in (None, {"status": "active"}, {"completed": True}, {"status": None}):
+        for created_from, created_to in ((None, None), ("2024-02", None), (None, "2024-02-11"),
+                                         ("2024-01-11 10:00:01", "2024-03")):
+            filters = dict(where=where, created_from=created_from, created_to=created_to)
+            for limit in (None, 1, 7):
+                assert pages(backend.query, limit, **filters) == pages(collection.page, limit, **filters)
+
+    backend.write((), ["r5"], None)
+    with pytest.raises(InvalidCursor):
+        backend.query(after="r5")
+    archived = next(record["id"] for record in records if record["status"] == "archived")
+    with pytest.raises(InvalidCursor):
+        backend.query(after=archived, where={"status": "active"})
+
+
+def test_tasks_match_list_pagination(db):
+    rng = random.Random(1)
+    tasks = [{"id": f"t{i}", "project_id": "p", "created_at": f"2024-01-01 10:{i // 10:02d}:00",
+              "status": rng.choice(["pending", "completed"]), "priority": rng.choice(["low", "high"]),
+              "due_date": rng.choice([None, "", "2024-02-01", "2024-02-15", "2024-03-01"])} for i in range(100)]
+    store = SqliteTaskStore(db)
+    store.save("p", tasks)
+    store.save("other", [dict(tasks[0], id="x", project_id="other")])
+
+    def in_memory(after=None, limit=None, status=None, priority=None, due_from=None, due_to=None,
+                  created_from=None, created_to=None):
+        def match(task):
+            due_date = task.get("due_date")
+            return ((priority is None or task["priority"] == priority)
+                    and not (due_from and (not due_date or due_date < due_from))
+                    and not (due_to and (not due_date or due_date[:len(due_to)] > due_to)))
+        selected = [task for task in tasks if status is None or task["status"] == status]
+        return paginate(selected, after, limit, match, created_from, created_to, descending=False)
+
+    def in_sql(**filters):
+        return store.query("p", **filters)
+
+    for filters in ({}, {"status": "pending"}, {"priority": "high", "due_from": "2024-02-10"},
+                    {"due_to": "2024-02"}, {"created_from": "2024-01-01 10:03", "created_to": "2024-01-01 10:07"}):
+        for limit in (None, 3):
+            assert pages(in_sql, limit, **filters) == pages(in_memory, limit, **filters)
+
+    with pytest.raises(InvalidCursor):
+        store.query("p", after="x")
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""整个工作区（笔记、待办、项目、任务、聊天会话和消息）的导出与导入
+
+两种格式：
+- ndjson：第一行为 {"type": "workspace", "version": 1, ...}，之后每行一条记录
+  {"type": 集合名, "data": 记录}，笔记记录带有正文 content；
+- tar：manifest.json，每条笔记的 notes/<id>.json（笔记信息）和紧随其后的 notes/<id>.txt（正文），
+  其余集合各一个 <集合名>.ndjson（每行一条记录）。
+集合按依赖顺序输出：项目在任务之前，会话在消息之前。笔记只导出当前版本。
+"""
+
+import io
+import re
+import json
+import shutil
+import tarfile
+import datetime
+import tempfile
+from contextlib import ExitStack
+
+import json_codec
+from note_store import NOTE_INTERNAL_FIELDS
+
+FORMAT_VERSION = 1
+FORMATS = ("ndjson", "tar")
+SECTIONS = ("notes", "todos", "projects", "tasks", "chat_sessions", "chat_messages")
+
+# 各集合记录的必填字段（id 之外）
+REQUIRED_FIELDS = {
+    "notes": ("title", "content", "created_at"),
+    "todos": ("title", "created_at"),
+    "projects": ("name", "created_at"),
+    "tasks": ("title", "project_id", "created_at"),
+    "chat_sessions": ("created_at",),
+    "chat_messages": ("role", "content", "timestamp"),
+}
+
+# id 会用在文件名中（版本历史、任务列表、tar成员名），只允许字母、数字、下划线和连字符
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_COPY_BUFFER = 64 * 1024
+
+
+def detect_format(f):
+    """根据文件头判断导入文件的格式（tar 或 gzip 压缩的 tar 视为 tar），不移动读取位置"""
+    position = f.tell()
+    head = f.read(512)
+    f.seek(position)
+    if head[:2] == b"\x1f\x8b" or head[257:262] == b"ustar":
+        return "tar"
+    return "ndjson"
+
+
+class Workspace:
+    """工作区的导出与导入（Web服务和命令行共用）
+
+    导出时按固定顺序获取各集合的快照读锁，在锁内把完整的导出内容写入临时文件，
+    之后再发送给客户端：加锁时间只取决于本地写盘速度，内存占用与数据量无关。
+    导入时先把上传内容保存到临时文件并完整校验一遍，全部有效后再按集合分批写入，
+    每批只加一次写锁、持久化一次索引。
+    """
+
+    def __init__(self, notes, todos, projects, chat, batch_size=1000):
+        self.notes = notes
+        self.todos = todos
+        self.projects = projects
+        self.chat = chat
+        self.batch_size = batch_size
+
+    # ---- 导出 ----
+
+    def snapshot(self, fmt="ndjson"):
+        """把一致的快照写入临时文件并返回（已定位到开头，关闭后自动删除）"""
+        f = tempfile.TemporaryFile()
+        try:
+            self.export(f, fmt)
+            f.seek(0)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def export(self, out, fmt="ndjson"):
+        """在快照锁内把整个工作区写入二进制文件对象 out"""
+        if fmt not in FORMATS:
+            raise ValueError(f"未知的导出格式: {fmt}")
+        with ExitStack() as stack:
+            for lock in (self.notes.lock, self.todos.lock, self.projects.lock,
+                         self.chat.session_lock, self.chat.lock):
+                stack.enter_context(lock.snapshot())
+            if fmt == "tar":
+                self._write_tar(out)
+            else:
+                self._write_ndjson(out)
+
+    def _manifest(self):
+        return {"type": "workspace", "version": FORMAT_VERSION,
+                "exported_at": datetime.datetime.now().isoformat(), "sections": list(SECTIONS)}
+
+    def _note_fields(self, note):
+        return {key: value for key, value in note.items() if key not in NOTE_INTERNAL_FIELDS}
+
+    def _iter_section(self, section):
+        """在快照锁内按导出顺序产出集合的记录（笔记不含正文）"""
+        if section == "notes":
+            for note in self.notes.notes_index:
+                if self.notes.contents.exists(note):
+                    yield note
+        elif section == "todos":
+            yield from self.todos.todos_index
+        elif section == "projects":
+            yield from self.projects.projects_index
+        elif section == "tasks":
+            for project in self.projects.projects_index:
+                yield from self.projects.tasks.peek(project["id"])
+        elif section == "chat_sessions":
+            yield from self.chat.sessions
+        else:
+            yield from self.chat.log.iter_forward()
+
+    def _write_ndjson(self, out):
+        out.write(json_codec.dumps_bytes(self._manifest()) + b"\n")
+        for section in SECTIONS:
+            for record in self._iter_section(section):
+                if section == "notes":
+                    record = {**self._note_fields(record), "content": self.notes.contents.read(record)}
+                out.write(json_codec.dumps_bytes({"type": section, "data": record}) + b"\n")
+
+    def _write_tar(self, out):
+        mtime = datetime.datetime.now().timestamp()
+
+        def add(tar, name, fileobj, size):
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = mtime
+            tar.addfile(info, fileobj)
+
+        def add_bytes(tar, name, data):
+            add(tar, name, io.BytesIO(data), len(data))
+
+        with tarfile.open(fileobj=out, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            add_bytes(tar, "manifest.json", json_codec.dumps_bytes(self._manifest()))
+            for note in self._iter_section("notes"):
+                add_bytes(tar, f"notes/{note['id']}.json", json_codec.dumps_bytes(self._note_fields(note)))
+                with self.notes.contents.open(note, binary=True) as body:
+                    add(tar, f"notes/{note['id']}.txt", body, self.notes.contents.size(note))
+            for section in SECTIONS[1:]:
+                # tar成员需要事先知道大小，先写入临时文件
+                with tempfile.TemporaryFile() as part:
+                    for record in self._iter_section(section):
+                        part.write(json_codec.dumps_bytes(record) + b"\n")
+                    size = part.tell()
+                    part.seek(0)
+                    add(tar, f"{section}.ndjson", part, size)
+
+    # ---- 导入 ----
+
+    def import_stream(self, stream, fmt=None):
+        """从二进制流导入工作区，fmt 为None时根据文件头判断格式
+
+        内容无效时抛出 ValueError，不做任何修改。返回各集合新建、更新（消息为跳过）的数量。
+        """
+        if fmt is not None and fmt not in FORMATS:
+            raise ValueError(f"未知的导入格式: {fmt}")
+        with tempfile.TemporaryFile() as f:
+            shutil.copyfileobj(stream, f, _COPY_BUFFER)
+            f.seek(0)
+            fmt = fmt or detect_format(f)
+
+            self._validate(self._read(f, fmt))
+            f.seek(0)
+            return self._apply(self._read(f, fmt))
+
+    def _validate(self, records):
+        """完整校验一遍导入内容：格式、必填字段、id，以及任务所属的项目（已存在或在之前导入）"""
+        with self.projects.lock.read():
+            project_ids = set(self.projects.projects_index.by_id)
+        for section, record, where in records:
+            if not isinstance(record, dict):
+                raise ValueError(f"{where}: 记录格式无效")
+            record_id = record.get("id")
+            if not isinstance(record_id, str) or not _ID_RE.match(record_id):
+                raise ValueError(f"{where}: id 无效")
+            for field in REQUIRED_FIELDS[section]:
+                if not isinstance(record.get(field), str):
+                    raise ValueError(f"{where}: 缺少 {field}")
+            if section == "projects":
+                project_ids.add(record_id)
+            elif section == "tasks" and record["project_id"] not in project_ids:
+                raise ValueError(f"{where}: 任务所属的项目不存在")
+
+    def _apply(self, records):
+        """按集合分批写入，返回各集合的统计"""
+        appliers = {
+            "notes": self.notes.import_notes,
+            "todos": self.todos.import_todos,
+            "projects": self.projects.import_projects,
+            "tasks": self.projects.import_tasks,
+            "chat_sessions": self.chat.import_sessions,
+            "chat_messages": self.chat.import_messages,
+        }
+        result = {}
+
+        def flush(section, batch):
+            if batch:
+                counts = result.setdefault(section, {})
+                for key, value in appliers[section](batch).items():
+                    counts[key] = counts.get(key, 0) + value
+
+        section, batch = None, []
+        for record_section, record, _ in records:
+            if record_section != section or len(batch) >= self.batch_size:
+                flush(section, batch)
+                section, batch = record_section, []
+            batch.append(record)
+        flush(section, batch)
+        return result
+
+    def _read(self, f, fmt):
+        """逐条产出 (集合名, 记录, 位置说明)"""
+        if fmt == "tar":
+            return self._read_tar(f)
+        return self._read_ndjson(f)
+
+    def _check_manifest(self, manifest, where):
+        if not isinstance(manifest, dict) or manifest.get("type") != "workspace":
+            raise ValueError(f"{where}: 不是工作区导出文件")
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{where}: 不支持的导出版本 {manifest.get('version')}")
+
+    def _parse_lines(self, lines, where):
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json_codec.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                raise ValueError(f"{where(number)}: JSON格式无效")
+
+    def _read_ndjson(self, f):
+        where = "第{}行".format
+        first = True
+        for number, item in self._parse_lines(f, where):
+            if first:
+                self._check_manifest(item, where(number))
+                first = False
+                continue
+            if not isinstance(item, dict) or item.get("type") not in SECTIONS:
+                raise ValueError(f"{where(number)}: 未知的记录类型")
+            yield item["type"], item.get("data"), where(number)
+        if first:
+            raise ValueError("导入内容为空")
+
+    def _read_tar(self, f):
+        try:
+            tar = tarfile.open(fileobj=f, mode="r|*")
+        except tarfile.TarError:
+            raise ValueError("不是有效的tar文件")
+        manifest_seen = False
+        pending = None  # 等待正文的笔记信息
+        with tar:
+            try:
+                for member in tar:
+                    name = member.name
+                    if not member.isfile():
+                        continue
+                    data = tar.extractfile(member)
+                    if name == "manifest.json":
+                        self._check_manifest(self._load_member(data, name), name)
+                        manifest_seen = True
+                        continue
+                    if not manifest_seen:
+                        raise ValueError(f"{name}: 缺少 manifest.json")
+                    if name.startswith("notes/") and name.endswith(".json"):
+                        if pending is not None:
+                            raise ValueError(f"{name}: 上一条笔记缺少正文")
+                        pending = self._load_member(data, name)
+                    elif name.startswith("notes/") and name.endswith(".txt"):
+                        if not isinstance(pending, dict) or f"notes/{pending.get('id')}.txt" != name:
+                            raise ValueError(f"{name}: 正文没有对应的笔记信息")
+                        try:
+                            content = data.read().decode("utf-8")
+                        except UnicodeDecodeError:
+                            raise ValueError(f"{name}: 正文不是UTF-8文本")
+                        yield "notes", {**pending, "content": content}, name
+                        pending = None
+                    elif name.endswith(".ndjson") and name[:-len(".ndjson")] in SECTIONS[1:]:
+                        section = name[:-len(".ndjson")]
+                        where = (lambda number, name=name: f"{name} 第{number}行")
+                        for number, record in self._parse_lines(data, where):
+                            yield section, record, where(number)
+                    else:
+                        raise ValueError(f"{name}: 未知的文件")
+            except tarfile.TarError as e:
+                raise ValueError(f"tar文件损坏: {e}")
+        if pending is not None:
+            raise ValueError("最后一条笔记缺少正文")
+        if not manifest_seen:
+            raise ValueError("缺少 manifest.json")
+
+    def _load_member(self, data, name):
+        try:
+            return json_codec.loads(data.read())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ValueError(f"{name}: JSON格式无效")